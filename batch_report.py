@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+
+import cvt_data
+import incidence
+import render_cache
+import series_store
+
+'''
+Headless batch reports of the cross-species overlays.
+
+For every species pair (or the pairs given with --pairs) and both matrices, the
+chemicals with ≥2 points in both species are drawn as overlay subplots
+(render_cache.plot_curves, light print style), ROWS × COLS per page, into
+
+  pdf    <out>/<role>/<species1>__<species2>.pdf        one multi-page PDF per pair
+  html   <out>/<role>/<species1>__<species2>/page_NNN.png plus <out>/index.html
+
+Pairs run in parallel on a ProcessPoolExecutor; each worker opens its own DB
+connection and draws on standalone Agg figures. <out>/manifest.json records a
+fingerprint per report (data version, chemical list, layout, format), and a
+rerun skips every report whose fingerprint and output file are unchanged. An
+output the manifest stops listing (written in the other format, or a pair that
+no longer has shared chemicals) is deleted.
+
+  python batch_report.py --pairs mouse:rat human:rat --format html
+'''
+
+DB_PATH        = "cvt_db_20210607.sqlite"
+OUT_DIR        = "reports"
+ROWS           = 4
+COLS           = 3
+REPORT_VERSION = 1
+ROLE_LABELS    = {"administered": "Administered Drugs", "analyte": "Metabolites"}
+COLORS         = ("tab:blue", "tab:orange")
+
+
+def report_path(out_dir, role, species1, species2, fmt):
+    base = os.path.join(out_dir, role, f"{species1}__{species2}".replace(" ", "_"))
+    return f"{base}.pdf" if fmt == "pdf" else base
+
+
+def remove_output(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def all_pairs(species):
+    return [(a, b) for i, a in enumerate(species) for b in species[i + 1:]]
+
+
+def fingerprint(db_path, role, species1, species2, chems, fmt, rows, cols):
+    raw = json.dumps([REPORT_VERSION, cvt_data.data_version(db_path), role, species1, species2,
+                      sorted(chems), fmt, rows, cols, render_cache.PRINT_STYLE], default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def plan(db_path, matrix_dir, pairs, roles, fmt, rows, cols):
+    # one job per (role, pair) with the chemicals that have data for both species
+    jobs = []
+    with cvt_data.connection(db_path) as conn:
+        for role in roles:
+            matrix = incidence.load_incidence(matrix_dir, role)
+            for sp1, sp2 in pairs or all_pairs(matrix.species):
+                shared = matrix.shared(sp1, sp2)
+                if not shared:
+                    continue
+                best = cvt_data.best_series_bulk(conn, (sp1, sp2), shared, role)
+                chems = cvt_data.available_for_pair(best, sp1, sp2, shared)
+                if chems:
+                    jobs.append({"role": role, "species": (sp1, sp2), "chems": chems,
+                                 "fingerprint": fingerprint(db_path, role, sp1, sp2, chems,
+                                                            fmt, rows, cols)})
+    return jobs
+
+
+# ——— DRAWING (runs in the worker processes) ———
+def _pages(db_path, role, species, chems, rows, cols):
+    store = series_store.open_store(db_path)
+    style = render_cache.PRINT_STYLE
+    per_page = rows * cols
+    n_pages = -(-len(chems) // per_page)
+    with cvt_data.connection(db_path) as conn:
+        for page in range(n_pages):
+            fig = Figure(figsize=(cols * 4, rows * 3), dpi=style["dpi"], layout="constrained")
+            fig.patch.set_facecolor(style["figure_bg"])
+            fig.suptitle(f"{ROLE_LABELS[role]}: {species[0]} vs {species[1]} "
+                         f"(page {page + 1}/{n_pages})")
+            axes = fig.subplots(rows, cols, squeeze=False).ravel()
+            for ax, chem in zip(axes, chems[page * per_page:(page + 1) * per_page]):
+                curves = [(sp.capitalize(), color,
+                           cvt_data.get_best_series_and_data(conn, sp, chem, role, store=store))
+                          for sp, color in zip(species, COLORS)]
+                render_cache.plot_curves(ax, chem, [c for c in curves if c[2] is not None], style)
+            for ax in axes[len(chems) - page * per_page:]:
+                ax.set_visible(False)
+            yield fig
+
+
+def write_report(db_path, job, out_dir, fmt, rows, cols):
+    path = report_path(out_dir, job["role"], *job["species"], fmt)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pages = _pages(db_path, job["role"], job["species"], job["chems"], rows, cols)
+    n_pages = 0
+    if fmt == "pdf":
+        with PdfPages(tmp) as pdf:
+            for fig in pages:
+                pdf.savefig(fig, facecolor=fig.get_facecolor())
+                n_pages += 1
+    else:
+        os.makedirs(tmp, exist_ok=True)
+        for fig in pages:
+            n_pages += 1
+            fig.savefig(os.path.join(tmp, f"page_{n_pages:03d}.png"), facecolor=fig.get_facecolor())
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+    os.replace(tmp, path)
+    return path, n_pages
+
+
+# ——— MANIFEST & INDEX ———
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    tmp = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(out_dir, "manifest.json"))
+
+
+def write_index(out_dir, manifest):
+    # HTML gallery over every report in the manifest, PNG pages inline
+    parts = ["<!doctype html><meta charset='utf-8'><title>Cross-species reports</title>",
+             "<style>body{font-family:sans-serif} img{max-width:100%}</style>"]
+    for role, label in ROLE_LABELS.items():
+        entries = sorted((k, v) for k, v in manifest.items() if v["role"] == role)
+        if not entries:
+            continue
+        parts.append(f"<h1>{label}</h1>")
+        for _, entry in entries:
+            rel = os.path.relpath(entry["path"], out_dir)
+            title = html.escape(f"{entry['species'][0]} vs {entry['species'][1]} "
+                                f"({entry['n_chems']} chemicals)")
+            if rel.endswith(".pdf"):
+                parts.append(f"<h2><a href='{html.escape(rel)}'>{title}</a></h2>")
+                continue
+            parts.append(f"<h2>{title}</h2>")
+            parts += [f"<img src='{html.escape(rel)}/page_{i:03d}.png' loading='lazy'>"
+                      for i in range(1, entry["n_pages"] + 1)]
+    with open(os.path.join(out_dir, "index.html"), "w") as f:
+        f.write("\n".join(parts))
+
+
+def run(db_path=DB_PATH, matrix_dir=incidence.INCIDENCE_DIR, out_dir=OUT_DIR, pairs=None,
+        roles=cvt_data.ROLES, fmt="pdf", rows=ROWS, cols=COLS, max_workers=None, force=False):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    jobs = plan(db_path, matrix_dir, pairs, roles, fmt, rows, cols)
+    keys = {f"{job['role']}/{job['species'][0]}__{job['species'][1]}" for job in jobs}
+    # reports this run covers but no longer plans: their pair lost its shared chemicals
+    for key, entry in list(manifest.items()):
+        if (key not in keys and entry["role"] in roles
+                and (not pairs or tuple(entry["species"]) in pairs)):
+            remove_output(entry["path"])
+            del manifest[key]
+            print(f"  {key}: removed, no shared chemicals")
+    save_manifest(out_dir, manifest)
+
+    todo = []
+    for job in jobs:
+        key = f"{job['role']}/{job['species'][0]}__{job['species'][1]}"
+        done = manifest.get(key)
+        if (not force and done and done["fingerprint"] == job["fingerprint"]
+                and os.path.exists(done["path"])):
+            continue
+        todo.append((key, job))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(write_report, db_path, job, out_dir, fmt, rows, cols): (key, job)
+                   for key, job in todo}
+        for fut in as_completed(futures):
+            key, job = futures[fut]
+            path, n_pages = fut.result()
+            old = manifest.get(key)
+            if old and old["path"] != path:
+                remove_output(old["path"])     # the previous --format's output
+            manifest[key] = {"role": job["role"], "species": list(job["species"]),
+                             "fingerprint": job["fingerprint"], "path": path, "format": fmt,
+                             "n_chems": len(job["chems"]), "n_pages": n_pages}
+            save_manifest(out_dir, manifest)   # after every report, so an interrupted run keeps its progress
+            print(f"  {key}: {len(job['chems'])} chemicals, {n_pages} pages → {path}")
+    write_index(out_dir, manifest)
+    return len(jobs) - len(todo), len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write overlay reports for every species pair, headless.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--matrices", default=incidence.INCIDENCE_DIR, help="incidence store directory")
+    parser.add_argument("--out", default=OUT_DIR, help="report directory")
+    parser.add_argument("--pairs", nargs="+", metavar="SP1:SP2",
+                        help="species pairs, e.g. mouse:rat (default: every pair)")
+    parser.add_argument("--roles", nargs="+", default=list(cvt_data.ROLES), choices=cvt_data.ROLES)
+    parser.add_argument("--format", default="pdf", choices=["pdf", "html"])
+    parser.add_argument("--rows", type=int, default=ROWS, help="subplot rows per page")
+    parser.add_argument("--cols", type=int, default=COLS, help="subplot columns per page")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="redraw reports even if unchanged")
+    args = parser.parse_args()
+
+    pairs = None
+    if args.pairs:
+        pairs = [tuple(p.split(":", 1)) for p in args.pairs]
+        if any(len(p) != 2 for p in pairs):
+            parser.error("pairs are written SPECIES1:SPECIES2")
+
+    t0 = time.perf_counter()
+    n_skipped, n_written = run(args.db, args.matrices, args.out, pairs, args.roles, args.format,
+                               args.rows, args.cols, args.workers, args.force)
+    print(f"Wrote {n_written} reports ({n_skipped} unchanged) in {time.perf_counter() - t0:.1f}s "
+          f"→ '{os.path.join(args.out, 'index.html')}'")
+
+
+if __name__ == "__main__":
+    main()
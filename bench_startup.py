@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+'''
+Startup benchmark for the Streamlit explorer.
+
+Every measurement runs the app in a fresh interpreter (via Streamlit's AppTest,
+no browser or server), so module imports and caches are cold:
+
+  first widget   time from the start of the script run to the first widget
+                 call (the species selectbox in the sidebar)
+  cold run       the whole first script run
+  warm rerun     a second run in the same process (st.cache_* warm)
+  imports        modules imported during the first run, with the heaviest
+                 top-level ones from python -X importtime
+
+Run it from the directory that holds the DB, e.g.
+  python bench_startup.py pkpd_app3.py --budget 1.5 >> bench_output.txt
+and it exits non-zero when the median time to first widget is over budget.
+'''
+
+DEFAULT_APP = "pkpd_app3.py"
+REPEATS     = 3
+TOP_IMPORTS = 10
+
+# Runs in the child interpreter; prints one JSON line after a marker on stderr
+_CHILD = r"""
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+from streamlit.delta_generator import DeltaGenerator
+from streamlit.testing.v1 import AppTest
+
+marks = {{}}
+_selectbox = DeltaGenerator.selectbox
+def selectbox(self, *args, **kwargs):
+    marks.setdefault("first_widget", time.perf_counter())
+    return _selectbox(self, *args, **kwargs)
+DeltaGenerator.selectbox = selectbox
+
+at = AppTest.from_file({app!r}, default_timeout=120)
+before = set(sys.modules)
+print("-- run --", file=sys.stderr, flush=True)
+t0 = time.perf_counter()
+at.run()
+t1 = time.perf_counter()
+n_imported = len(set(sys.modules) - before)
+at.run()
+t2 = time.perf_counter()
+print(json.dumps({{
+    "first_widget": marks.get("first_widget", t1) - t0,
+    "cold_run":     t1 - t0,
+    "warm_rerun":   t2 - t1,
+    "n_imported":   n_imported,
+    "exceptions":   [e.value for e in at.exception],
+}}))
+"""
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def _top_level_imports(stderr):
+    # importtime lines after the run marker, outermost imports only
+    lines = stderr.split("-- run --", 1)[-1].splitlines()
+    rows = [m.groups() for m in map(_IMPORTTIME.match, lines) if m]
+    if not rows:
+        return []
+    depth = min(len(indent) for _, _, indent, _ in rows)
+    top = [(name, int(cum) / 1e6) for _, cum, indent, name in rows if len(indent) == depth]
+    return sorted(top, key=lambda r: -r[1])
+
+
+def measure(app):
+    code = _CHILD.format(app=os.path.abspath(app), app_dir=os.path.dirname(os.path.abspath(app)))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = _top_level_imports(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of a Streamlit app.")
+    parser.add_argument("app", nargs="?", default=DEFAULT_APP)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--budget", type=float, help="fail if median time to first widget exceeds this (s)")
+    args = parser.parse_args()
+
+    runs = [measure(args.app) for _ in range(args.repeats)]
+    median = lambda key: sorted(r[key] for r in runs)[len(runs) // 2]
+
+    print(f"{args.app}: {args.repeats} cold starts")
+    print(f"  first widget   {median('first_widget'):7.3f}s")
+    print(f"  cold run       {median('cold_run'):7.3f}s")
+    print(f"  warm rerun     {median('warm_rerun'):7.3f}s")
+    print(f"  modules        {runs[-1]['n_imported']} imported during the first run")
+    for name, seconds in runs[-1]["imports"][:TOP_IMPORTS]:
+        print(f"    {name:<28} {seconds:7.3f}s")
+    if runs[-1]["exceptions"]:
+        print(f"  exceptions     {runs[-1]['exceptions']}")
+
+    if args.budget is not None and median("first_widget") > args.budget:
+        print(f"FAIL: first widget {median('first_widget'):.3f}s > budget {args.budget:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+import best_series_index
+import cvt_data
+import export_shared_matrices
+import incidence
+import render_cache
+import series_store
+import synth_db
+
+'''
+Benchmark suite over synthetic CvT databases.
+
+For every requested scale (synth_db.PRESETS) a database is generated once under
+--workdir and reused by later runs; then each step below is timed (median of
+--repeats) and the results are printed as one table, scales as columns:
+
+  build index          best_series_index.build_index (offline, one-time)
+  convert store        series_store.convert (offline, one-time)
+  export matrices      export_matrices → incidence store, and with the CSVs too
+  load matrices        incidence.load_incidence for both roles + one intersection
+  availability         best_series_bulk + available_for_pair, per species pair
+  best series (sql)    get_best_series_and_data without the columnar store, per call
+  best series (store)  the same through the memory-mapped store, per call
+  render tile          render_cache.render_tile for a two-species overlay, per tile
+
+--save writes the numbers as JSON; --compare prints a previous run next to the
+current one with the speed-up, so an optimization can be checked objectively:
+
+  python bench_suite.py --scales small medium --save before.json
+  ... change something ...
+  python bench_suite.py --scales small medium --compare before.json
+'''
+
+WORKDIR  = "bench_data"
+REPEATS  = 3
+N_CALLS  = 200
+N_TILES  = 10
+
+
+def _median_time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def _database(workdir, scale, regenerate):
+    path = os.path.join(workdir, f"{scale}.sqlite")
+    if regenerate or not os.path.exists(path):
+        os.makedirs(workdir, exist_ok=True)
+        synth_db.generate(path, **synth_db.PRESETS[scale])
+    return path
+
+
+def run_scale(db_path, repeats=REPEATS, seed=0):
+    rng = random.Random(seed)
+    results = {}
+    matrix_dir = os.path.splitext(db_path)[0] + ".matrices"
+    csv_base   = os.path.splitext(db_path)[0]
+
+    results["build index"]   = _median_time(lambda: best_series_index.build_index(db_path), repeats)
+    results["convert store"] = _median_time(lambda: series_store.convert(db_path), repeats)
+    results["export matrices"] = _median_time(
+        lambda: export_shared_matrices.export_matrices(db_path, matrix_dir), repeats)
+    results["export matrices + csv"] = _median_time(
+        lambda: export_shared_matrices.export_matrices(
+            db_path, matrix_dir, f"{csv_base}.admin.csv", f"{csv_base}.metab.csv"), repeats)
+
+    def load_matrices():
+        admin = incidence.load_incidence(matrix_dir, "administered")
+        metab = incidence.load_incidence(matrix_dir, "analyte")
+        admin.shared(*admin.species[:2])
+        metab.shared(*metab.species[:2])
+        return admin, metab
+    results["load matrices"] = _median_time(load_matrices, repeats)
+
+    admin, _ = load_matrices()
+    pairs = [(a, b) for i, a in enumerate(admin.species) for b in admin.species[i + 1:]]
+    conn  = cvt_data.connect(db_path)
+    store = series_store.open_store(db_path)
+
+    def availability():
+        found = []
+        for sp1, sp2 in pairs:
+            shared = admin.shared(sp1, sp2)
+            best = cvt_data.best_series_bulk(conn, (sp1, sp2), shared, "administered")
+            found += [(sp, chem) for chem in cvt_data.available_for_pair(best, sp1, sp2, shared)
+                      for sp in (sp1, sp2)]
+        return found
+    results["availability (per pair)"] = _median_time(availability, repeats) / max(len(pairs), 1)
+
+    candidates = availability()
+    calls = [rng.choice(candidates) for _ in range(N_CALLS)] if candidates else []
+    for label, st in (("best series (sql)", None), ("best series (store)", store)):
+        results[label] = _median_time(lambda: [
+            cvt_data.get_best_series_and_data(conn, sp, chem, "administered", store=st)
+            for sp, chem in calls
+        ], repeats) / max(len(calls), 1)
+
+    tiles = []
+    for sp, chem in calls[:N_TILES]:
+        other = next((s for s in admin.species if s != sp), sp)
+        tiles.append((chem, [
+            (sp, "#1f77b4", cvt_data.get_best_series_and_data(conn, sp, chem, store=store)),
+            (other, "#ff7f0e", cvt_data.get_best_series_and_data(conn, other, chem, store=store)),
+        ]))
+    tiles = [(chem, [c for c in curves if c[2] is not None]) for chem, curves in tiles]
+    results["render tile"] = _median_time(
+        lambda: [render_cache.render_tile(chem, curves) for chem, curves in tiles], repeats
+    ) / max(len(tiles), 1)
+    conn.close()
+    return results
+
+
+def _fmt(seconds):
+    if seconds is None:
+        return "—"
+    return f"{seconds * 1e3:.2f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+def print_table(results, sizes, baseline=None):
+    scales = list(results)
+    steps  = list(dict.fromkeys(step for r in results.values() for step in r))
+    width  = max(len(s) for s in steps) + 2
+    cols = []
+    for scale in scales:
+        cols.append(scale)
+        if baseline:
+            cols += [f"{scale} (before)", "speed-up"]
+    colw = max(14, *(len(c) + 2 for c in cols))
+
+    print("".ljust(width) + "".join(c.rjust(colw) for c in cols))
+    print("series / points".ljust(width) + "".join(
+        (f"{sizes[s]['series']}/{sizes[s]['points']}".rjust(colw)
+         + ("".rjust(colw) * 2 if baseline else "")) for s in scales))
+    for step in steps:
+        row = step.ljust(width)
+        for scale in scales:
+            now = results[scale].get(step)
+            row += _fmt(now).rjust(colw)
+            if baseline:
+                before = baseline.get(scale, {}).get(step)
+                row += _fmt(before).rjust(colw)
+                row += (f"{before / now:.2f}×" if before and now else "—").rjust(colw)
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the data paths on synthetic CvT databases.")
+    parser.add_argument("--scales", nargs="+", default=["tiny", "small"], choices=synth_db.PRESETS)
+    parser.add_argument("--workdir", default=WORKDIR, help="where generated DBs and their sidecars live")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the synthetic DBs")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON from an earlier --save to compare against")
+    args = parser.parse_args()
+
+    results, sizes = {}, {}
+    for scale in args.scales:
+        t0 = time.perf_counter()
+        db_path = _database(args.workdir, scale, args.regenerate)
+        conn = cvt_data.connect(db_path)
+        sizes[scale] = {
+            "series": conn.execute("SELECT COUNT(*) FROM series").fetchone()[0],
+            "points": conn.execute("SELECT COUNT(*) FROM conc_time_values").fetchone()[0],
+        }
+        conn.close()
+        results[scale] = run_scale(db_path, args.repeats)
+        print(f"[{scale}] done in {time.perf_counter() - t0:.1f}s")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print()
+    print_table(results, sizes, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"sizes": sizes, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
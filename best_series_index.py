@@ -0,0 +1,302 @@
+import argparse
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows: only threads of one process are serialized
+    fcntl = None
+
+'''
+Offline indexer for the CvT database.
+
+Materializes a sidecar SQLite file next to the source DB
+(cvt_db_20210607.sqlite → cvt_db_20210607.index.sqlite) holding:
+
+  conc_time(fk_series_id, time_hr, conc, valid, blank)
+  series_stats(series_id, species_norm, test_substance_dtxsid, analyte_dtxsid,
+               n_pts, n_valid_pts, n_nonblank_pts)
+  best_series(species_norm, dtxsid, role, series_id, n_valid_pts)
+
+conc_time is the one-time numeric migration of conc_time_values: time_hr and
+conc are REAL (NULL where the text does not parse as a number), valid flags rows
+where both parse and blank rows where either is empty text. The partial index
+conc_time_valid on (fk_series_id, time_hr, conc, valid) covers reading a
+series' valid points in time order, so readers never coerce strings at query
+time.
+
+role is "administered" (series.test_substance_dtxsid) or "analyte"
+(series.analyte_dtxsid). n_valid_pts counts valid rows, and the best series is
+the one with the most of them.
+
+The sidecar records the source file's size and mtime and is rebuilt whenever
+they change, so callers just go through ensure_index(). Rebuilds are serialized
+across threads (a lock per output path) and processes (a .lock file next to
+it), and each build writes its own temp file, so concurrent sessions never
+clobber one another's half-built index. The other sidecar builders (search,
+curve features, cohort) go through the same ensure_built() / atomic_output().
+'''
+
+DB_PATH        = "cvt_db_20210607.sqlite"
+INDEX_VERSION  = "2"
+ROLE_COLUMNS   = {
+    "administered": "test_substance_dtxsid",
+    "analyte":      "analyte_dtxsid",
+}
+
+SCHEMA_SQL = """
+    CREATE TABLE index_meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE conc_time (
+        fk_series_id INTEGER NOT NULL,
+        time_hr      REAL,
+        conc         REAL,
+        valid        INTEGER NOT NULL,
+        blank        INTEGER NOT NULL
+    );
+    CREATE TABLE series_stats (
+        series_id             INTEGER PRIMARY KEY,
+        species_norm          TEXT,
+        test_substance_dtxsid TEXT,
+        analyte_dtxsid        TEXT,
+        n_pts                 INTEGER NOT NULL,
+        n_valid_pts           INTEGER NOT NULL,
+        n_nonblank_pts        INTEGER NOT NULL
+    );
+    CREATE TABLE best_series (
+        species_norm TEXT    NOT NULL,
+        dtxsid       TEXT    NOT NULL,
+        role         TEXT    NOT NULL,
+        series_id    INTEGER NOT NULL,
+        n_valid_pts  INTEGER NOT NULL,
+        PRIMARY KEY (species_norm, dtxsid, role)
+    ) WITHOUT ROWID;
+"""
+
+# Blank = empty after stripping whitespace, same as .astype(str).str.strip().eq('')
+_WS = "char(32, 9, 10, 11, 12, 13)"
+
+CONC_TIME_SQL = f"""
+    INSERT INTO idx.conc_time
+    SELECT fk_series_id, time_hr, conc,
+           time_hr IS NOT NULL AND conc IS NOT NULL,
+           is_blank_time OR is_blank_conc
+      FROM (
+        SELECT CAST(fk_series_id AS INTEGER)  AS fk_series_id,
+               to_real(time_hr)               AS time_hr,
+               to_real(conc)                  AS conc,
+               COALESCE(TRIM(time_hr, {_WS}) = '', 0) AS is_blank_time,
+               COALESCE(TRIM(conc,    {_WS}) = '', 0) AS is_blank_conc
+          FROM conc_time_values
+         WHERE fk_series_id IS NOT NULL
+      )
+"""
+
+CONC_TIME_INDEX_SQL = """
+    CREATE INDEX conc_time_valid ON conc_time(fk_series_id, time_hr, conc, valid) WHERE valid
+"""
+
+SERIES_STATS_SQL = """
+    INSERT INTO idx.series_stats
+    WITH pts AS (
+        SELECT fk_series_id,
+               COUNT(*)         AS n_pts,
+               SUM(valid)       AS n_valid_pts,
+               SUM(NOT blank)   AS n_nonblank_pts
+          FROM idx.conc_time
+         GROUP BY fk_series_id
+    )
+    SELECT r.id,
+           LOWER(TRIM(s.species)),
+           r.test_substance_dtxsid,
+           r.analyte_dtxsid,
+           COALESCE(pts.n_pts, 0),
+           COALESCE(pts.n_valid_pts, 0),
+           COALESCE(pts.n_nonblank_pts, 0)
+      FROM series AS r
+      JOIN subjects AS s ON r.fk_subject_id = s.id
+      LEFT JOIN pts ON pts.fk_series_id = r.id
+"""
+
+BEST_SERIES_SQL = """
+    INSERT INTO best_series (species_norm, dtxsid, role, series_id, n_valid_pts)
+    SELECT species_norm, dtxsid, role, series_id, n_valid_pts
+      FROM (
+        SELECT species_norm, {column} AS dtxsid, ? AS role, series_id, n_valid_pts,
+               ROW_NUMBER() OVER (
+                   PARTITION BY species_norm, {column}
+                   ORDER BY n_valid_pts DESC, n_pts DESC, series_id
+               ) AS rank
+          FROM series_stats
+         WHERE {column} IS NOT NULL AND species_norm IS NOT NULL
+      )
+     WHERE rank = 1
+"""
+
+
+def _to_real(value):
+    # Same rule as pd.to_numeric(errors="coerce"): None for anything that is not a number
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+# ——— PATHS & FRESHNESS ———
+def index_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".index.sqlite"
+
+
+def source_signature(db_path):
+    st = os.stat(db_path)
+    return {"source_size": str(st.st_size), "source_mtime_ns": str(st.st_mtime_ns)}
+
+
+def is_fresh(db_path, index_path=None):
+    index_path = index_path or index_path_for(db_path)
+    if not os.path.exists(index_path):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM index_meta"))
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+    expected = dict(source_signature(db_path), index_version=INDEX_VERSION)
+    return all(meta.get(k) == v for k, v in expected.items())
+
+
+# ——— ATOMIC SIDECAR BUILDS ———
+_path_locks      = {}
+_path_locks_lock = threading.Lock()
+
+
+@contextmanager
+def build_lock(path):
+    # one build of `path` at a time: threads via a per-path lock (so building one sidecar
+    # can still ensure another), processes via an flock'd file next to it
+    with _path_locks_lock:
+        lock = _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock, open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def ensure_built(path, is_fresh, build):
+    # build() unless is_fresh(); re-checked under the lock, since another thread or
+    # process may have rebuilt it while we waited
+    if not is_fresh():
+        with build_lock(path):
+            if not is_fresh():
+                build()
+    return path
+
+
+@contextmanager
+def atomic_output(path, directory=False):
+    # yields a private temp file (or directory) next to `path`, swapped in when the
+    # block succeeds and removed when it fails, so readers never see a partial build
+    parent, prefix = os.path.dirname(os.path.abspath(path)), os.path.basename(path) + "."
+    if directory:
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix=prefix, suffix=".tmp")
+        os.chmod(tmp_path, 0o755)
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=parent, prefix=prefix, suffix=".tmp")
+        os.close(fd)
+        os.chmod(tmp_path, 0o644)
+    try:
+        yield tmp_path
+        if directory:
+            shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    finally:
+        if directory:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# ——— BUILD ———
+def build_index(db_path, index_path=None):
+    index_path = index_path or index_path_for(db_path)
+    with atomic_output(index_path) as tmp_path:
+        _build_into(db_path, tmp_path, source_signature(db_path))
+    return index_path
+
+
+def _build_into(db_path, tmp_path, signature):
+    out = sqlite3.connect(tmp_path)
+    out.executescript(SCHEMA_SQL)
+    out.close()
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.create_function("to_real", 1, _to_real, deterministic=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS idx", (tmp_path,))
+        with conn:
+            conn.execute(CONC_TIME_SQL)
+            conn.execute(SERIES_STATS_SQL)
+        conn.execute("DETACH DATABASE idx")
+    finally:
+        conn.close()
+
+    out = sqlite3.connect(tmp_path)
+    with out:
+        out.execute(CONC_TIME_INDEX_SQL)
+        for role, column in ROLE_COLUMNS.items():
+            out.execute(BEST_SERIES_SQL.format(column=column), (role,))
+        out.executemany(
+            "INSERT INTO index_meta (key, value) VALUES (?, ?)",
+            [*signature.items(),
+             ("index_version", INDEX_VERSION),
+             ("source_path", os.path.abspath(db_path))],
+        )
+    out.execute("ANALYZE")
+    out.close()
+
+
+def ensure_index(db_path, index_path=None):
+    index_path = index_path or index_path_for(db_path)
+    return ensure_built(index_path, lambda: is_fresh(db_path, index_path),
+                        lambda: build_index(db_path, index_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the typed-values and best-series index for a CvT database.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--out", help="index file (default: <db>.index.sqlite)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the index is fresh")
+    args = parser.parse_args()
+
+    index_path = args.out or index_path_for(args.db)
+    if not args.force and is_fresh(args.db, index_path):
+        print(f"Index '{index_path}' is up to date")
+        return
+
+    t0 = time.perf_counter()
+    build_index(args.db, index_path)
+    conn = sqlite3.connect(index_path)
+    n_pts, n_valid = conn.execute("SELECT COUNT(*), COALESCE(SUM(valid), 0) FROM conc_time").fetchone()
+    n_series = conn.execute("SELECT COUNT(*) FROM series_stats").fetchone()[0]
+    n_best   = conn.execute("SELECT COUNT(*) FROM best_series").fetchone()[0]
+    conn.close()
+    print(f"Migrated {n_pts} points ({n_valid} valid) and indexed {n_series} series into "
+          f"{n_best} best-series rows in '{index_path}' ({time.perf_counter() - t0:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import best_series_index
+
+'''
+Type-ahead chemical search.
+
+A sidecar SQLite file next to the source DB (cvt_db_20210607.sqlite →
+cvt_db_20210607.search.sqlite) holds every name a chemical is known by:
+
+  terms(dtxsid, term, term_lower, kind)   kind: dtxsid | cas | name
+  terms_fts                               FTS5 trigram index over terms.term
+  labels(dtxsid, label)                   display name for pickers
+
+Terms come from series (test_substance_dtxsid, analyte_dtxsid, analyte_casrn,
+analyte_name_original) and, when chemical_data.sqlite is there, the inventory's
+CAS and name columns. search() is case-insensitive and ranks, in order:
+
+  1. substring hits (FTS5 trigram phrase), exact and prefix matches first
+  2. if there are none, fuzzy hits sharing trigrams with the query (typos), by bm25
+  3. for queries under three characters, a prefix range scan on term_lower
+
+`within` restricts hits to a chemical list (e.g. a species pair's shared
+chemicals) inside the same query, so nothing is filtered after the LIMIT.
+The sidecar is rebuilt when the source DB or the inventory file changes.
+'''
+
+DB_PATH       = "cvt_db_20210607.sqlite"
+INVENTORY_DB  = "chemical_data.sqlite"
+INDEX_VERSION = "1"
+LIMIT         = 20
+INVENTORY_COLUMNS = {
+    "cas":  ("Curated CAS", "CASRN"),
+    "name": ("Preferred Name", "PREFERRED_NAME", "Chemical Name"),
+}
+
+SCHEMA_SQL = """
+    CREATE TABLE search_meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE terms (
+        dtxsid     TEXT NOT NULL,
+        term       TEXT NOT NULL,
+        term_lower TEXT NOT NULL,
+        kind       TEXT NOT NULL
+    );
+    CREATE TABLE labels (
+        dtxsid TEXT PRIMARY KEY,
+        label  TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE VIRTUAL TABLE terms_fts USING fts5(
+        term, content='terms', content_rowid='rowid', tokenize='trigram'
+    );
+"""
+
+SERIES_TERMS_SQL = """
+    SELECT test_substance_dtxsid, test_substance_dtxsid, 'dtxsid' FROM series
+     UNION SELECT analyte_dtxsid, analyte_dtxsid,        'dtxsid' FROM series
+     UNION SELECT analyte_dtxsid, analyte_casrn,         'cas'    FROM series
+     UNION SELECT analyte_dtxsid, analyte_name_original, 'name'   FROM series
+"""
+
+# most frequent original name per chemical, for the label
+SERIES_LABELS_SQL = """
+    SELECT analyte_dtxsid, analyte_name_original, COUNT(*) AS n
+      FROM series
+     WHERE analyte_dtxsid IS NOT NULL AND TRIM(COALESCE(analyte_name_original, '')) != ''
+     GROUP BY analyte_dtxsid, analyte_name_original
+     ORDER BY analyte_dtxsid, n DESC
+"""
+
+_WITHIN = "AND (?1 IS NULL OR t.dtxsid IN (SELECT value FROM json_each(?1)))"
+
+SUBSTRING_SQL = f"""
+    SELECT t.dtxsid, t.term
+      FROM terms_fts AS f
+      JOIN terms     AS t ON t.rowid = f.rowid
+     WHERE terms_fts MATCH ?2 {_WITHIN}
+     ORDER BY t.term_lower = ?3 DESC, substr(t.term_lower, 1, length(?3)) = ?3 DESC, length(t.term)
+     LIMIT ?4
+"""
+
+FUZZY_SQL = f"""
+    SELECT t.dtxsid, t.term
+      FROM terms_fts AS f
+      JOIN terms     AS t ON t.rowid = f.rowid
+     WHERE terms_fts MATCH ?2 {_WITHIN}
+     ORDER BY bm25(terms_fts)
+     LIMIT ?4
+"""
+
+PREFIX_SQL = f"""
+    SELECT t.dtxsid, t.term
+      FROM terms AS t
+     WHERE t.term_lower >= ?2 AND t.term_lower < ?3 {_WITHIN}
+     ORDER BY length(t.term)
+     LIMIT ?4
+"""
+
+
+def search_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".search.sqlite"
+
+
+def _signature(db_path, inventory_db):
+    sig = dict(best_series_index.source_signature(db_path), index_version=INDEX_VERSION)
+    if inventory_db and os.path.exists(inventory_db):
+        sig["inventory_mtime_ns"] = str(os.stat(inventory_db).st_mtime_ns)
+    return sig
+
+
+def _inventory_terms(inventory_db):
+    # (dtxsid, term, kind) from whichever known CAS / name columns the inventory has
+    conn = sqlite3.connect(f"file:{os.path.abspath(inventory_db)}?mode=ro", uri=True)
+    try:
+        import tox_data     # table layout; imported here since it pulls in pandas, needed only on rebuild
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({tox_data.TABLE_NAME})")}
+        for kind, candidates in INVENTORY_COLUMNS.items():
+            for col in (c for c in candidates if c in columns):
+                yield from conn.execute(
+                    f'SELECT DISTINCT {tox_data.KEY_COLUMN}, "{col}", ? FROM {tox_data.TABLE_NAME} '
+                    f'WHERE {tox_data.KEY_COLUMN} IS NOT NULL', (kind,))
+    except sqlite3.DatabaseError:
+        return
+    finally:
+        conn.close()
+
+
+# ——— BUILD ———
+def build(db_path, path=None, inventory_db=INVENTORY_DB):
+    path = path or search_path_for(db_path)
+    src = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        rows = src.execute(SERIES_TERMS_SQL).fetchall()
+        named = {}
+        for dtxsid, name, _ in src.execute(SERIES_LABELS_SQL):
+            named.setdefault(dtxsid, name.strip())
+    finally:
+        src.close()
+    if inventory_db and os.path.exists(inventory_db):
+        inventory_rows = list(_inventory_terms(inventory_db))
+        rows += inventory_rows
+        # an inventory's preferred name beats free-text names from the studies
+        named.update({d: t.strip() for d, t, kind in inventory_rows if kind == "name" and t and t.strip()})
+
+    terms = {(d, t.strip(), kind) for d, t, kind in rows if d and t and t.strip()}
+    with best_series_index.atomic_output(path) as tmp_path:
+        out = sqlite3.connect(tmp_path)
+        try:
+            out.executescript(SCHEMA_SQL)
+            with out:
+                out.executemany("INSERT INTO terms VALUES (?, ?, ?, ?)",
+                                sorted((d, t, t.lower(), kind) for d, t, kind in terms))
+                out.execute("CREATE INDEX terms_lower ON terms(term_lower)")
+                out.execute("INSERT INTO terms_fts(terms_fts) VALUES ('rebuild')")
+                out.executemany("INSERT INTO labels VALUES (?, ?)",
+                                ((d, named.get(d, d)) for d in sorted({d for d, _, _ in terms})))
+                out.executemany("INSERT INTO search_meta VALUES (?, ?)",
+                                _signature(db_path, inventory_db).items())
+        finally:
+            out.close()
+    return path
+
+
+def is_fresh(db_path, path=None, inventory_db=INVENTORY_DB):
+    path = path or search_path_for(db_path)
+    if not os.path.exists(path):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM search_meta"))
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+    return meta == _signature(db_path, inventory_db)
+
+
+def ensure_index(db_path, path=None, inventory_db=INVENTORY_DB):
+    path = path or search_path_for(db_path)
+    best_series_index.ensure_built(path, lambda: is_fresh(db_path, path, inventory_db),
+                                   lambda: build(db_path, path, inventory_db))
+    return ChemicalSearch(path)
+
+
+# ——— QUERY ———
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+class ChemicalSearch:
+    def __init__(self, path):
+        self.path   = path
+        self._conn  = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True,
+                                      check_same_thread=False)
+        self._lock  = threading.Lock()      # one connection, shared by every session thread
+        self.labels = dict(self._conn.execute("SELECT dtxsid, label FROM labels"))
+
+    def label(self, dtxsid):
+        name = self.labels.get(dtxsid, dtxsid)
+        return dtxsid if name == dtxsid else f"{name} ({dtxsid})"
+
+    def search(self, query, limit=LIMIT, within=None):
+        # [(dtxsid, matched term)], best first, one entry per chemical
+        q = " ".join(query.split()).lower()
+        if not q:
+            return []
+        within = json.dumps(list(within)) if within is not None else None
+        hits = {}
+
+        def collect(sql, *params):
+            for dtxsid, term in self._conn.execute(sql, (within, *params, limit * 4)):
+                if len(hits) >= limit:
+                    break
+                hits.setdefault(dtxsid, term)
+
+        with self._lock:
+            if len(q) < 3:
+                collect(PREFIX_SQL, q, q[:-1] + chr(ord(q[-1]) + 1))
+                return list(hits.items())
+            collect(SUBSTRING_SQL, _phrase(q), q)
+            if not hits:
+                trigrams = sorted({q[i:i + 3] for i in range(len(q) - 2)})
+                collect(FUZZY_SQL, " OR ".join(map(_phrase, trigrams)), None)
+        return list(hits.items())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chemical search index, or search it.")
+    parser.add_argument("query", nargs="*", help="text to search for (name, CAS or DTXSID)")
+    parser.add_argument("--db", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--inventory", default=INVENTORY_DB)
+    parser.add_argument("--limit", type=int, default=LIMIT)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.rebuild:
+        build(args.db, inventory_db=args.inventory)
+    index = ensure_index(args.db, inventory_db=args.inventory)
+    print(f"{len(index.labels)} chemicals in '{index.path}' ({time.perf_counter() - t0:.2f}s)")
+    if args.query:
+        t0 = time.perf_counter()
+        hits = index.search(" ".join(args.query), args.limit)
+        elapsed = time.perf_counter() - t0
+        for dtxsid, term in hits:
+            print(f"  {index.label(dtxsid):<60} {term}")
+        print(f"{len(hits)} hits in {elapsed * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
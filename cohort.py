@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import best_series_index
+import cvt_data
+
+'''
+Cohort queries over subject metadata.
+
+subjects keeps sex, age, age_category, height and weight_kg as free text, so
+they are normalized once, for every series, into column arrays next to the
+source DB (cvt_db_20210607.sqlite → cvt_db_20210607.cohort/):
+
+  series_id, subject_id, n_valid_pts      int64
+  species, sex, age_category              S-dtype; lower-cased and trimmed, sex and
+                                          age category mapped to canonical values
+                                          (SEX_MAP / AGE_CATEGORY_MAP, else "unknown")
+  age, height, weight_kg                  float64, NaN where the text is not a number
+  analyte_dtxsid, test_substance_dtxsid   S-dtype
+  meta.json                               source signature
+
+A query ("female rats, 0.2–0.3 kg, with series for analyte X") is a handful of
+vectorized comparisons over those arrays, so it covers every subject at once and
+returns all matching series; open-ended ranges use None for a missing bound, and
+a range excludes subjects whose value is unknown.
+'''
+
+DB_PATH = "cvt_db_20210607.sqlite"
+MIN_PTS = 2
+UNKNOWN = "unknown"
+
+SEX_MAP = {
+    "m": "male",   "male": "male",     "males": "male",
+    "f": "female", "female": "female", "females": "female",
+}
+AGE_CATEGORY_MAP = {
+    "adult": "adult", "adults": "adult",
+    "juvenile": "juvenile", "juveniles": "juvenile",
+    "pup": "pup", "pups": "pup",
+    "neonate": "neonate", "neonates": "neonate", "neonatal": "neonate",
+    "child": "child", "children": "child", "elderly": "elderly",
+}
+NUMERIC = ("age", "height", "weight_kg")
+TEXT    = ("species", "sex", "age_category", "analyte_dtxsid", "test_substance_dtxsid")
+INTEGER = ("series_id", "subject_id", "n_valid_pts")
+
+COHORT_SQL = """
+    SELECT r.id                    AS series_id,
+           s.id                    AS subject_id,
+           COALESCE(st.n_valid_pts, 0) AS n_valid_pts,
+           s.species, s.sex, s.age, s.age_category, s.height, s.weight_kg,
+           r.analyte_dtxsid, r.test_substance_dtxsid
+      FROM series   AS r
+      JOIN subjects AS s ON r.fk_subject_id = s.id
+      LEFT JOIN idx.series_stats AS st ON st.series_id = r.id
+"""
+
+
+def cohort_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".cohort"
+
+
+def _canonical(values, mapping=None):
+    text = values.fillna("").astype(str).str.strip().str.lower()
+    if mapping is not None:
+        text = text.map(mapping).fillna(UNKNOWN)
+    return text.replace("", UNKNOWN)
+
+
+# ——— BUILD ———
+def build(db_path, out_path=None):
+    out_path = out_path or cohort_path_for(db_path)
+    signature = best_series_index.source_signature(db_path)
+    with cvt_data.connection(db_path) as conn:
+        df = pd.read_sql_query(COHORT_SQL, conn)
+
+    cols = {
+        "series_id":   df["series_id"].to_numpy(dtype="int64"),
+        "subject_id":  df["subject_id"].to_numpy(dtype="int64"),
+        "n_valid_pts": df["n_valid_pts"].to_numpy(dtype="int64"),
+        "species":      _canonical(df["species"]),
+        "sex":          _canonical(df["sex"], SEX_MAP),
+        "age_category": _canonical(df["age_category"], AGE_CATEGORY_MAP),
+        "analyte_dtxsid":        df["analyte_dtxsid"].fillna(""),
+        "test_substance_dtxsid": df["test_substance_dtxsid"].fillna(""),
+    }
+    for col in NUMERIC:
+        cols[col] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")
+
+    with best_series_index.atomic_output(out_path, directory=True) as tmp_path:
+        for name, values in cols.items():
+            if name in TEXT:
+                values = np.char.encode(values.to_numpy(dtype=str), "utf-8")
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(dict(signature, n_series=len(df)), f)
+    return out_path
+
+
+def is_fresh(db_path, path=None):
+    path = path or cohort_path_for(db_path)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return all(meta.get(k) == v for k, v in best_series_index.source_signature(db_path).items())
+
+
+def open_cohort(db_path=DB_PATH, path=None):
+    path = path or cohort_path_for(db_path)
+    best_series_index.ensure_built(path, lambda: is_fresh(db_path, path), lambda: build(db_path, path))
+    return Cohort(path)
+
+
+# ——— QUERY ———
+def _in_range(values, bounds):
+    lo, hi = bounds
+    mask = ~np.isnan(values)
+    if lo is not None:
+        mask &= values >= lo
+    if hi is not None:
+        mask &= values <= hi
+    return mask
+
+
+class Cohort:
+    def __init__(self, path):
+        self.path = path
+        self.cols = {name: np.load(os.path.join(path, f"{name}.npy"))
+                     for name in INTEGER + TEXT + NUMERIC}
+
+    def __len__(self):
+        return len(self.cols["series_id"])
+
+    def values(self, column):
+        # distinct values of a text column, e.g. for pickers
+        return sorted(v.decode() for v in np.unique(self.cols[column]))
+
+    def query(self, species=None, sex=None, age_category=None, analyte=None, test_substance=None,
+              age=None, height=None, weight_kg=None, min_pts=MIN_PTS):
+        # text filters take one value or a list; numeric filters a (lo, hi) pair
+        mask = self.cols["n_valid_pts"] >= min_pts
+        for column, wanted in (("species", species), ("sex", sex), ("age_category", age_category),
+                               ("analyte_dtxsid", analyte),
+                               ("test_substance_dtxsid", test_substance)):
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            if column in ("species", "sex", "age_category"):
+                wanted = [w.strip().lower() for w in wanted]
+            mask &= np.isin(self.cols[column], np.char.encode(np.array(wanted, dtype=str), "utf-8"))
+        for column, bounds in (("age", age), ("height", height), ("weight_kg", weight_kg)):
+            if bounds is not None:
+                mask &= _in_range(self.cols[column], bounds)
+        rows = np.flatnonzero(mask)
+        out = pd.DataFrame({name: self.cols[name][rows] for name in INTEGER + TEXT + NUMERIC})
+        for name in TEXT:
+            out[name] = out[name].str.decode("utf-8")
+        return out
+
+
+def describe(row):
+    # "Sex: female · Age: 12 (adult) · Weight: 0.25 kg", skipping unknown fields
+    parts = []
+    if row["sex"] != UNKNOWN:
+        parts.append(f"Sex: {row['sex']}")
+    if pd.notna(row["age"]):
+        age = f"Age: {row['age']:g}"
+        if row["age_category"] != UNKNOWN:
+            age += f" ({row['age_category']})"
+        parts.append(age)
+    if pd.notna(row["height"]):
+        parts.append(f"Height: {row['height']:g} cm")
+    if pd.notna(row["weight_kg"]):
+        parts.append(f"Weight: {row['weight_kg']:g} kg")
+    return " · ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query series by subject metadata, e.g. "
+                                                 "--species rat --sex female --weight-kg 0.2 0.3 --analyte DTXSID…")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--species", nargs="+")
+    parser.add_argument("--sex", nargs="+", help=f"male / female / {UNKNOWN}")
+    parser.add_argument("--age-category", nargs="+")
+    parser.add_argument("--analyte", nargs="+", help="analyte DTXSID(s)")
+    parser.add_argument("--test-substance", nargs="+", help="administered DTXSID(s)")
+    parser.add_argument("--age",       nargs=2, type=float, metavar=("LO", "HI"))
+    parser.add_argument("--height",    nargs=2, type=float, metavar=("LO", "HI"), help="cm")
+    parser.add_argument("--weight-kg", nargs=2, type=float, metavar=("LO", "HI"))
+    parser.add_argument("--min-pts", type=int, default=MIN_PTS)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.rebuild:
+        build(args.db)
+    cohort = open_cohort(args.db)
+    print(f"{len(cohort)} series in '{cohort.path}' ({time.perf_counter() - t0:.2f}s)")
+    t0 = time.perf_counter()
+    res = cohort.query(args.species, args.sex, args.age_category, args.analyte, args.test_substance,
+                       args.age, args.height, args.weight_kg, args.min_pts)
+    elapsed = time.perf_counter() - t0
+    print(res.to_string(index=False, max_rows=40))
+    print(f"{len(res)} series from {res['subject_id'].nunique()} subjects in {elapsed * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
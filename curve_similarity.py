@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import best_series_index
+import cvt_data
+import nca
+import series_store
+
+'''
+PK curve similarity search.
+
+Every best series in the DB (one per species, chemical and role, as picked by
+get_best_series_and_data) is turned into a fixed-length feature vector:
+
+  profile   log10(conc / cmax) interpolated on N_GRID points of normalized time
+            t / tlast, floored at PROFILE_FLOOR, so curve shape is compared
+            independently of dose and sampling schedule
+  nca       log10 of NCA_FEATURES (cmax, tmax, tlast, auc_last, half_life),
+            z-scored over all series and weighted by NCA_WEIGHT; missing values
+            (e.g. no terminal phase) sit at the mean
+
+The vectors are written next to the source DB (cvt_db_20210607.sqlite →
+cvt_db_20210607.features/) as one float32 matrix plus key arrays:
+
+  vectors.npy   float32 (n, N_GRID + len(NCA_FEATURES))
+  norms.npy     float32 squared row norms, for ‖a − b‖² = ‖a‖² − 2a·b + ‖b‖²
+  series_id.npy, species.npy, dtxsid.npy, role.npy
+  meta.json     source signature and feature parameters
+
+With a few dozen dimensions a tree index buys nothing over a brute-force scan,
+so nearest() is one BLAS matrix-vector product and an argpartition over the
+whole corpus — milliseconds for hundreds of thousands of series.
+'''
+
+DB_PATH       = "cvt_db_20210607.sqlite"
+N_GRID        = 16
+PROFILE_FLOOR = 1e-4
+NCA_FEATURES  = ["cmax", "tmax", "tlast", "auc_last", "half_life"]
+NCA_WEIGHT    = 0.5
+MIN_PTS       = 3
+TOP_K         = 10
+
+BEST_SERIES_ALL_SQL = """
+    SELECT species_norm AS species, dtxsid, role, series_id
+      FROM idx.best_series
+     WHERE n_valid_pts >= ?
+     ORDER BY series_id
+"""
+
+
+def features_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".features"
+
+
+# ——— FEATURES ———
+def profile_features(time, conc, offsets, series_ids, n_grid=N_GRID, floor=PROFILE_FLOOR):
+    # CSR arrays as in series_store; returns (len(series_ids), n_grid) and a validity mask
+    offsets = np.asarray(offsets, dtype="int64")
+    series_ids = np.asarray(series_ids, dtype="int64")
+    starts = offsets[series_ids]
+    counts = offsets[series_ids + 1] - starts
+    m = len(series_ids)
+    out = np.zeros((m, n_grid))
+    valid = counts >= 2
+    if not valid.any():
+        return out, valid
+
+    # gather the selected series into one contiguous segment each
+    s0  = np.r_[0, np.cumsum(counts)[:-1]]
+    seg = np.repeat(np.arange(m), counts)
+    pos = np.repeat(starts - s0, counts) + np.arange(counts.sum())
+    t = np.asarray(time, dtype="float64")[pos]
+    c = np.asarray(conc, dtype="float64")[pos]
+
+    last = s0 + counts - 1
+    tlast = np.where(counts > 0, t[np.maximum(last, 0)], 0.0)
+    cmax = np.full(m, -np.inf)
+    np.maximum.at(cmax, seg, c)
+    valid &= (tlast > 0) & (cmax > 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tn = t / tlast[seg]
+        lc = np.log10(np.clip(c / cmax[seg], floor, None))
+    # time is sorted within each series and tn ∈ [0, 1], so seg*2 + tn is globally sorted
+    key = seg * 2.0 + np.where(valid[seg], tn, 0.0)
+    grid = np.linspace(0.0, 1.0, n_grid)
+    q = (np.arange(m)[:, None] * 2.0 + grid).ravel()
+    qseg = np.repeat(np.arange(m), n_grid)
+    hi = np.clip(np.searchsorted(key, q, side="left"), s0[qseg], last[qseg])
+    lo = np.clip(hi - 1, s0[qseg], last[qseg])
+    dt = key[hi] - key[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(dt > 0, (q - key[lo]) / dt, 0.0)
+    # before the first sample (or past the last) the nearest value is held
+    w = np.clip(w, 0.0, 1.0)
+    out[:] = ((1 - w) * lc[lo] + w * lc[hi]).reshape(m, n_grid)
+    out[~valid] = 0.0
+    return out, valid
+
+
+def nca_features(time, conc, offsets, series_ids):
+    res = nca.nca_arrays(time, conc, offsets).reindex(series_ids)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logged = np.log10(res[NCA_FEATURES].to_numpy(dtype="float64"))
+    logged[~np.isfinite(logged)] = np.nan
+    return logged
+
+
+def standardize(logged, weight=NCA_WEIGHT):
+    mean = np.nanmean(logged, axis=0) if len(logged) else np.zeros(logged.shape[1])
+    std  = np.nanstd(logged, axis=0)  if len(logged) else np.ones(logged.shape[1])
+    mean = np.nan_to_num(mean)
+    std  = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+    z = np.nan_to_num((logged - mean) / std)
+    return weight * z, mean, std
+
+
+# ——— BUILD ———
+def build(db_path, out_path=None, n_grid=N_GRID, min_pts=MIN_PTS):
+    out_path = out_path or features_path_for(db_path)
+    signature = best_series_index.source_signature(db_path)
+    store_path = series_store.store_path_for(db_path)
+    best_series_index.ensure_built(store_path, lambda: series_store.is_fresh(db_path, store_path),
+                                   lambda: series_store.convert(db_path, store_path))
+    store = series_store.open_store(db_path, store_path)
+
+    with cvt_data.connection(db_path) as conn:
+        keys = pd.read_sql_query(BEST_SERIES_ALL_SQL, conn, params=(min_pts,))
+    keys = keys[keys["series_id"] < len(store)].reset_index(drop=True)
+    sids = keys["series_id"].to_numpy(dtype="int64")
+
+    profile, valid = profile_features(store.time, store.conc, store.offsets, sids, n_grid)
+    logged = nca_features(store.time, store.conc, store.offsets, sids)[valid]
+    keys, profile = keys[valid].reset_index(drop=True), profile[valid]
+    scaled, mean, std = standardize(logged)
+    vectors = np.hstack([profile, scaled]).astype("float32")
+
+    with best_series_index.atomic_output(out_path, directory=True) as tmp_path:
+        np.save(os.path.join(tmp_path, "vectors.npy"),   vectors)
+        np.save(os.path.join(tmp_path, "norms.npy"),     (vectors * vectors).sum(axis=1))
+        np.save(os.path.join(tmp_path, "series_id.npy"), keys["series_id"].to_numpy(dtype="int64"))
+        for col in ("species", "dtxsid", "role"):
+            np.save(os.path.join(tmp_path, f"{col}.npy"), keys[col].to_numpy(dtype=str))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(dict(signature, n_grid=n_grid, min_pts=min_pts, floor=PROFILE_FLOOR,
+                           nca_features=NCA_FEATURES, nca_weight=NCA_WEIGHT,
+                           nca_mean=mean.tolist(), nca_std=std.tolist(), n_series=len(keys)), f)
+    return out_path
+
+
+def is_fresh(db_path, path=None):
+    path = path or features_path_for(db_path)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (meta.get("n_grid") == N_GRID
+            and all(meta.get(k) == v for k, v in best_series_index.source_signature(db_path).items()))
+
+
+def ensure_index(db_path, path=None):
+    path = path or features_path_for(db_path)
+    best_series_index.ensure_built(path, lambda: is_fresh(db_path, path), lambda: build(db_path, path))
+    return SimilarityIndex(path)
+
+
+# ——— QUERY ———
+class SimilarityIndex:
+    def __init__(self, path):
+        self.path      = path
+        self.vectors   = np.load(os.path.join(path, "vectors.npy"))
+        self.norms     = np.load(os.path.join(path, "norms.npy"))
+        self.series_id = np.load(os.path.join(path, "series_id.npy"))
+        self.species   = np.load(os.path.join(path, "species.npy"))
+        self.dtxsid    = np.load(os.path.join(path, "dtxsid.npy"))
+        self.role      = np.load(os.path.join(path, "role.npy"))
+        self._rows     = {key: i for i, key in enumerate(zip(self.species.tolist(),
+                                                             self.dtxsid.tolist(),
+                                                             self.role.tolist()))}
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def row(self, species, dtxsid, role="administered"):
+        return self._rows.get((species.lower(), dtxsid, role))
+
+    def chemicals(self, species, role="administered"):
+        mask = (self.species == species.lower()) & (self.role == role)
+        return sorted(self.dtxsid[mask].tolist())
+
+    def nearest(self, row, k=TOP_K, species=None, exclude_chemical=True):
+        # top-k rows of the query's role by Euclidean distance to `row`, optionally
+        # from one species only; the query chemical itself is left out unless asked for.
+        # (A series whose analyte is its test substance is indexed under both roles.)
+        q = self.vectors[row]
+        d2 = self.norms - 2.0 * (self.vectors @ q) + self.norms[row]
+        mask = self.role == self.role[row]
+        mask[row] = False
+        if species is not None:
+            mask &= self.species == species.lower()
+        if exclude_chemical:
+            mask &= self.dtxsid != self.dtxsid[row]
+        cand = np.flatnonzero(mask)
+        k = min(k, len(cand))
+        if k == 0:
+            return self._frame(cand, d2[cand])
+        top = cand[np.argpartition(d2[cand], k - 1)[:k]]
+        top = top[np.argsort(d2[top], kind="stable")]
+        return self._frame(top, d2[top])
+
+    def _frame(self, rows, d2):
+        return pd.DataFrame({
+            "species":   self.species[rows],
+            "dtxsid":    self.dtxsid[rows],
+            "role":      self.role[rows],
+            "series_id": self.series_id[rows],
+            "distance":  np.sqrt(np.maximum(d2, 0.0)),
+        })
+
+
+def normalized_frame(df):
+    # the curve as the profile features see it: t / tlast against conc / cmax
+    tlast, cmax = df["time_hr"].max(), df["conc"].max()
+    return pd.DataFrame({"time_hr": df["time_hr"] / tlast, "conc": df["conc"] / cmax})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the PK curve similarity index, or query it.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--query", nargs=2, metavar=("SPECIES", "DTXSID"),
+                        help="print the curves most similar to this species' best series")
+    parser.add_argument("--role", default="administered", choices=cvt_data.ROLES)
+    parser.add_argument("--in-species", help="only return matches from this species")
+    parser.add_argument("-k", type=int, default=TOP_K)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.rebuild:
+        build(args.db)
+    index = ensure_index(args.db)
+    print(f"{len(index)} series × {index.vectors.shape[1]} features in '{index.path}' "
+          f"({time.perf_counter() - t0:.2f}s)")
+    if args.query:
+        row = index.row(args.query[0], args.query[1], args.role)
+        if row is None:
+            parser.error(f"no {args.role} series with ≥{MIN_PTS} points for {args.query[1]} in {args.query[0]}")
+        t0 = time.perf_counter()
+        res = index.nearest(row, args.k, species=args.in_species)
+        print(res.to_string(index=False))
+        print(f"query: {(time.perf_counter() - t0) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import best_series_index
+import diagnostics
+
+'''
+Shared access helpers for the CvT database (subjects ⋈ series ⋈ conc_time_values).
+
+"Best series" lookups go through the sidecar index built by best_series_index.py
+(attached as `idx`), so picking the series for a (species, chemical, role) is an
+indexed point lookup rather than an aggregate over conc_time_values, and a
+series' points are read already numeric from idx.conc_time. The index is
+rebuilt automatically when the source DB file changes.
+
+Connections are read-only (mode=ro, immutable) with a large page cache and
+mmap, and are handed out from a process-wide pool via connection(db_path), so
+Streamlit's script threads reuse warm connections and their cached prepared
+statements instead of opening a fresh handle per call.
+'''
+
+ROLES = tuple(best_series_index.ROLE_COLUMNS)
+
+
+# ——— CONNECTIONS ———
+MMAP_SIZE         = 256 * 1024 * 1024   # bytes
+CACHE_SIZE_KIB    = 64 * 1024           # negative PRAGMA cache_size is in KiB
+CACHED_STATEMENTS = 256
+POOL_SIZE         = 8                   # idle connections kept per DB
+
+
+def _ro_uri(path):
+    return f"file:{os.path.abspath(path)}?mode=ro&immutable=1"
+
+
+def connect(db_path, index_path=None):
+    # pools pass the index they already ensured; standalone callers get it checked here
+    index_path = index_path or best_series_index.ensure_index(db_path)
+    conn = sqlite3.connect(
+        _ro_uri(db_path),
+        uri=True,
+        check_same_thread=False,          # pooled connections move between script threads
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA query_only = 1")
+    conn.execute("ATTACH DATABASE ? AS idx", (_ro_uri(index_path),))
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, db_path, index_path, signature, size=POOL_SIZE):
+        self.db_path    = db_path
+        self.index_path = index_path
+        self.signature  = signature
+        self._idle      = queue.LifoQueue(maxsize=size)   # LIFO keeps the warmest caches in use
+        self.closed     = False
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.db_path, self.index_path)
+
+    def release(self, conn):
+        if self.closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools      = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    key = os.path.abspath(db_path)
+    signature = best_series_index.source_signature(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        # immutable connections never notice file changes, so swap the pool instead;
+        # the index is (re)built here, once, rather than by each new connection
+        if pool is None or pool.signature != signature:
+            if pool is not None:
+                pool.close()
+            index_path = best_series_index.ensure_index(db_path)
+            pool = _pools[key] = ConnectionPool(db_path, index_path, signature)
+    return pool
+
+
+@contextmanager
+def connection(db_path):
+    pool = get_pool(db_path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def data_version(db_path):
+    # Changes whenever the source DB file does; used to key derived caches
+    return "-".join(best_series_index.source_signature(db_path).values())
+
+
+# ——— BEST-SERIES LOOKUPS ———
+BEST_SERIES_SQL = """
+    SELECT series_id, n_valid_pts
+      FROM idx.best_series
+     WHERE species_norm = ? AND dtxsid = ? AND role = ?
+"""
+
+BEST_SERIES_BULK_SQL = """
+    SELECT species_norm AS species, dtxsid, series_id, n_valid_pts
+      FROM idx.best_series
+     WHERE role = ?
+       AND species_norm IN (SELECT value FROM json_each(?))
+       AND dtxsid       IN (SELECT value FROM json_each(?))
+"""
+
+
+def best_series(conn, species, dtxsid, role="administered"):
+    diagnostics.count("sql.queries")
+    return conn.execute(BEST_SERIES_SQL, (species.lower(), dtxsid, role)).fetchone()
+
+
+def best_series_bulk(conn, species, dtxsids, role="administered"):
+    diagnostics.count("sql.queries")
+    return pd.read_sql_query(
+        BEST_SERIES_BULK_SQL,
+        conn,
+        params=(role,
+                json.dumps([sp.lower() for sp in species]),
+                json.dumps(list(dtxsids))),
+    )
+
+
+def available_for_pair(best, species1, species2, dtxsids, min_pts=2):
+    usable = best[best["n_valid_pts"] >= min_pts]
+    ok1 = set(usable.loc[usable["species"] == species1.lower(), "dtxsid"])
+    ok2 = set(usable.loc[usable["species"] == species2.lower(), "dtxsid"])
+    return [chem for chem in dtxsids if chem in ok1 and chem in ok2]
+
+
+# ——— CONCENTRATION–TIME DATA ———
+# Valid points only, in time order, straight off the covering index conc_time_valid
+SERIES_POINTS_SQL = """
+    SELECT time_hr, conc
+      FROM idx.conc_time
+     WHERE fk_series_id = ? AND valid
+     ORDER BY time_hr
+"""
+
+
+# `store` is an optional series_store.SeriesStore; when given, points come from
+# its memory-mapped arrays (already numeric, cleaned and sorted) instead of SQL.
+def load_series(conn, series_id, store=None):
+    if store is not None:
+        diagnostics.count("store.reads")
+        return store.frame(series_id)
+    diagnostics.count("sql.queries")
+    with diagnostics.span("sql read"):
+        rows = conn.execute(SERIES_POINTS_SQL, (int(series_id),)).fetchall()
+    points = np.array(rows, dtype="float64").reshape(-1, 2)
+    return pd.DataFrame({"time_hr": points[:, 0], "conc": points[:, 1]})
+
+
+def get_best_series_and_data(conn, species, dtxsid, role="administered", min_pts=2, store=None):
+    best = best_series(conn, species, dtxsid, role)
+    if best is None or best[1] < min_pts:
+        return None
+    df = load_series(conn, best[0], store)
+    return df if len(df) >= min_pts else None
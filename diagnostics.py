@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+'''
+Lightweight per-run instrumentation for the explorer.
+
+An app calls start_run() at the top of each script run; while that run's
+Recorder is active on the thread, span("name") times a phase (nested spans keep
+their depth) and count("name", n) bumps a counter: SQL queries, cache misses,
+bytes sent to the browser. Library code (cvt_data, render_cache) calls the same
+two functions without knowing whether anyone is listening.
+
+With no active recorder, span() hands back a shared nullcontext and count()
+returns after one thread-local lookup, so the disabled cost is negligible.
+Finished runs can be rendered in a sidebar panel and exported as JSON lines
+(one run per line) for offline aggregation.
+'''
+
+HISTORY = 20    # runs kept per session for export
+
+_local = threading.local()
+_NULL  = nullcontext()
+
+
+class Recorder:
+    def __init__(self, label=""):
+        self.label    = label
+        self.started  = time.time()
+        self.t0       = time.perf_counter()
+        self.spans    = []          # (name, depth, start offset s, duration s)
+        self.counters = {}
+        self._depth   = 0
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, name):
+        depth = self._depth
+        self._depth += 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            t1 = time.perf_counter()
+            self._depth = depth
+            self.spans.append((name, depth, t0 - self.t0, t1 - t0))
+
+    def to_dict(self):
+        return {
+            "label":    self.label,
+            "started":  self.started,
+            "elapsed":  time.perf_counter() - self.t0,
+            "spans":    [{"name": n, "depth": d, "start": s, "duration": t}
+                         for n, d, s, t in self.spans],
+            "counters": dict(self.counters),
+        }
+
+
+def start_run(enabled, label=""):
+    _local.recorder = Recorder(label) if enabled else None
+    return _local.recorder
+
+
+def current():
+    return getattr(_local, "recorder", None)
+
+
+def span(name):
+    rec = getattr(_local, "recorder", None)
+    return _NULL if rec is None else rec.span(name)
+
+
+def count(name, n=1):
+    rec = getattr(_local, "recorder", None)
+    if rec is not None:
+        rec.count(name, n)
+
+
+def traced(name):
+    # Decorator: wrap a function in span(name); put it outside @st.cache_* so the
+    # span covers cache hits as well as misses
+    def wrap(fn):
+        def inner(*args, **kwargs):
+            count(f"{name}.calls")
+            with span(name):
+                return fn(*args, **kwargs)
+        inner.__name__ = fn.__name__
+        inner.__wrapped__ = fn
+        return inner
+    return wrap
+
+
+def to_jsonl(runs):
+    return "".join(json.dumps(run) + "\n" for run in runs)
+
+
+def append_jsonl(path, run):
+    with open(path, "a") as f:
+        f.write(json.dumps(run) + "\n")
+
+
+# ——— STREAMLIT PANEL ———
+def summary_rows(run):
+    # one row per span name, in the order phases started, indented by nesting depth
+    totals = {}
+    for s in sorted(run["spans"], key=lambda s: s["start"]):
+        row = totals.setdefault(s["name"], {"phase": "· " * s["depth"] + s["name"],
+                                            "calls": 0, "total ms": 0.0})
+        row["calls"] += 1
+        row["total ms"] += s["duration"] * 1e3
+    return [dict(row, **{"total ms": round(row["total ms"], 2)}) for row in totals.values()]
+
+
+def counter_rows(run):
+    counters = run["counters"]
+    rows = [{"counter": k, "value": v} for k, v in sorted(counters.items())]
+    # cache hits are the calls that never reached the function body
+    for key in sorted(counters):
+        if key.endswith(".calls"):
+            name = key[:-len(".calls")]
+            misses = counters.get(f"{name}.miss", 0)
+            rows.append({"counter": f"{name}.hit", "value": counters[key] - misses})
+    return rows
+
+
+def render_panel(container, rec, history, log_path=None):
+    # container: a Streamlit container (e.g. the sidebar expander); history: session list
+    run = rec.to_dict()
+    history.append(run)
+    del history[:-HISTORY]
+    if log_path:
+        append_jsonl(log_path, run)
+    container.caption(f"Script run: {run['elapsed'] * 1e3:.1f} ms")
+    container.dataframe(summary_rows(run), hide_index=True)
+    container.dataframe(counter_rows(run), hide_index=True)
+    container.download_button("Export runs (JSONL)", to_jsonl(history),
+                              file_name="diagnostics.jsonl", mime="application/jsonl")
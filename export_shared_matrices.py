@@ -0,0 +1,103 @@
+import argparse
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+import cvt_data
+import incidence
+
+'''
+Builds both species×species intersection matrices in one pass over the CvT DB.
+
+These two IDs allow clear delineation between:
+✅ What you measured (e.g. a metabolite in plasma) — linked via analyte_dtxsid / analyte_casrn
+✅ What you administered (e.g. prodrug or parent compound) — linked via test_substance_dtxsid
+
+The result is written as the compact incidence store (see incidence.py); the
+old list-literal CSV matrices are still available with --csv.
+
+Only distinct (species, test_substance_dtxsid, analyte_dtxsid) triples for series
+with at least one non-blank time/concentration row are pulled out of SQLite, and
+they are streamed with fetchmany(), so memory stays flat as the DB grows. The
+non-blank counts come precomputed from the sidecar index (series_stats, see
+best_series_index.py), so no value is trimmed or compared as text here.
+'''
+
+DB_PATH        = "cvt_db_20210607.sqlite"
+ADMIN_MATRIX   = "parallel_administered_drugs_matrix.csv"
+METAB_MATRIX   = "parallel_metabolites_matrix.csv"
+FETCH_SIZE     = 10_000
+
+DISTINCT_TRIPLES_SQL = """
+    SELECT DISTINCT species_norm, test_substance_dtxsid, analyte_dtxsid
+      FROM idx.series_stats
+     WHERE n_nonblank_pts > 0
+"""
+
+
+def collect_chemicals_by_species(conn, fetch_size=FETCH_SIZE):
+    administered = defaultdict(set)
+    analytes     = defaultdict(set)
+    cur = conn.execute(DISTINCT_TRIPLES_SQL)
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if not rows:
+            break
+        for species, test_dtxsid, analyte_dtxsid in rows:
+            if species is None:
+                continue
+            if test_dtxsid is not None:
+                administered[species].add(test_dtxsid)
+            if analyte_dtxsid is not None:
+                analytes[species].add(analyte_dtxsid)
+    return administered, analytes
+
+
+def intersection_matrix(chems_by_species, species_list):
+    matrix = pd.DataFrame(index=species_list, columns=species_list, dtype=object)
+    for sp1 in species_list:
+        for sp2 in species_list:
+            shared = chems_by_species.get(sp1, set()) & chems_by_species.get(sp2, set())
+            matrix.at[sp1, sp2] = sorted(shared)
+    return matrix
+
+
+def export_matrices(db_path=DB_PATH, out_dir=incidence.INCIDENCE_DIR, admin_csv=None, metab_csv=None):
+    conn = cvt_data.connect(db_path)
+    try:
+        administered, analytes = collect_chemicals_by_species(conn)
+    finally:
+        conn.close()
+
+    incidence.write_incidence(out_dir, administered, analytes)
+
+    species_list = sorted(set(administered) | set(analytes))
+    if admin_csv:
+        intersection_matrix(administered, species_list).to_csv(admin_csv)
+    if metab_csv:
+        intersection_matrix(analytes, species_list).to_csv(metab_csv)
+    return administered, analytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the shared administered-drug and metabolite matrices.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--out", default=incidence.INCIDENCE_DIR, help="incidence store directory")
+    parser.add_argument("--csv", action="store_true",
+                        help=f"also write '{ADMIN_MATRIX}' and '{METAB_MATRIX}'")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    administered, analytes = export_matrices(
+        args.db, args.out,
+        ADMIN_MATRIX if args.csv else None,
+        METAB_MATRIX if args.csv else None,
+    )
+    n_species = len(set(administered) | set(analytes))
+    print(f"Wrote incidence store '{args.out}' for {n_species} species "
+          f"({time.perf_counter() - t0:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import ast
+import os
+
+import numpy as np
+
+'''
+Compact species×chemical incidence store.
+
+Replaces the list-literal CSV matrices: instead of every pairwise intersection,
+the store keeps one chemical dictionary and one bitset per species and role,
+and intersections are computed on demand with bitwise ops. Everything is a
+plain .npy file, so loading is an mmap with no parsing:
+
+  parallel_matrices/
+    species.npy        S-dtype, one row per species (sorted, normalized)
+    chemicals.npy      S-dtype, one row per chemical id (sorted DTXSIDs)
+    administered.npy   uint8 (n_species, ceil(n_chemicals / 8)) packed bits
+    analyte.npy        same layout, for analyte_dtxsid
+    administered_by_chemical.npy
+                       the inverted index: uint8 (n_chemicals, ceil(n_species / 8)),
+                       each chemical's species bitmask
+    analyte_by_chemical.npy
+                       same, for analyte_dtxsid
+
+The species rows answer "what does this species have"; the per-chemical
+bitmasks answer N-way questions (in mouse and rat and dog, but not human) with
+one vectorized pass over the chemicals. Stores written before the inverted
+index existed still load: the masks are then derived from the species rows.
+'''
+
+INCIDENCE_DIR = "parallel_matrices"
+ROLES         = ("administered", "analyte")
+
+
+class IncidenceMatrix:
+    def __init__(self, species, chemicals, bits, by_chemical=None):
+        self.species    = species                     # list[str]
+        self.chemicals  = chemicals                   # np.ndarray[S], possibly memory-mapped
+        self.bits       = bits                        # np.ndarray[uint8], possibly memory-mapped
+        if by_chemical is None:
+            by_chemical = _invert(bits, len(species), len(chemicals))
+        self.by_chemical = by_chemical                # np.ndarray[uint8] (n_chemicals, species bytes)
+        self._row       = {sp: i for i, sp in enumerate(species)}
+
+    def __contains__(self, species):
+        return species in self._row
+
+    def mask(self, species):
+        return self.bits[self._row[species]]
+
+    def chemicals_in(self, mask):
+        ids = np.flatnonzero(np.unpackbits(mask, count=len(self.chemicals)))
+        return [chem.decode() for chem in self.chemicals[ids]]
+
+    def intersect(self, *species):
+        return self.chemicals_in(np.bitwise_and.reduce([self.mask(sp) for sp in species]))
+
+    def union(self, *species):
+        return self.chemicals_in(np.bitwise_or.reduce([self.mask(sp) for sp in species]))
+
+    def shared(self, species1, species2):
+        if species1 not in self or species2 not in self:
+            return []
+        return self.intersect(species1, species2)
+
+    # ——— N-way queries over the inverted index ———
+    def species_mask(self, species):
+        bits = np.zeros(len(self.species), dtype=bool)
+        bits[[self._row[sp] for sp in species]] = True
+        return np.packbits(bits)
+
+    def species_of(self, chem):
+        i = np.searchsorted(self.chemicals, chem.encode())
+        if i == len(self.chemicals) or self.chemicals[i] != chem.encode():
+            return []
+        present = np.unpackbits(self.by_chemical[i], count=len(self.species))
+        return [self.species[j] for j in np.flatnonzero(present)]
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        # chemicals present in every species of all_of, in at least one of any_of
+        # (when given) and in none of none_of
+        keep = np.ones(len(self.chemicals), dtype=bool)
+        masks = self.by_chemical
+        if all_of:
+            need = self.species_mask(all_of)
+            keep &= ((masks & need) == need).all(axis=1)
+        if any_of:
+            keep &= (masks & self.species_mask(any_of)).any(axis=1)
+        if none_of:
+            keep &= ~(masks & self.species_mask(none_of)).any(axis=1)
+        if not (all_of or any_of):
+            keep &= masks.any(axis=1)
+        return [chem.decode() for chem in self.chemicals[keep]]
+
+
+def _invert(bits, n_species, n_chemicals):
+    # species rows (n_species, chem bytes) → chemical rows (n_chemicals, species bytes)
+    dense = np.unpackbits(np.asarray(bits), axis=1, count=n_chemicals)
+    return np.packbits(dense.T, axis=1)
+
+
+# ——— WRITE ———
+def _packed_rows(chems_by_species, species_list, chem_ids):
+    n_chem = len(chem_ids)
+    bits = np.zeros((len(species_list), n_chem), dtype=bool)
+    for i, sp in enumerate(species_list):
+        ids = [chem_ids[c] for c in chems_by_species.get(sp, ())]
+        bits[i, ids] = True
+    return np.packbits(bits, axis=1)
+
+
+def write_incidence(out_dir, administered, analytes):
+    species_list = sorted(set(administered) | set(analytes))
+    chemicals = sorted(set().union(*administered.values(), *analytes.values()))
+    chem_ids = {c: i for i, c in enumerate(chemicals)}
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "species.npy"),   np.array(species_list, dtype="S"))
+    np.save(os.path.join(out_dir, "chemicals.npy"), np.array(chemicals, dtype="S"))
+    for role, chems_by_species in zip(ROLES, (administered, analytes)):
+        rows = _packed_rows(chems_by_species, species_list, chem_ids)
+        np.save(os.path.join(out_dir, f"{role}.npy"), rows)
+        np.save(os.path.join(out_dir, f"{role}_by_chemical.npy"),
+                _invert(rows, len(species_list), len(chemicals)))
+    return out_dir
+
+
+# ——— READ ———
+def store_version(path=INCIDENCE_DIR, role="administered"):
+    # changes whenever the role's bitsets are rewritten; apps key their cached matrices on it
+    return os.stat(os.path.join(path, f"{role}.npy")).st_mtime_ns
+
+
+def load_incidence(path=INCIDENCE_DIR, role="administered"):
+    species   = [sp.decode() for sp in np.load(os.path.join(path, "species.npy"))]
+    chemicals = np.load(os.path.join(path, "chemicals.npy"), mmap_mode="r")
+    bits      = np.load(os.path.join(path, f"{role}.npy"),   mmap_mode="r")
+    inverted  = os.path.join(path, f"{role}_by_chemical.npy")
+    by_chem   = np.load(inverted, mmap_mode="r") if os.path.exists(inverted) else None
+    return IncidenceMatrix(species, chemicals, bits, by_chem)
+
+
+# ——— ONE-OFF CONVERSION FROM THE OLD CSV MATRICES ———
+def chemicals_from_matrix_csv(path):
+    import pandas as pd     # kept off the import path of the apps, which never read CSVs
+    matrix = pd.read_csv(path, index_col=0)
+    # the diagonal of a species×species intersection matrix is each species' own set
+    return {sp: set(ast.literal_eval(matrix.at[sp, sp])) for sp in matrix.index}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert list-literal CSV matrices into the compact incidence store.")
+    parser.add_argument("--admin-csv", default="parallel_administered_drugs_matrix.csv")
+    parser.add_argument("--metab-csv", default="parallel_metabolites_matrix.csv")
+    parser.add_argument("--out", default=INCIDENCE_DIR)
+    args = parser.parse_args()
+
+    write_incidence(args.out,
+                    chemicals_from_matrix_csv(args.admin_csv),
+                    chemicals_from_matrix_csv(args.metab_csv))
+    print(f"Wrote incidence store '{args.out}'")
+
+
+if __name__ == "__main__":
+    main()
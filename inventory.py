@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+import incidence
+import tox_data
+
+'''
+Chemical inventory lookups for the explorer (the chemical_inventory table that
+tox_data.py loads into chemical_data.sqlite).
+
+Filtering goes through a DTXSID → functional-use map read once per process, so
+narrowing a species pair's list of thousands of chemicals to a few uses is a set
+operation in memory, never a query per chemical. The remaining attributes are
+fetched only for the chemicals on screen, with one indexed query (idx_dtxsid)
+for the whole list; a chemical with several inventory rows (one per use) comes
+back as one row with its uses joined.
+'''
+
+USE_COLUMN = "Harmonized Functional Use"
+USE_SEP    = "; "
+
+USES_SQL = f"""
+    SELECT DISTINCT {tox_data.KEY_COLUMN}, "{USE_COLUMN}"
+      FROM {tox_data.TABLE_NAME}
+     WHERE {tox_data.KEY_COLUMN} IS NOT NULL AND "{USE_COLUMN}" IS NOT NULL
+"""
+
+ATTRIBUTES_SQL = f"""
+    SELECT *
+      FROM {tox_data.TABLE_NAME}
+     WHERE {tox_data.KEY_COLUMN} IN (SELECT value FROM json_each(?))
+"""
+
+
+class Inventory:
+    def __init__(self, db_file=tox_data.DB_FILE):
+        self.db_file = db_file
+        self._conn   = sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True,
+                                       check_same_thread=False)
+        self._lock   = threading.Lock()     # one connection, shared by every session thread
+        by_use, uses_of = {}, {}
+        for dtxsid, use in self._conn.execute(USES_SQL):
+            by_use.setdefault(use, set()).add(dtxsid)
+            uses_of.setdefault(dtxsid, []).append(use)
+        self.by_use  = {use: frozenset(ids) for use, ids in by_use.items()}
+        self.uses_of = {dtxsid: tuple(sorted(uses)) for dtxsid, uses in uses_of.items()}
+        self.uses    = sorted(self.by_use)
+
+    def with_uses(self, uses):
+        # every DTXSID listed under at least one of `uses`
+        return frozenset().union(*(self.by_use.get(use, ()) for use in uses))
+
+    def filter(self, chems, uses):
+        if not uses:
+            return list(chems)
+        keep = self.with_uses(uses)
+        return [chem for chem in chems if chem in keep]
+
+    def use_counts(self, chems):
+        # {use: number of `chems` listed under it}, for labelling the filter
+        counts = {}
+        for chem in chems:
+            for use in self.uses_of.get(chem, ()):
+                counts[use] = counts.get(use, 0) + 1
+        return counts
+
+    def attributes(self, chems):
+        with self._lock:
+            df = pd.read_sql_query(ATTRIBUTES_SQL, self._conn, params=(json.dumps(list(chems)),))
+        key = tox_data.KEY_COLUMN
+        if df.empty:
+            return df.set_index(key)
+        agg = {col: "first" for col in df.columns if col not in (key, USE_COLUMN)}
+        if USE_COLUMN in df.columns:
+            agg[USE_COLUMN] = lambda s: USE_SEP.join(sorted(set(s.dropna())))
+        found = set(df[key])
+        return df.groupby(key, sort=False).agg(agg).reindex([c for c in chems if c in found])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_inventory(db_file=tox_data.DB_FILE):
+    # None when tox_data.py has not been run, so the apps just hide the filter
+    if not os.path.exists(db_file):
+        return None
+    try:
+        return Inventory(db_file)
+    except sqlite3.DatabaseError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter a species pair's shared chemicals by functional use.")
+    parser.add_argument("species", nargs=2)
+    parser.add_argument("--use", action="append", default=[], help="functional use (repeatable)")
+    parser.add_argument("--role", default="administered", choices=incidence.ROLES)
+    parser.add_argument("--matrices", default=incidence.INCIDENCE_DIR)
+    parser.add_argument("--inventory", default=tox_data.DB_FILE)
+    args = parser.parse_args()
+
+    inv = open_inventory(args.inventory)
+    if inv is None:
+        parser.error(f"no chemical inventory at '{args.inventory}' (run tox_data.py)")
+    shared = incidence.load_incidence(args.matrices, args.role).shared(*args.species)
+    if not args.use:
+        for use, n in sorted(inv.use_counts(shared).items(), key=lambda kv: -kv[1]):
+            print(f"{n:6d}  {use}")
+        return
+    chems = inv.filter(shared, args.use)
+    print(f"{len(chems)} of {len(shared)} shared chemicals")
+    print(inv.attributes(chems).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import series_store
+
+'''
+Vectorized non-compartmental analysis (NCA).
+
+Works on CSR-style concatenated arrays (the layout series_store.py writes):
+time/conc for every point, sorted by time within each series, plus offsets so
+series s is [offsets[s], offsets[s + 1]). Every parameter is computed for all
+series at once with NumPy segment reductions (reduceat / bincount), never with a
+per-series Python loop.
+
+  cmax, tmax         highest observed concentration and its first time
+  tlast, clast       last observed point
+  auc_last           AUC0–t, linear-up / log-down trapezoids
+  lambda_z, r2_adj   log-linear fit over the last N_TERMINAL points after tmax
+  half_life          ln 2 / lambda_z
+  auc_inf            auc_last + clast / lambda_z
+  cl_per_dose        1 / auc_inf (clearance per unit dose)
+  cl                 dose / auc_inf, only when doses are supplied
+'''
+
+DB_PATH    = "cvt_db_20210607.sqlite"
+N_TERMINAL = 3
+COLUMNS    = ["n_pts", "cmax", "tmax", "tlast", "clast", "auc_last",
+              "lambda_z", "r2_adj", "half_life", "auc_inf", "cl_per_dose", "cl"]
+
+
+def _interval_auc(t, c, same_series):
+    t1, t2 = t[:-1], t[1:]
+    c1, c2 = c[:-1], c[1:]
+    dt = t2 - t1
+    linear = dt * (c1 + c2) / 2
+    # log-down only applies to strictly decreasing positive concentrations
+    log_down = (c2 < c1) & (c2 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logarithmic = dt * (c1 - c2) / np.log(c1 / c2)
+    return np.where(same_series, np.where(log_down, logarithmic, linear), 0.0)
+
+
+def _terminal_fit(t, c, starts, counts, tmax_idx, n_terminal):
+    m = len(starts)
+    lambda_z = np.full(m, np.nan)
+    r2_adj   = np.full(m, np.nan)
+    tail0 = starts + counts - n_terminal
+    ok = (counts >= n_terminal) & (tail0 > tmax_idx)
+    if not ok.any():
+        return lambda_z, r2_adj
+
+    idx = tail0[ok, None] + np.arange(n_terminal)          # (k, n_terminal)
+    x, y = t[idx], c[idx]
+    positive = (y > 0).all(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ly  = np.log(np.where(y > 0, y, np.nan))
+        xm  = x - x.mean(axis=1, keepdims=True)
+        ym  = ly - ly.mean(axis=1, keepdims=True)
+        sxx = (xm * xm).sum(axis=1)
+        sxy = (xm * ym).sum(axis=1)
+        syy = (ym * ym).sum(axis=1)
+        slope = sxy / sxx
+        r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 1.0)
+    adj = 1 - (1 - r2) * (n_terminal - 1) / (n_terminal - 2) if n_terminal > 2 else r2
+    good = positive & (slope < 0) & np.isfinite(slope)
+
+    rows = np.flatnonzero(ok)
+    lambda_z[rows[good]] = -slope[good]
+    r2_adj[rows[good]]   = adj[good]
+    return lambda_z, r2_adj
+
+
+def nca_arrays(time, conc, offsets, doses=None, n_terminal=N_TERMINAL, min_pts=2):
+    time    = np.asarray(time,    dtype="float64")
+    conc    = np.asarray(conc,    dtype="float64")
+    offsets = np.asarray(offsets, dtype="int64")
+    counts_all = np.diff(offsets)
+
+    series_ids = np.flatnonzero(counts_all >= min_pts)
+    out = pd.DataFrame(np.nan, index=pd.Index(series_ids, name="series_id"), columns=COLUMNS)
+    if len(series_ids) == 0:
+        return out
+
+    starts = offsets[series_ids]
+    counts = counts_all[series_ids]
+
+    # Restrict the point arrays to the selected series so reduceat never sees empty segments
+    s0  = np.r_[0, np.cumsum(counts)[:-1]]
+    e0  = s0 + counts - 1
+    seg = np.repeat(np.arange(len(series_ids)), counts)
+    pos = np.repeat(starts - s0, counts) + np.arange(counts.sum())
+    t, c = time[pos], conc[pos]
+
+    cmax = np.maximum.reduceat(c, s0)
+    first_at_max = np.where(c == cmax[seg], np.arange(len(c)), len(c))
+    tmax_idx = np.minimum.reduceat(first_at_max, s0)
+
+    same_series = seg[:-1] == seg[1:]
+    auc_last = np.bincount(seg[:-1], weights=_interval_auc(t, c, same_series),
+                           minlength=len(series_ids))
+
+    lambda_z, r2_adj = _terminal_fit(t, c, s0, counts, tmax_idx, n_terminal)
+    clast = c[e0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        auc_inf     = auc_last + clast / lambda_z
+        cl_per_dose = 1.0 / auc_inf
+    cl = np.full(len(series_ids), np.nan)
+    if doses is not None:
+        cl = np.asarray(doses, dtype="float64")[series_ids] * cl_per_dose
+
+    out["n_pts"]       = counts
+    out["cmax"]        = cmax
+    out["tmax"]        = t[tmax_idx]
+    out["tlast"]       = t[e0]
+    out["clast"]       = clast
+    out["auc_last"]    = auc_last
+    out["lambda_z"]    = lambda_z
+    out["r2_adj"]      = r2_adj
+    out["half_life"]   = np.log(2) / lambda_z
+    out["auc_inf"]     = auc_inf
+    out["cl_per_dose"] = cl_per_dose
+    out["cl"]          = cl
+    return out
+
+
+def nca_store(store, doses=None, n_terminal=N_TERMINAL):
+    return nca_arrays(store.time, store.conc, store.offsets, doses, n_terminal)
+
+
+def nca_frames(frames, n_terminal=N_TERMINAL):
+    # frames: {label: DataFrame(time_hr, conc)} as returned by get_best_series_and_data;
+    # tuple labels, e.g. (chemical, species), come back as a MultiIndex
+    labels = [k for k, df in frames.items() if df is not None]
+    dfs = [frames[k] for k in labels]
+    offsets = np.r_[0, np.cumsum([len(df) for df in dfs])].astype("int64")
+    time = np.concatenate([df["time_hr"].to_numpy(dtype="float64") for df in dfs]) if dfs else []
+    conc = np.concatenate([df["conc"].to_numpy(dtype="float64") for df in dfs]) if dfs else []
+    res = nca_arrays(time, conc, offsets, n_terminal=n_terminal)
+    res.index = pd.Index([labels[i] for i in res.index])
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run NCA over every series in the columnar series store.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--out", help="CSV output (default: <db>.nca.csv)")
+    parser.add_argument("--n-terminal", type=int, default=N_TERMINAL,
+                        help="points used for the terminal log-linear fit")
+    args = parser.parse_args()
+
+    store = series_store.open_store(args.db)
+    if store is None:
+        series_store.convert(args.db)
+        store = series_store.open_store(args.db)
+
+    t0 = time.perf_counter()
+    res = nca_store(store, n_terminal=args.n_terminal)
+    elapsed = time.perf_counter() - t0
+    out = args.out or os.path.splitext(args.db)[0] + ".nca.csv"
+    res.to_csv(out)
+    print(f"NCA for {len(res)} series in {elapsed:.2f}s → '{out}'")
+
+
+if __name__ == "__main__":
+    main()
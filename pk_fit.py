@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+from scipy.optimize import least_squares
+
+import best_series_index
+import cvt_data
+import incidence
+import series_store
+
+'''
+1- and 2-compartment PK model fitting.
+
+The CvT tables carry no dose or route, so the models are the disposition
+curves in macro-constant form, fitted to log-concentration (proportional
+error) with positivity enforced through log-parameters:
+
+  1cmt   C(t) = C0 · e^(−k·t)
+  2cmt   C(t) = A · e^(−α·t) + B · e^(−β·t),   α > β
+
+Batch mode fits the best series of every (species, chemical, role) present in
+the incidence store over a ProcessPoolExecutor, in chunks, and persists results
+to <db>.fits.sqlite so reruns skip series already fitted. The app uses
+submit_fit() on a small shared thread pool so fitting never blocks the script
+thread; worker processes are avoided there because Streamlit runs the app as
+__main__, which spawned workers would re-execute.
+'''
+
+DB_PATH    = "cvt_db_20210607.sqlite"
+CHUNK_SIZE = 64
+MODELS     = ("1cmt", "2cmt")
+
+FITS_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS fits_meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS pk_fits (
+        series_id INTEGER NOT NULL,
+        model     TEXT    NOT NULL,
+        success   INTEGER NOT NULL,
+        n_pts     INTEGER NOT NULL,
+        params    TEXT,
+        rss       REAL,
+        aic       REAL,
+        PRIMARY KEY (series_id, model)
+    );
+"""
+
+
+# ——— MODELS ———
+def one_compartment(t, c0, k):
+    return c0 * np.exp(-k * t)
+
+
+def two_compartment(t, a, alpha, b, beta):
+    return a * np.exp(-alpha * t) + b * np.exp(-beta * t)
+
+
+def _unpack(model, theta):
+    p = np.exp(theta)
+    if model == "1cmt":
+        return {"c0": p[0], "k": p[1]}
+    # α = β + δ keeps the fast phase first, so the fit is identifiable
+    return {"a": p[0], "alpha": p[3] + p[1], "b": p[2], "beta": p[3]}
+
+
+def predict(model, params, t):
+    t = np.asarray(t, dtype="float64")
+    if model == "1cmt":
+        return one_compartment(t, params["c0"], params["k"])
+    return two_compartment(t, params["a"], params["alpha"], params["b"], params["beta"])
+
+
+def _initial_guess(model, t, c):
+    slope, intercept = np.polyfit(t, np.log(c), 1)
+    k0  = max(-slope, 1e-3)
+    c00 = np.exp(intercept)
+    if model == "1cmt":
+        return np.log([c00, k0])
+    # split the amplitude between a fast and a slow phase
+    return np.log([c00 / 2, 4 * k0, c00 / 2, k0 / 2])
+
+
+def fit_model(t, c, model):
+    t = np.asarray(t, dtype="float64")
+    c = np.asarray(c, dtype="float64")
+    keep = (c > 0) & np.isfinite(t) & np.isfinite(c)
+    t, c = t[keep], c[keep]
+    n_params = 2 if model == "1cmt" else 4
+    result = {"model": model, "success": False, "n_pts": int(len(t)),
+              "params": None, "rss": None, "aic": None}
+    if len(t) <= n_params or np.ptp(t) == 0:
+        return result
+
+    log_c = np.log(c)
+
+    def residuals(theta):
+        with np.errstate(over="ignore", under="ignore", divide="ignore"):
+            pred = predict(model, _unpack(model, theta), t)
+        return np.log(np.maximum(pred, 1e-300)) - log_c
+
+    try:
+        sol = least_squares(residuals, _initial_guess(model, t, c), method="trf")
+    except (ValueError, np.linalg.LinAlgError):
+        return result
+    rss = float(np.sum(sol.fun ** 2))
+    n = len(t)
+    result.update(
+        success=bool(sol.success),
+        params={k: float(v) for k, v in _unpack(model, sol.x).items()},
+        rss=rss,
+        aic=float(n * np.log(max(rss, 1e-300) / n) + 2 * n_params),
+    )
+    return result
+
+
+def fit_series(t, c, models=MODELS):
+    return [fit_model(t, c, m) for m in models]
+
+
+def best_fit(fits):
+    ok = [f for f in fits if f["success"]]
+    return min(ok, key=lambda f: f["aic"]) if ok else None
+
+
+# ——— INTERACTIVE ———
+def make_executor(max_workers=2):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pk-fit")
+
+
+def submit_fit(executor, df):
+    return executor.submit(fit_series, df["time_hr"].to_numpy(), df["conc"].to_numpy())
+
+
+# ——— BATCH ———
+def fits_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".fits.sqlite"
+
+
+def open_fits_db(db_path, fits_path=None):
+    conn = sqlite3.connect(fits_path or fits_path_for(db_path))
+    conn.executescript(FITS_SCHEMA_SQL)
+    signature = best_series_index.source_signature(db_path)
+    meta = dict(conn.execute("SELECT key, value FROM fits_meta"))
+    if any(meta.get(k) != v for k, v in signature.items()):
+        # fitted against a different DB file: start over
+        with conn:
+            conn.execute("DELETE FROM pk_fits")
+            conn.executemany("INSERT OR REPLACE INTO fits_meta VALUES (?, ?)", signature.items())
+    return conn
+
+
+def target_series(db_path, incidence_dir=incidence.INCIDENCE_DIR):
+    targets = set()
+    with cvt_data.connection(db_path) as conn:
+        for role in cvt_data.ROLES:
+            matrix = incidence.load_incidence(incidence_dir, role)
+            for species in matrix.species:
+                best = cvt_data.best_series_bulk(conn, (species,), matrix.union(species), role)
+                targets.update(best.loc[best["n_valid_pts"] >= 2, "series_id"].tolist())
+    return sorted(targets)
+
+
+def _fit_chunk(db_path, series_ids):
+    store = series_store.open_store(db_path)
+    conn = None if store is not None else cvt_data.connect(db_path)
+    rows = []
+    try:
+        for sid in series_ids:
+            df = cvt_data.load_series(conn, sid, store)
+            for fit in fit_series(df["time_hr"].to_numpy(), df["conc"].to_numpy()):
+                rows.append((sid, fit["model"], int(fit["success"]), fit["n_pts"],
+                             json.dumps(fit["params"]), fit["rss"], fit["aic"]))
+    finally:
+        if conn is not None:
+            conn.close()
+    return rows
+
+
+def run_batch(db_path=DB_PATH, fits_path=None, max_workers=None, chunk_size=CHUNK_SIZE):
+    out = open_fits_db(db_path, fits_path)
+    done = {sid for (sid,) in out.execute(
+        "SELECT series_id FROM pk_fits GROUP BY series_id HAVING COUNT(*) = ?", (len(MODELS),)
+    )}
+    todo = [sid for sid in target_series(db_path) if sid not in done]
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = [ex.submit(_fit_chunk, db_path, chunk) for chunk in chunks]
+        for fut in as_completed(futures):
+            with out:   # commit per chunk, so an interrupted run keeps its progress
+                out.executemany("INSERT OR REPLACE INTO pk_fits VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                fut.result())
+    out.close()
+    return len(done), len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit 1-/2-compartment models to every shared series.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--out", help="results DB (default: <db>.fits.sqlite)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    n_skipped, n_fitted = run_batch(args.db, args.out, args.workers, args.chunk_size)
+    print(f"Fitted {n_fitted} series ({n_skipped} already done) "
+          f"in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
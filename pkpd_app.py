@@ -1,13 +1,22 @@
-import sqlite3
-import pandas as pd
 import streamlit as st
 import matplotlib.pyplot as plt
-import ast
 import math
+import io
+
+import cvt_data
+import diagnostics
+import incidence
+import series_cache
+import series_store
 
 # ——— CONFIG ———
 DB_PATH    = "cvt_db_20210607.sqlite"
-MATRIX_CSV = "parallel_administered_drugs_matrix.csv"
+INCIDENCE_DIR = "parallel_matrices"
+DIAGNOSTICS_LOG = None  # e.g. "diagnostics.jsonl" to append every recorded run
+SERIES_CACHE_BYTES = 256 * 1024 * 1024  # budget for cached series, shared by all sessions
+
+# ——— DIAGNOSTICS (timings recorded only while the sidebar toggle is on) ———
+diag = diagnostics.start_run(st.session_state.get("diag_on", False), label="pkpd_app")
 
 
 st.set_page_config(page_title="Cross-Species PK/PD Explorer", layout="wide")
@@ -37,13 +46,14 @@ if 'shared_ready' not in st.session_state:
     st.session_state['shared_ready'] = False
 
 # ——— LOAD ANALYTE MATRIX ———
-@st.cache_data
-def load_matrix(path):
-    df = pd.read_csv(path, index_col=0)
-    return df.applymap(ast.literal_eval)
+@st.cache_resource(max_entries=4)
+def load_matrix(path, role, version):
+    return incidence.load_incidence(path, role)
 
-matrix = load_matrix(MATRIX_CSV)
-species_options = sorted(matrix.index.str.lower().unique())
+with diagnostics.span("load matrices"):
+    matrix = load_matrix(INCIDENCE_DIR, "administered",
+                         incidence.store_version(INCIDENCE_DIR, "administered"))
+species_options = matrix.species
 
 # ——— SIDEBAR: SPECIES SELECTION ———
 st.sidebar.header("Select Species")
@@ -53,54 +63,44 @@ if species1 == species2:
     st.sidebar.error("Pick two different species.")
     st.stop()
 
+diag_panel = st.sidebar.expander("Diagnostics")
+diag_panel.toggle("Record timings", key="diag_on")
+
 # ——— FIND SHARED METABOLITES ———
-shared_raw = matrix.at[species1, species2] if species1 != species2 else []
-shared = shared_raw if shared_raw else []
+shared = matrix.shared(species1, species2)
 if not shared:
     st.error(f"No shared analytes for **{species1}** & **{species2}**.")
     st.stop()
 
-# ——— DB QUERY FUNCTION ———
-@st.cache_data
-def get_best_series_and_data(db_path, species, metab):
-    conn = sqlite3.connect(db_path)
-    q_best = """
-        SELECT r.id AS series_id, COUNT(*) AS n_pts
-          FROM series AS r
-          JOIN subjects AS s ON r.fk_subject_id = s.id
-          JOIN conc_time_values AS ctv ON r.id = ctv.fk_series_id
-         WHERE LOWER(s.species)        = ?
-           AND r.test_substance_dtxsid = ?
-         GROUP BY r.id
-         ORDER BY n_pts DESC
-         LIMIT 1
-    """
-    best = pd.read_sql_query(q_best, conn, params=(species, metab))
-    if best.empty or best.at[0, "n_pts"] < 2:
-        conn.close()
-        return None
-    series_id = best.at[0, "series_id"]
-    ct_df = pd.read_sql_query(
-        "SELECT time_hr, conc FROM conc_time_values WHERE fk_series_id = ?",
-        conn,
-        params=(series_id,),
-    )
-    conn.close()
-    ct_df["time_hr"] = pd.to_numeric(ct_df["time_hr"], errors="coerce")
-    ct_df["conc"]    = pd.to_numeric(ct_df["conc"],    errors="coerce")
-    ct_df = (
-        ct_df.dropna(subset=["time_hr", "conc"])
-             .sort_values("time_hr")
-             .reset_index(drop=True)
-    )
-    return ct_df if len(ct_df) >= 2 else None
-
-# ——— PRE-FILTER AVAILABLE METABOLITES ———
-available_metabs = []
-for metab in shared:
-    if get_best_series_and_data(DB_PATH, species1, metab) is not None \
-       and get_best_series_and_data(DB_PATH, species2, metab) is not None:
-        available_metabs.append(metab)
+# ——— DB QUERY FUNCTIONS ———
+@st.cache_resource
+def get_series_cache():
+    return series_cache.SeriesCache(SERIES_CACHE_BYTES)
+
+@diagnostics.traced("best_series_data")
+def get_best_series_and_data(db_path, species, metab, role="administered"):
+    # one read-only frame per series per process, shared by every session (series_cache.py)
+    def load():
+        diagnostics.count("best_series_data.miss")
+        with cvt_data.connection(db_path) as conn:
+            return cvt_data.get_best_series_and_data(
+                conn, species, metab, role, store=series_store.open_store(db_path)
+            )
+    return get_series_cache().get_or_load((db_path, species, metab, role),
+                                          cvt_data.data_version(db_path), load)
+
+@diagnostics.traced("best_series_bulk")
+@st.cache_data(max_entries=256)
+def get_best_series_bulk(db_path, version, species_pair, chems, role="administered"):
+    diagnostics.count("best_series_bulk.miss")
+    with cvt_data.connection(db_path) as conn:
+        return cvt_data.best_series_bulk(conn, species_pair, chems, role)
+
+# ——— PRE-FILTER AVAILABLE METABOLITES (ONE INDEXED LOOKUP PER SPECIES PAIR) ———
+with diagnostics.span("availability"):
+    best_series = get_best_series_bulk(DB_PATH, cvt_data.data_version(DB_PATH),
+                                       (species1, species2), tuple(shared))
+    available_metabs = cvt_data.available_for_pair(best_series, species1, species2, shared)
 
 if not available_metabs:
     st.warning("No metabolites with ≥2 points for both species.")
@@ -123,50 +123,63 @@ if st.session_state['shared_ready']:
         ncols = 2
         nrows = math.ceil(n / ncols)
 
-        # Create one figure with subplots
-        fig, axes = plt.subplots(
-            nrows, ncols,
-            figsize=(ncols * 5, nrows * 3),
-            # sharex=True, sharey=True,
-            constrained_layout=True
-        )
-        axes = axes.flatten()  # flatten in case of multiple rows/cols
-
-        # Make the figure background black too
-        fig.patch.set_facecolor('black')
-
-        # Plot each metabolite in its own axis
-        for ax, metab in zip(axes, selected):
-            df1 = get_best_series_and_data(DB_PATH, species1, metab)
-            df2 = get_best_series_and_data(DB_PATH, species2, metab)
-
-            ax.plot(df1["time_hr"], df1["conc"],
-                    marker="o", linestyle="-",
-                    color=colors[species1],
-                    label=species1.capitalize())
-            ax.plot(df2["time_hr"], df2["conc"],
-                    marker="s", linestyle="--",
-                    color=colors[species2],
-                    label=species2.capitalize())
-
-            # Dark-theme styling
-            ax.set_facecolor('#222222')
-            ax.tick_params(colors='white', which='both')
-            ax.xaxis.label.set_color('white')
-            ax.yaxis.label.set_color('white')
-            ax.title.set_color('white')
-            for spine in ax.spines.values():
-                spine.set_color('white')
-            ax.grid(color='gray', linestyle=':', linewidth=0.5)
-
-            ax.set_title(metab, fontsize=10)
-            ax.set_xlabel("Time (hr)")
-            ax.set_ylabel("Concentration")
-            ax.legend(fontsize=6, facecolor='#333333', edgecolor='white', labelcolor='white')
-
-        # Turn off any unused subplots
-        for ax in axes[n:]:
-            ax.set_visible(False)
+        with diagnostics.span("matplotlib draw"):
+            # Create one figure with subplots
+            fig, axes = plt.subplots(
+                nrows, ncols,
+                figsize=(ncols * 5, nrows * 3),
+                # sharex=True, sharey=True,
+                constrained_layout=True
+            )
+            axes = axes.flatten()  # flatten in case of multiple rows/cols
+
+            # Make the figure background black too
+            fig.patch.set_facecolor('black')
+
+            # Plot each metabolite in its own axis
+            for ax, metab in zip(axes, selected):
+                df1 = get_best_series_and_data(DB_PATH, species1, metab)
+                df2 = get_best_series_and_data(DB_PATH, species2, metab)
+
+                ax.plot(df1["time_hr"], df1["conc"],
+                        marker="o", linestyle="-",
+                        color=colors[species1],
+                        label=species1.capitalize())
+                ax.plot(df2["time_hr"], df2["conc"],
+                        marker="s", linestyle="--",
+                        color=colors[species2],
+                        label=species2.capitalize())
+
+                # Dark-theme styling
+                ax.set_facecolor('#222222')
+                ax.tick_params(colors='white', which='both')
+                ax.xaxis.label.set_color('white')
+                ax.yaxis.label.set_color('white')
+                ax.title.set_color('white')
+                for spine in ax.spines.values():
+                    spine.set_color('white')
+                ax.grid(color='gray', linestyle=':', linewidth=0.5)
+
+                ax.set_title(metab, fontsize=10)
+                ax.set_xlabel("Time (hr)")
+                ax.set_ylabel("Concentration")
+                ax.legend(fontsize=6, facecolor='#333333', edgecolor='white', labelcolor='white')
+
+            # Turn off any unused subplots
+            for ax in axes[n:]:
+                ax.set_visible(False)
 
         # Render the combined figure
-        st.pyplot(fig)
+        with diagnostics.span("png encode"):
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", facecolor=fig.get_facecolor())
+            plt.close(fig)
+        diagnostics.count("bytes_sent.images", buf.getbuffer().nbytes)
+        st.image(buf.getvalue())
+
+# ——— DIAGNOSTICS PANEL ———
+if diag is not None:
+    diagnostics.render_panel(diag_panel, diag, st.session_state.setdefault("diag_runs", []),
+                             DIAGNOSTICS_LOG)
+    diag_panel.caption("Series cache (this process, all sessions)")
+    diag_panel.dataframe([get_series_cache().stats()], hide_index=True)
@@ -1,14 +1,23 @@
-import sqlite3
-import pandas as pd
 import streamlit as st
 import matplotlib.pyplot as plt
-import ast
-import math
+
+import cvt_data
+import diagnostics
+import incidence
+import render_cache
+import series_cache
+import series_store
+import vega_plots
 
 # ——— CONFIG ———
 DB_PATH = "cvt_db_20210607.sqlite"
-ADMIN_MATRIX_CSV = "parallel_administered_drugs_matrix.csv"
-MET_MATRIX_CSV = "parallel_metabolites_matrix.csv"
+INCIDENCE_DIR = "parallel_matrices"
+TILE_CACHE_DIR = None  # e.g. ".tile_cache" to keep rendered plots across restarts
+DIAGNOSTICS_LOG = None  # e.g. "diagnostics.jsonl" to append every recorded run
+SERIES_CACHE_BYTES = 256 * 1024 * 1024  # budget for cached series, shared by all sessions
+
+# ——— DIAGNOSTICS (timings recorded only while the sidebar toggle is on) ———
+diag = diagnostics.start_run(st.session_state.get("diag_on", False), label="pkpd_app2")
 
 # ——— STREAMLIT PAGE CONFIG ———
 st.set_page_config(page_title="Cross-Species PK/PD Explorer", layout="wide")
@@ -39,17 +48,20 @@ if 'shared_ready_meta' not in st.session_state:
     st.session_state['shared_ready_meta'] = False
 
 # ——— LOAD MATRIX FUNCTION ———
-@st.cache_data
-def load_matrix(path):
-    df = pd.read_csv(path, index_col=0)
-    return df.applymap(ast.literal_eval)
+# Memory-mapped incidence bitsets; intersections are computed on demand
+@st.cache_resource(max_entries=4)
+def load_matrix(path, role, version):
+    return incidence.load_incidence(path, role)
 
 # Load both matrices
-admin_matrix = load_matrix(ADMIN_MATRIX_CSV)
-metab_matrix = load_matrix(MET_MATRIX_CSV)
+with diagnostics.span("load matrices"):
+    admin_matrix = load_matrix(INCIDENCE_DIR, "administered",
+                               incidence.store_version(INCIDENCE_DIR, "administered"))
+    metab_matrix = load_matrix(INCIDENCE_DIR, "analyte",
+                               incidence.store_version(INCIDENCE_DIR, "analyte"))
 
-# Species options (assumes both matrices share same species index)
-species_options = sorted(admin_matrix.index.str.lower().unique())
+# Species options (both roles share the same species index)
+species_options = admin_matrix.species
 
 # ——— SIDEBAR: SPECIES SELECTION ———
 st.sidebar.header("Select Species")
@@ -67,62 +79,74 @@ if species1 == species2:
     st.sidebar.error("Pick two different species.")
     st.stop()
 
-# ——— DB QUERY FUNCTION ———
-@st.cache_data
-def get_best_series_and_data(db_path, species, metab):
-    conn = sqlite3.connect(db_path)
-    q_best = """
-        SELECT r.id AS series_id, COUNT(*) AS n_pts
-          FROM series AS r
-          JOIN subjects AS s ON r.fk_subject_id = s.id
-          JOIN conc_time_values AS ctv ON r.id = ctv.fk_series_id
-         WHERE LOWER(s.species)        = ?
-           AND r.test_substance_dtxsid = ?
-         GROUP BY r.id
-         ORDER BY n_pts DESC
-         LIMIT 1
-    """
-    best = pd.read_sql_query(q_best, conn, params=(species, metab))
-    if best.empty or best.at[0, "n_pts"] < 2:
-        conn.close()
-        return None
-    series_id = best.at[0, "series_id"]
-    ct_df = pd.read_sql_query(
-        "SELECT time_hr, conc FROM conc_time_values WHERE fk_series_id = ?",
-        conn,
-        params=(series_id,),
-    )
-    conn.close()
-    ct_df["time_hr"] = pd.to_numeric(ct_df["time_hr"], errors="coerce")
-    ct_df["conc"]    = pd.to_numeric(ct_df["conc"],    errors="coerce")
-    ct_df = (
-        ct_df.dropna(subset=["time_hr", "conc"])
-             .sort_values("time_hr")
-             .reset_index(drop=True)
-    )
-    return ct_df if len(ct_df) >= 2 else None
+# ——— SIDEBAR: RENDERING MODE ———
+# Browser mode ships only the numeric series (Arrow) to a Vega-Lite chart
+render_mode = st.sidebar.radio("Plot rendering", ["Static images", "Interactive (browser)"])
+interactive = render_mode == "Interactive (browser)"
+
+diag_panel = st.sidebar.expander("Diagnostics")
+diag_panel.toggle("Record timings", key="diag_on")
+
+# ——— DB QUERY FUNCTIONS ———
+@st.cache_resource
+def get_series_cache():
+    return series_cache.SeriesCache(SERIES_CACHE_BYTES)
+
+@diagnostics.traced("best_series_data")
+def get_best_series_and_data(db_path, species, metab, role="administered"):
+    # one read-only frame per series per process, shared by every session (series_cache.py)
+    def load():
+        diagnostics.count("best_series_data.miss")
+        with cvt_data.connection(db_path) as conn:
+            return cvt_data.get_best_series_and_data(
+                conn, species, metab, role, store=series_store.open_store(db_path)
+            )
+    return get_series_cache().get_or_load((db_path, species, metab, role),
+                                          cvt_data.data_version(db_path), load)
+
+@diagnostics.traced("best_series_bulk")
+@st.cache_data(max_entries=256)
+def get_best_series_bulk(db_path, version, species_pair, chems, role="administered"):
+    diagnostics.count("best_series_bulk.miss")
+    with cvt_data.connection(db_path) as conn:
+        return cvt_data.best_series_bulk(conn, species_pair, chems, role)
+
+# ——— SHARED ITEMS & AVAILABILITY (ONE INDEXED LOOKUP PER SPECIES PAIR & ROLE) ———
+with diagnostics.span("availability"):
+    shared_admin = admin_matrix.shared(species1, species2)
+    shared_meta  = metab_matrix.shared(species1, species2)
+    version    = cvt_data.data_version(DB_PATH)
+    best_admin = get_best_series_bulk(DB_PATH, version, (species1, species2), tuple(shared_admin), "administered")
+    best_meta  = get_best_series_bulk(DB_PATH, version, (species1, species2), tuple(shared_meta),  "analyte")
+
+# ——— RENDER CACHE FOR OVERLAY TILES ———
+# Tiles are rendered once per (species pair, chemical, role, data version, style)
+# and shared by every session
+@st.cache_resource
+def get_tile_cache():
+    return render_cache.TileCache(disk_dir=TILE_CACHE_DIR)
+
+def overlay_tile(item, role, colors):
+    key = render_cache.tile_key((species1, species2), item, role, cvt_data.data_version(DB_PATH))
+    return get_tile_cache().get_or_render(key, lambda: render_cache.render_tile(item, [
+        (sp.capitalize(), colors[sp], get_best_series_and_data(DB_PATH, sp, item, role))
+        for sp in (species1, species2)
+    ]))
 
 # ——— TABS FOR ADMINISTERED DRUGS & METABOLITES ———
 tab_admin, tab_meta = st.tabs(["Administered Drugs", "Metabolites"])
 
-for tab, matrix, state_key, button_key, select_key, plot_key, label in [
-    (tab_admin, admin_matrix, 'shared_ready_admin', 'show_admin', 'select_admin', 'plot_admin', 'Administered Drugs'),
-    (tab_meta, metab_matrix, 'shared_ready_meta', 'show_meta', 'select_meta', 'plot_meta', 'Metabolites')
+for tab, shared, best, role, state_key, button_key, select_key, plot_key, label in [
+    (tab_admin, shared_admin, best_admin, 'administered', 'shared_ready_admin', 'show_admin', 'select_admin', 'plot_admin', 'Administered Drugs'),
+    (tab_meta, shared_meta, best_meta, 'analyte', 'shared_ready_meta', 'show_meta', 'select_meta', 'plot_meta', 'Metabolites')
 ]:
     with tab:
-        # Find shared items between species
-        shared_raw = matrix.at[species1, species2] if species1 != species2 else []
-        shared = shared_raw if shared_raw else []
         if not shared:
             st.error(f"No shared {label.lower()} for **{species1}** & **{species2}**.")
             continue
 
-        # Pre-filter items with ≥2 points in both species
-        available = []
-        for item in shared:
-            if get_best_series_and_data(DB_PATH, species1, item) is not None \
-               and get_best_series_and_data(DB_PATH, species2, item) is not None:
-                available.append(item)
+        # Items with ≥2 points in both species, from the bulk lookup
+        available = cvt_data.available_for_pair(best, species1, species2, shared)
 
         if not available:
             st.warning(f"No {label.lower()} with ≥2 points for both species.")
@@ -139,47 +163,42 @@ for tab, matrix, state_key, button_key, select_key, plot_key, label in [
             selected = st.multiselect(
                 f"Select {label} to plot", available, key=select_key
             )
-            if st.button(f"Plot selected {label}", key=plot_key) and selected:
+            if interactive:
+                log_y = st.toggle("Log y-axis", key=f"logy_{select_key}")
+
+            plotted_key = f"plotted_{select_key}"
+            clicked = st.button(f"Plot selected {label}", key=plot_key) and selected
+            if clicked:
+                st.session_state[plotted_key] = list(selected)
+
+            # Browser charts stay up across reruns (e.g. the log toggle)
+            if interactive and st.session_state.get(plotted_key):
+                colors = {species1: "#1f77b4", species2: "#ff7f0e"}
+                with diagnostics.span("fetch series"):
+                    frames = {
+                        (item, sp): get_best_series_and_data(DB_PATH, sp, item, role)
+                        for item in st.session_state[plotted_key]
+                        for sp in (species1, species2)
+                    }
+                with diagnostics.span("vega chart"):
+                    chart_data = vega_plots.overlay_data(frames)
+                    diagnostics.count("bytes_sent.chart_data",
+                                      int(chart_data.memory_usage(index=False).sum()))
+                    st.vega_lite_chart(chart_data, vega_plots.overlay_spec(colors, log_y))
+            elif clicked:
                 colors = {species1: "#1f77b4", species2: "#ff7f0e"}
-                n = len(selected)
-                ncols = 2
-                nrows = math.ceil(n / ncols)
-                fig, axes = plt.subplots(
-                    nrows, ncols,
-                    figsize=(ncols * 5, nrows * 3),
-                    constrained_layout=True
-                )
-                axes = axes.flatten()
-                fig.patch.set_facecolor('black')
-
-                for ax, item in zip(axes, selected):
-                    df1 = get_best_series_and_data(DB_PATH, species1, item)
-                    df2 = get_best_series_and_data(DB_PATH, species2, item)
-
-                    ax.plot(df1["time_hr"], df1["conc"],
-                            marker="o", linestyle="-",
-                            color=colors[species1],
-                            label=species1.capitalize())
-                    ax.plot(df2["time_hr"], df2["conc"],
-                            marker="s", linestyle="--",
-                            color=colors[species2],
-                            label=species2.capitalize())
-
-                    ax.set_facecolor('#222222')
-                    ax.tick_params(colors='white', which='both')
-                    ax.xaxis.label.set_color('white')
-                    ax.yaxis.label.set_color('white')
-                    ax.title.set_color('white')
-                    for spine in ax.spines.values():
-                        spine.set_color('white')
-                    ax.grid(color='gray', linestyle=':', linewidth=0.5)
-
-                    ax.set_title(item, fontsize=10)
-                    ax.set_xlabel("Time (hr)")
-                    ax.set_ylabel("Concentration")
-                    ax.legend(fontsize=6, facecolor='#333333', edgecolor='white', labelcolor='white')
-
-                for ax in axes[n:]:
-                    ax.set_visible(False)
-
-                st.pyplot(fig)
+
+                # One cached tile per chemical, laid out in a 2-column grid
+                with diagnostics.span("overlay tiles"):
+                    grid = st.columns(2)
+                    for i, item in enumerate(selected):
+                        png = overlay_tile(item, role, colors)
+                        diagnostics.count("bytes_sent.images", len(png))
+                        grid[i % 2].image(png)
+
+# ——— DIAGNOSTICS PANEL ———
+if diag is not None:
+    diagnostics.render_panel(diag_panel, diag, st.session_state.setdefault("diag_runs", []),
+                             DIAGNOSTICS_LOG)
+    diag_panel.caption("Series cache (this process, all sessions)")
+    diag_panel.dataframe([get_series_cache().stats()], hide_index=True)
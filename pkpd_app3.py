@@ -1,16 +1,34 @@
-import sqlite3
-import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
-import ast
+import numpy as np
+import io
 import math
+import os
 import uuid
-from streamlit.components.v1 import html
+
+import diagnostics
+import incidence
+
+# Everything else (pandas, matplotlib, scipy, the structure store) is imported inside
+# the function or branch that first needs it, keeping it off the startup path.
+# importlib's LazyLoader is no use here: Streamlit inspects the stack for every
+# widget, which touches each module in sys.modules and loads lazy ones anyway.
 
 # ——— CONFIG ———
 DB_PATH            = "cvt_db_20210607.sqlite"
-ADMIN_MATRIX_CSV   = "parallel_administered_drugs_matrix.csv"
-MET_MATRIX_CSV     = "parallel_metabolites_matrix.csv"
+INCIDENCE_DIR      = "parallel_matrices"
+TILE_CACHE_DIR     = None   # e.g. ".tile_cache" to keep rendered plots across restarts
+STRUCTURE_STORE    = "structures.sqlite"
+INVENTORY_DB       = "chemical_data.sqlite"   # from tox_data.py; functional-use filter if present
+DIAGNOSTICS_LOG    = None   # e.g. "diagnostics.jsonl" to append every recorded run
+SERIES_CACHE_BYTES = 256 * 1024 * 1024   # budget for cached series, shared by all sessions
+SPECIES_PALETTE    = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+                      "#8c564b", "#e377c2", "#bcbd22", "#17becf", "#7f7f7f"]
+SEARCH_LIMIT       = 50
+NCA_COLUMNS        = ["cmax", "tmax", "auc_last", "auc_inf", "half_life", "cl_per_dose", "r2_adj"]
+BAND_OPTIONS       = [(25, 75), (10, 90), (5, 95)]   # percentile bands for the all-series view
+
+# ——— DIAGNOSTICS (timings recorded only while the sidebar toggle is on) ———
+diag = diagnostics.start_run(st.session_state.get("diag_on", False), label="pkpd_app3")
 
 # ——— STREAMLIT PAGE CONFIG ———
 st.set_page_config(page_title="Cross-Species PK/PD Explorer", layout="wide")
@@ -30,25 +48,25 @@ st.markdown("""
     <div class="page-title">Cross-Species PK/PD Explorer</div>
     """, unsafe_allow_html=True)
 
-plt.style.use('dark_background')
-
 # ——— SESSION KEYS ———
 if 'shared_ready_admin' not in st.session_state:
     st.session_state['shared_ready_admin'] = False
 if 'shared_ready_meta' not in st.session_state:
     st.session_state['shared_ready_meta'] = False
 
-# ——— LOAD MATRICES ———
-@st.cache_data
-def load_matrix(path):
-    df = pd.read_csv(path, index_col=0)
-    return df.applymap(ast.literal_eval)
+# ——— LOAD MATRICES (memory-mapped incidence bitsets) ———
+@st.cache_resource(max_entries=4)
+def load_matrix(path, role, version):
+    return incidence.load_incidence(path, role)
 
-admin_matrix = load_matrix(ADMIN_MATRIX_CSV)
-metab_matrix = load_matrix(MET_MATRIX_CSV)
+with diagnostics.span("load matrices"):
+    admin_matrix = load_matrix(INCIDENCE_DIR, "administered",
+                               incidence.store_version(INCIDENCE_DIR, "administered"))
+    metab_matrix = load_matrix(INCIDENCE_DIR, "analyte",
+                               incidence.store_version(INCIDENCE_DIR, "analyte"))
 
 # ——— SPECIES SELECTION ———
-species_options = sorted(admin_matrix.index.str.lower().unique())
+species_options = admin_matrix.species
 st.sidebar.header("Select Species")
 species1 = st.sidebar.selectbox("Species 1", species_options,
                                 index=species_options.index("mouse") if "mouse" in species_options else 0)
@@ -58,188 +76,489 @@ if species1 == species2:
     st.sidebar.error("Pick two different species.")
     st.stop()
 
+# ——— SIDEBAR: RENDERING MODE ———
+# Browser mode ships only the numeric series (Arrow) to a Vega-Lite chart
+render_mode = st.sidebar.radio("Plot rendering", ["Static images", "Interactive (browser)"])
+interactive = render_mode == "Interactive (browser)"
+
+diag_panel = st.sidebar.expander("Diagnostics")
+diag_panel.toggle("Record timings", key="diag_on")
+
 # ——— DB QUERY ———
-@st.cache_data
-def get_best_series_and_data(db_path, species, metab):
-    conn = sqlite3.connect(db_path)
-    q = """
-      SELECT r.id AS series_id, COUNT(*) AS n_pts
-        FROM series r
-        JOIN subjects s ON r.fk_subject_id = s.id
-        JOIN conc_time_values ctv ON r.id = ctv.fk_series_id
-       WHERE LOWER(s.species)=? AND r.test_substance_dtxsid=?
-       GROUP BY r.id
-       ORDER BY n_pts DESC
-       LIMIT 1
-    """
-    best = pd.read_sql_query(q, conn, params=(species, metab))
-    if best.empty or best.at[0, "n_pts"] < 2:
-        conn.close()
+@st.cache_resource
+def get_series_cache():
+    import series_cache
+    return series_cache.SeriesCache(SERIES_CACHE_BYTES)
+
+@diagnostics.traced("best_series_data")
+def get_best_series_and_data(db_path, species, metab, role="administered"):
+    # one read-only frame per series per process, shared by every session (series_cache.py)
+    import cvt_data
+    import series_store
+    def load():
+        diagnostics.count("best_series_data.miss")
+        with cvt_data.connection(db_path) as conn:
+            return cvt_data.get_best_series_and_data(
+                conn, species, metab, role, store=series_store.open_store(db_path)
+            )
+    return get_series_cache().get_or_load((db_path, species, metab, role),
+                                          cvt_data.data_version(db_path), load)
+
+@diagnostics.traced("best_series_bulk")
+@st.cache_data(max_entries=256)
+def get_best_series_bulk(db_path, version, species_pair, chems, role="administered"):
+    diagnostics.count("best_series_bulk.miss")
+    import cvt_data
+    with cvt_data.connection(db_path) as conn:
+        return cvt_data.best_series_bulk(conn, species_pair, chems, role)
+
+@diagnostics.traced("series_band")
+@st.cache_resource(max_entries=512)
+def get_series_band(db_path, version, species, metab, role, percentiles):
+    # (median/mean/percentile band over every series, number of series); see series_bands.py
+    # shared across sessions without copies: the band frame is read-only, like series_cache's
+    diagnostics.count("series_band.miss")
+    import cvt_data
+    import series_bands
+    import series_cache
+    import series_store
+    with cvt_data.connection(db_path) as conn:
+        df, n = series_bands.series_band(conn, species, metab, role, store=series_store.open_store(db_path),
+                                         percentiles=percentiles)
+    return series_cache.read_only(df), n
+
+# ——— SHARED LISTS (bitset intersections; the DB is only queried once a list is shown) ———
+with diagnostics.span("shared lists"):
+    shared_admin_raw = admin_matrix.shared(species1, species2)
+    shared_meta_raw  = metab_matrix.shared(species1, species2)
+
+def available_for(role):
+    # one indexed lookup per species pair & role, cached across sessions
+    import cvt_data
+    shared = shared_admin_raw if role == "administered" else shared_meta_raw
+    with diagnostics.span("availability"):
+        best = get_best_series_bulk(DB_PATH, cvt_data.data_version(DB_PATH),
+                                    (species1, species2), tuple(shared), role)
+        return cvt_data.available_for_pair(best, species1, species2, shared)
+
+# ——— MATPLOTLIB (imported and styled on first plot) ———
+@st.cache_resource
+def load_pyplot():
+    import matplotlib.pyplot as plt
+    plt.style.use('dark_background')
+    return plt
+
+# ——— RENDER CACHE (per-chemical overlay tiles shared by all sessions) ———
+@st.cache_resource
+def get_tile_cache():
+    import render_cache
+    return render_cache.TileCache(disk_dir=TILE_CACHE_DIR)
+
+def overlay_tile(item, role, colors):
+    # colors: {species: hex}, one curve per species that has data, in that order
+    import cvt_data
+    import render_cache
+    load_pyplot()
+    key = render_cache.tile_key(tuple(colors), item, role, cvt_data.data_version(DB_PATH))
+    def render():
+        curves = [(sp.capitalize(), colors[sp], get_best_series_and_data(DB_PATH, sp, item, role))
+                  for sp in colors]
+        return render_cache.render_tile(item, [c for c in curves if c[2] is not None])
+    return get_tile_cache().get_or_render(key, render)
+
+def band_tile(item, role, colors, percentiles):
+    # same as overlay_tile, but each species' band over all of its series
+    import cvt_data
+    import render_cache
+    load_pyplot()
+    version = cvt_data.data_version(DB_PATH)
+    key = render_cache.tile_key(tuple(colors), item, role, version,
+                                view=f"band-{percentiles[0]}-{percentiles[1]}")
+    def render():
+        bands = [(sp.capitalize(), colors[sp],
+                  get_series_band(DB_PATH, version, sp, item, role, percentiles)[0]) for sp in colors]
+        return render_cache.render_tile(item, [b for b in bands if b[2] is not None],
+                                        plot=render_cache.plot_bands)
+    return get_tile_cache().get_or_render(key, render)
+
+# ——— STRUCTURES (local SDF store, see structure_store.py) ———
+@st.cache_resource
+def get_structure_store():
+    import structure_store
+    return structure_store.StructureStore(STRUCTURE_STORE)
+
+# ——— CHEMICAL INVENTORY (functional uses, loaded once per process) ———
+@st.cache_resource
+def get_inventory(path, mtime):
+    import inventory
+    return inventory.open_inventory(path)
+
+def inventory_or_none():
+    if not os.path.exists(INVENTORY_DB):
         return None
-    sid = best.at[0, "series_id"]
-    df = pd.read_sql_query(
-        "SELECT time_hr, conc FROM conc_time_values WHERE fk_series_id=?",
-        conn, params=(sid,)
-    )
-    conn.close()
-    df["time_hr"] = pd.to_numeric(df["time_hr"], errors="coerce")
-    df["conc"]    = pd.to_numeric(df["conc"],    errors="coerce")
-    df = df.dropna(subset=["time_hr","conc"]).sort_values("time_hr").reset_index(drop=True)
-    return df if len(df) >= 2 else None
-
-# ——— PRE-COMPUTE “AVAILABLE” LISTS FOR STRUCTURE TAB ———
-shared_admin_raw = admin_matrix.at[species1, species2] if species1 != species2 else []
-available_admin = [
-    chem for chem in shared_admin_raw
-    if get_best_series_and_data(DB_PATH, species1, chem) is not None
-   and get_best_series_and_data(DB_PATH, species2, chem) is not None
-]
-
-shared_meta_raw = metab_matrix.at[species1, species2] if species1 != species2 else []
-available_meta = [
-    chem for chem in shared_meta_raw
-    if get_best_series_and_data(DB_PATH, species1, chem) is not None
-   and get_best_series_and_data(DB_PATH, species2, chem) is not None
-]
-
-struct_options = sorted(set(available_admin + available_meta))
+    return get_inventory(INVENTORY_DB, os.path.getmtime(INVENTORY_DB))
+
+# ——— CHEMICAL SEARCH (FTS5 trigram sidecar over DTXSID, CAS and names) ———
+@st.cache_resource
+def get_chemical_search(db_path, inventory_db, version):
+    import chemical_search
+    return chemical_search.ensure_index(db_path, inventory_db=inventory_db)
+
+def chemical_picker(label, options, key):
+    # multiselect over `options`, narrowed by a type-ahead search box; picks survive new searches
+    import chemical_search
+    query = st.text_input(f"Search {label.lower()}", key=f"q_{key}",
+                          placeholder="name, CAS or DTXSID")
+    # the sidecar is only built once someone searches (a full scan of series); until then
+    # an already-built one still supplies labels, else the picker shows bare DTXSIDs
+    if not query.strip() and not chemical_search.is_fresh(DB_PATH, inventory_db=INVENTORY_DB):
+        return st.multiselect(f"Select {label} to plot", options, key=key)
+    # keyed on file mtimes rather than cvt_data.data_version, which would pull pandas into startup
+    inv_mtime = os.path.getmtime(INVENTORY_DB) if os.path.exists(INVENTORY_DB) else None
+    with diagnostics.span("search index"):
+        search = get_chemical_search(DB_PATH, INVENTORY_DB, (os.path.getmtime(DB_PATH), inv_mtime))
+    if query.strip():
+        with diagnostics.span("chemical search"):
+            hits = [chem for chem, _ in search.search(query, SEARCH_LIMIT, within=options)]
+        options = hits + [c for c in st.session_state.get(key, []) if c not in hits]
+        st.caption(f"{len(hits)} matching “{query.strip()}”" if hits else f"No match for “{query.strip()}”")
+    return st.multiselect(f"Select {label} to plot", options, key=key, format_func=search.label)
+
+# ——— CURVE SIMILARITY (feature matrix next to the DB, built on first use) ———
+@st.cache_resource
+def get_similarity_index(db_path, version):
+    import curve_similarity
+    return curve_similarity.ensure_index(db_path)
+
+# ——— PK MODEL FITS (run off the script thread, polled by a fragment) ———
+@st.cache_resource
+def get_fit_executor():
+    import pk_fit
+    return pk_fit.make_executor()
+
+@st.fragment(run_every=1.0)
+def poll_model_fits(fits_key):
+    # only rendered while fits are pending; the app rerun on completion drops it and its timer
+    jobs = st.session_state[fits_key]
+    pending = sum(not fut.done() for fut, _ in jobs.values())
+    if pending:
+        st.info(f"Fitting PK models… {pending} of {len(jobs)} series pending")
+        return
+    st.session_state[f"{fits_key}_done"] = True
+    st.rerun()
+
+def show_model_fits(fits_key, colors):
+    jobs = st.session_state.get(fits_key)
+    if not jobs:
+        return
+    if f"{fits_key}_png" in st.session_state:
+        st.image(st.session_state[f"{fits_key}_png"])
+        return
+    if not all(fut.done() for fut, _ in jobs.values()):
+        poll_model_fits(fits_key)
+        return
+
+    import pk_fit
+    import render_cache
+    plt = load_pyplot()
+    items = list(dict.fromkeys(item for item, _ in jobs))
+    ncols = 2
+    nrows = math.ceil(len(items) / ncols)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * 5, nrows * 3),
+                             constrained_layout=True)
+    axes = axes.flatten()
+    fig.patch.set_facecolor('black')
+    for ax, item in zip(axes, items):
+        for (job_item, sp), (fut, df) in jobs.items():
+            if job_item != item:
+                continue
+            ax.plot(df["time_hr"], df["conc"], marker="o", linestyle="none",
+                    color=colors[sp], label=sp.capitalize())
+            fit = pk_fit.best_fit(fut.result())
+            if fit is not None:
+                t_grid = np.linspace(df["time_hr"].min(), df["time_hr"].max(), 200)
+                ax.plot(t_grid, pk_fit.predict(fit["model"], fit["params"], t_grid),
+                        linestyle="-", color=colors[sp], label=f"{sp.capitalize()} {fit['model']} fit")
+        render_cache.style_axis(ax, item)
+    for ax in axes[len(items):]:
+        ax.set_visible(False)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", facecolor=fig.get_facecolor())
+    plt.close(fig)
+    st.session_state[f"{fits_key}_png"] = buf.getvalue()
+    st.image(st.session_state[f"{fits_key}_png"])
 
 # ——— TABS ———
-tab_admin, tab_meta, tab_struct = st.tabs([
-    "Administered Drugs", "Metabolites", "3D Structure Viewer"
+tab_admin, tab_meta, tab_multi, tab_similar, tab_struct = st.tabs([
+    "Administered Drugs", "Metabolites", "Multi-species", "Similar Curves", "3D Structure Viewer"
 ])
 
 # Administered & Metabolites plotting logic
-for tab, matrix, state_key, button_key, select_key, plot_key, label in [
-    (tab_admin, admin_matrix, 'shared_ready_admin', 'show_admin', 'select_admin', 'plot_admin', 'Administered Drugs'),
-    (tab_meta,  metab_matrix, 'shared_ready_meta',  'show_meta',  'select_meta',  'plot_meta',  'Metabolites')
+for tab, shared, role, state_key, button_key, select_key, plot_key, label in [
+    (tab_admin, shared_admin_raw, 'administered', 'shared_ready_admin', 'show_admin', 'select_admin', 'plot_admin', 'Administered Drugs'),
+    (tab_meta,  shared_meta_raw,  'analyte',      'shared_ready_meta',  'show_meta',  'select_meta',  'plot_meta',  'Metabolites')
 ]:
     with tab:
-        shared_raw = matrix.at[species1, species2] if species1 != species2 else []
-        shared = shared_raw or []
         if not shared:
             st.error(f"No shared {label.lower()} for **{species1}** & **{species2}**.")
             continue
 
-        available = [
-            item for item in shared
-            if get_best_series_and_data(DB_PATH, species1, item) is not None
-           and get_best_series_and_data(DB_PATH, species2, item) is not None
-        ]
-        if not available:
-            st.warning(f"No {label.lower()} with ≥2 points for both species.")
-            continue
-
-        st.header(f"{len(available)} {label} Available for Plotting")
+        st.header(f"{len(shared)} Shared {label}")
         if st.button(f"Show {label}", key=button_key):
             st.session_state[state_key] = True
 
+        # When button pressed: look up which have data for both species, then select & plot
         if st.session_state[state_key]:
-            selected = st.multiselect(
-                f"Select {label} to plot", available, key=select_key
-            )
-            if st.button(f"Plot selected {label}", key=plot_key) and selected:
+            available = available_for(role)
+            if not available:
+                st.warning(f"No {label.lower()} with ≥2 points for both species.")
+                continue
+            st.caption(f"{len(available)} with ≥2 points for both species")
+            inv = inventory_or_none()
+            if inv is not None:
+                with diagnostics.span("functional use filter"):
+                    use_counts = inv.use_counts(available)
+                    uses = st.multiselect("Filter by functional use", sorted(use_counts),
+                                          format_func=lambda u: f"{u} ({use_counts[u]})",
+                                          key=f"uses_{select_key}")
+                    available = inv.filter(available, uses)
+                if uses:
+                    st.caption(f"{len(available)} with any of the selected uses")
+                with st.expander("Inventory attributes"):
+                    st.dataframe(inv.attributes(available))
+            selected = chemical_picker(label, available, select_key)
+            fit_models = st.checkbox("Fit 1-/2-compartment models", key=f"fit_{select_key}")
+            # every series per species instead of only the one with the most points
+            aggregate = st.toggle("All series: median & percentile band", key=f"agg_{select_key}")
+            if aggregate:
+                percentiles = st.radio("Band", BAND_OPTIONS, index=1, horizontal=True, key=f"band_{select_key}",
+                                       format_func=lambda p: f"{p[0]}th–{p[1]}th percentile")
+            elif interactive:
+                log_y = st.toggle("Log y-axis", key=f"logy_{select_key}")
+
+            plotted_key = f"plotted_{select_key}"
+            fits_key = f"fits_{select_key}"
+            clicked = st.button(f"Plot selected {label}", key=plot_key) and selected
+            if clicked:
+                st.session_state[plotted_key] = list(selected)
+            # browser charts stay up across reruns (e.g. the log toggle); images only on click,
+            # or on the one rerun that shows the finished model fits
+            fits_done = st.session_state.pop(f"{fits_key}_done", False)
+            if clicked or fits_done or (interactive and st.session_state.get(plotted_key)):
+                plotted = st.session_state[plotted_key]
                 colors = {species1: "#1f77b4", species2: "#ff7f0e"}
-                n = len(selected)
-                ncols = 2
-                nrows = math.ceil(n / ncols)
-                fig, axes = plt.subplots(
-                    nrows, ncols,
-                    figsize=(ncols * 5, nrows * 3),
-                    constrained_layout=True
-                )
-                axes = axes.flatten()
-                fig.patch.set_facecolor('black')
-
-                for ax, item in zip(axes, selected):
-                    df1 = get_best_series_and_data(DB_PATH, species1, item)
-                    df2 = get_best_series_and_data(DB_PATH, species2, item)
-                    ax.plot(df1["time_hr"], df1["conc"], marker="o", linestyle="-",
-                            color=colors[species1], label=species1.capitalize())
-                    ax.plot(df2["time_hr"], df2["conc"], marker="s", linestyle="--",
-                            color=colors[species2], label=species2.capitalize())
-
-                    ax.set_facecolor('#222222')
-                    ax.tick_params(colors='white', which='both')
-                    ax.xaxis.label.set_color('white')
-                    ax.yaxis.label.set_color('white')
-                    ax.title.set_color('white')
-                    for spine in ax.spines.values():
-                        spine.set_color('white')
-                    ax.grid(color='gray', linestyle=':', linewidth=0.5)
-
-                    ax.set_title(item, fontsize=10)
-                    ax.set_xlabel("Time (hr)")
-                    ax.set_ylabel("Concentration")
-                    ax.legend(
-                        fontsize=6, facecolor='#333333', edgecolor='white', labelcolor='white'
-                    )
-
-                for ax in axes[n:]:
-                    ax.set_visible(False)
-
-                st.pyplot(fig)
+                nca_inputs = {}
+                with diagnostics.span("fetch series"):
+                    for item in plotted:
+                        nca_inputs[(item, species1)] = get_best_series_and_data(DB_PATH, species1, item, role)
+                        nca_inputs[(item, species2)] = get_best_series_and_data(DB_PATH, species2, item, role)
+
+                import nca
+                import pk_fit
+                import vega_plots
+                col_plot, col_nca = st.columns([3, 2])
+                with col_plot:
+                    if aggregate:
+                        import cvt_data
+                        version = cvt_data.data_version(DB_PATH)
+                        with diagnostics.span("series bands"):
+                            bands = {(item, sp): get_series_band(DB_PATH, version, sp, item, role, percentiles)
+                                     for item in plotted for sp in (species1, species2)}
+                        if interactive:
+                            with diagnostics.span("vega chart"):
+                                chart_data = vega_plots.band_data({k: df for k, (df, _) in bands.items()})
+                                diagnostics.count("bytes_sent.chart_data",
+                                                  int(chart_data.memory_usage(index=False).sum()))
+                                st.vega_lite_chart(chart_data, vega_plots.band_spec(colors))
+                        else:
+                            with diagnostics.span("band tiles"):
+                                grid = st.columns(2)
+                                for i, item in enumerate(plotted):
+                                    png = band_tile(item, role, colors, percentiles)
+                                    diagnostics.count("bytes_sent.images", len(png))
+                                    grid[i % 2].image(png)
+                        st.caption("Median and geometric mean (dotted) across all series; "
+                                   f"shaded: {percentiles[0]}th–{percentiles[1]}th percentile where "
+                                   "at least two series overlap.")
+                    elif interactive:
+                        with diagnostics.span("vega chart"):
+                            chart_data = vega_plots.overlay_data(nca_inputs)
+                            diagnostics.count("bytes_sent.chart_data",
+                                              int(chart_data.memory_usage(index=False).sum()))
+                            st.vega_lite_chart(chart_data, vega_plots.overlay_spec(colors, log_y))
+                    else:
+                        with diagnostics.span("overlay tiles"):
+                            grid = st.columns(2)
+                            for i, item in enumerate(plotted):
+                                png = overlay_tile(item, role, colors)
+                                diagnostics.count("bytes_sent.images", len(png))
+                                grid[i % 2].image(png)
+                with col_nca:
+                    if aggregate:
+                        st.subheader("Series")
+                        counts = {"chemical": plotted}
+                        for sp in (species1, species2):
+                            counts[sp.capitalize()] = [bands[(item, sp)][1] for item in plotted]
+                        st.dataframe(counts, hide_index=True)
+                    st.subheader("NCA (best series)" if aggregate else "NCA")
+                    with diagnostics.span("nca"):
+                        nca_table = nca.nca_frames(nca_inputs)
+                        nca_table.index.names = ["chemical", "species"]
+                        st.dataframe(nca_table[NCA_COLUMNS].round(4))
+
+                if fit_models and clicked:
+                    executor = get_fit_executor()
+                    st.session_state.pop(f"{fits_key}_png", None)
+                    st.session_state[fits_key] = {
+                        key: (pk_fit.submit_fit(executor, df), df)
+                        for key, df in nca_inputs.items()
+                    }
+                if fit_models and fits_key in st.session_state:
+                    st.subheader("PK model fits")
+                    show_model_fits(fits_key, colors)
 
 
+# ——— MULTI-SPECIES (N-way queries over the inverted chemical index) ———
+with tab_multi:
+    st.header("Multi-species Comparison")
+    multi_label = st.radio("Chemicals", ["Administered Drugs", "Metabolites"],
+                           horizontal=True, key="multi_role")
+    multi_role   = "administered" if multi_label == "Administered Drugs" else "analyte"
+    multi_matrix = admin_matrix if multi_role == "administered" else metab_matrix
+
+    col_all, col_any, col_none = st.columns(3)
+    all_of  = col_all.multiselect("Data in all of", species_options,
+                                  default=[species1, species2], key="multi_all")
+    any_of  = col_any.multiselect("…and in at least one of", species_options, key="multi_any")
+    none_of = col_none.multiselect("…but in none of", species_options, key="multi_none")
+
+    with diagnostics.span("n-way query"):
+        multi_chems = multi_matrix.query(all_of, any_of, none_of)
+    st.subheader(f"{len(multi_chems)} {multi_label}")
+
+    multi_species = list(dict.fromkeys(all_of + any_of))
+    multi_selected = chemical_picker(multi_label, multi_chems, "multi_select")
+    if st.button("Plot across species", key="multi_plot") and multi_selected and multi_species:
+        colors = {sp: SPECIES_PALETTE[i % len(SPECIES_PALETTE)] for i, sp in enumerate(multi_species)}
+        if interactive:
+            import vega_plots
+            with diagnostics.span("fetch series"):
+                frames = {(item, sp): get_best_series_and_data(DB_PATH, sp, item, multi_role)
+                          for item in multi_selected for sp in multi_species}
+            st.vega_lite_chart(vega_plots.overlay_data(frames), vega_plots.overlay_spec(colors))
+        else:
+            with diagnostics.span("overlay tiles"):
+                grid = st.columns(2)
+                for i, item in enumerate(multi_selected):
+                    png = overlay_tile(item, multi_role, colors)
+                    diagnostics.count("bytes_sent.images", len(png))
+                    grid[i % 2].image(png)
+
+
+# ——— SIMILAR CURVES (nearest neighbours over every best series) ———
+with tab_similar:
+    st.header("Similar PK Curves")
+    st.caption("Curves are compared on shape (log conc / Cmax over time / Tlast) "
+               "plus Cmax, Tmax, Tlast, AUC and half-life.")
+    if st.toggle("Load similarity index", key="sim_on"):
+        import cvt_data
+        with st.spinner("Building curve features…"), diagnostics.span("similarity index"):
+            sim_index = get_similarity_index(DB_PATH, cvt_data.data_version(DB_PATH))
+
+        col_role, col_sp, col_chem = st.columns([1, 1, 2])
+        sim_label = col_role.radio("Chemicals", ["Administered Drugs", "Metabolites"], key="sim_role")
+        sim_role  = "administered" if sim_label == "Administered Drugs" else "analyte"
+        sim_sp    = col_sp.selectbox("Query species", species_options,
+                                     index=species_options.index(species1), key="sim_species")
+        sim_chems = sim_index.chemicals(sim_sp, sim_role)
+        sim_chem  = col_chem.selectbox("Query chemical", sim_chems, key="sim_chem")
+
+        col_in, col_k = st.columns([1, 2])
+        sim_in = col_in.selectbox("Match in species", ["Any species"] + species_options, key="sim_in")
+        sim_k  = col_k.slider("Matches", 1, 25, 5, key="sim_k")
+
+        if sim_chem is None:
+            st.warning(f"No {sim_label.lower()} with ≥3 points in {sim_sp}.")
+        else:
+            # across species, the same chemical's curve is the most telling match, so keep it
+            with diagnostics.span("similarity query"):
+                matches = sim_index.nearest(sim_index.row(sim_sp, sim_chem, sim_role), sim_k,
+                                            species=None if sim_in == "Any species" else sim_in,
+                                            exclude_chemical=sim_in in ("Any species", sim_sp))
+            if matches.empty:
+                st.info("No other curves to compare against.")
+            else:
+                import curve_similarity
+                col_plot, col_table = st.columns([3, 2])
+                with col_table:
+                    st.dataframe(matches.drop(columns="role").round(4), hide_index=True)
+                with col_plot:
+                    # every curve rescaled the way the features see it
+                    labels = [(sim_sp, sim_chem)] + list(zip(matches["species"], matches["dtxsid"]))
+                    colors = {f"{sp} · {chem}": SPECIES_PALETTE[i % len(SPECIES_PALETTE)]
+                              for i, (sp, chem) in enumerate(labels)}
+                    with diagnostics.span("fetch series"):
+                        frames = {label: get_best_series_and_data(DB_PATH, sp, chem, sim_role)
+                                  for label, (sp, chem) in zip(colors, labels)}
+                    frames = {label: curve_similarity.normalized_frame(df)
+                              for label, df in frames.items() if df is not None}
+                    if interactive:
+                        import vega_plots
+                        chart_data = vega_plots.overlay_data(
+                            {("normalized", label): df for label, df in frames.items()})
+                        st.vega_lite_chart(chart_data, vega_plots.overlay_spec(colors, log_y=True, columns=1))
+                    else:
+                        import render_cache
+                        load_pyplot()
+                        st.image(render_cache.render_tile(
+                            f"{sim_sp} · {sim_chem} (normalized)",
+                            [(label, colors[label], df) for label, df in frames.items()]))
+
 # ——— 3D STRUCTURE VIEWER ———
 with tab_struct:
     st.header("3D Structure Viewer")
-    st.write("Select a chemical (DTXSID or CAS) to display its 3D structure:")
-    if not struct_options:
-        st.warning("No shared chemicals with ≥2 points to visualize.")
-    else:
-        chem = st.selectbox("Select a chemical", struct_options)
-
-        view_style = st.radio(
-            "Choose display style",
-            ["Ball and Stick", "Sticks", "Wire-Frame", "Space-Filling"],
-            horizontal=True
-        )
-        animate = st.checkbox("Animate")  # ← new!
-
-        style_map = {
-            "Ball and Stick": "{sphere:{scale:0.3},stick:{radius:0.2}}",
-            "Sticks":          "{stick:{radius:0.2}}",
-            "Wire-Frame":      "{line:{linewidth:1}}",
-            "Space-Filling":   "{sphere:{scale:1.0}}"
-        }
-        style_js = style_map[view_style]
-        spin_js   = "viewer.spin(true);" if animate else ""
-
-        if chem:
-            div_id = f"viewer_{uuid.uuid4().hex}"
-            svc = f"xref/RN/{chem}" if "-" in chem else f"name/{chem}"
-            sdf_url = (
-                "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/"
-                f"{svc}/SDF?record_type=3d"
+    # The viewer (availability lookups, structure store, 3Dmol component) loads on demand
+    if st.toggle("Load structure viewer", key="struct_viewer"):
+        struct_options = sorted(set(available_for("administered") + available_for("analyte")))
+        st.write("Select a chemical (DTXSID or CAS) to display its 3D structure:")
+        if not struct_options:
+            st.warning("No shared chemicals with ≥2 points to visualize.")
+        else:
+            chem = st.selectbox("Select a chemical", struct_options)
+
+            view_style = st.radio(
+                "Choose display style",
+                ["Ball and Stick", "Sticks", "Wire-Frame", "Space-Filling"],
+                horizontal=True
             )
+            animate = st.checkbox("Animate")  # ← new!
+
+            style_map = {
+                "Ball and Stick": "{sphere:{scale:0.3},stick:{radius:0.2}}",
+                "Sticks":          "{stick:{radius:0.2}}",
+                "Wire-Frame":      "{line:{linewidth:1}}",
+                "Space-Filling":   "{sphere:{scale:1.0}}"
+            }
+            style_js = style_map[view_style]
 
-            component = f"""
-            <script src="https://3Dmol.org/build/3Dmol-min.js"></script>
-            <div id="{div_id}" style="width:100%; height:500px; background-color:#0E1117;"></div>
-            <script>
-            (function() {{
-              const tgt = document.getElementById("{div_id}");
-              const viewer = $3Dmol.createViewer(tgt, {{ backgroundColor: 'black' }});
-              fetch("{sdf_url}")
-                .then(res => {{
-                  if (!res.ok) throw new Error('HTTP ' + res.status);
-                  return res.text();
-                }})
-                .then(sdf => {{
-                  viewer.addModel(sdf, 'sdf');
-                  viewer.setStyle({{}}, {style_js});
-                  viewer.zoomTo();
-                  viewer.render();
-                  {spin_js}  // ← spins if animate==True
-                }})
-                .catch(err => {{
-                  tgt.innerHTML = '<p style="color:red;">Could not load structure:<br>'
-                                 + err.message + '</p>';
-                  console.error(err);
-                }});
-            }})();
-            </script>
-            """
-            html(component, height=550)
+            if chem:
+                import structure_store
+                from streamlit.components.v1 import html
+                with diagnostics.span("structure lookup"):
+                    sdf = structure_store.get_or_fetch(get_structure_store(), chem)
+                if sdf is None:
+                    st.error(f"No structure found for {chem}.")
+                else:
+                    js_src = structure_store.script_src(st.get_option("server.baseUrlPath"))
+                    component = structure_store.viewer_html(f"viewer_{uuid.uuid4().hex}", sdf,
+                                                            style_js, animate, js_src)
+                    diagnostics.count("bytes_sent.html", len(component))
+                    html(component, height=550)
 
+# ——— DIAGNOSTICS PANEL ———
+if diag is not None:
+    diagnostics.render_panel(diag_panel, diag, st.session_state.setdefault("diag_runs", []),
+                             DIAGNOSTICS_LOG)
+    diag_panel.caption("Series cache (this process, all sessions)")
+    diag_panel.dataframe([get_series_cache().stats()], hide_index=True)
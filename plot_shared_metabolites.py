@@ -1,11 +1,12 @@
-import sqlite3
-import pandas as pd
 import matplotlib.pyplot as plt
-import ast
+
+import cvt_data
+import incidence
+import series_store
 
 # === USER INPUTS ===
 db_path      = "cvt_db_20210607.sqlite"
-matrix_csv   = "parallel_metabolites_matrix.csv"  # CSV containing species×species lists
+matrix_dir   = "parallel_matrices"  # compact species×chemical incidence store
 species1     = "mouse"
 species2     = "rat"
 
@@ -15,17 +16,18 @@ colors = {
     species2: "tab:orange"
 }
 
-# 1) Read the precomputed analyte‐intersection matrix
-matrix_df = pd.read_csv(matrix_csv, index_col=0)
-matrix    = matrix_df.applymap(ast.literal_eval)
+# 1) Load the precomputed species×chemical incidence store
+matrix = incidence.load_incidence(matrix_dir, role="analyte")
 
 # 2) Get shared metabolites for the two chosen species
-shared_metabs = matrix.at[species1, species2]
+shared_metabs = matrix.shared(species1, species2)
 if not shared_metabs:
     raise ValueError(f"No shared analytes found for {species1} & {species2}")
 
 # 3) Open DB and collect only the metabolites that have ≥2 points for both species
-conn = sqlite3.connect(db_path)
+#    (best series per species comes from the precomputed best_series index)
+conn = cvt_data.connect(db_path)
+store = series_store.open_store(db_path)  # None → read points from SQL
 valid_entries = []  # will hold tuples (metab, {0: df1, 1: df2})
 
 for metab in shared_metabs:
@@ -33,46 +35,10 @@ for metab in shared_metabs:
     valid = True
 
     for idx, sp in enumerate([species1, species2]):
-        # find the series_id with the most time‐points
-        q_best = """
-            SELECT r.id AS series_id,
-                   COUNT(*) AS n_pts
-              FROM series AS r
-              JOIN subjects AS s
-                ON r.fk_subject_id = s.id
-              JOIN conc_time_values AS ctv
-                ON r.id = ctv.fk_series_id
-             WHERE LOWER(s.species)        = ?
-               AND r.test_substance_dtxsid = ?
-             GROUP BY r.id
-             ORDER BY n_pts DESC
-             LIMIT 1
-        """
-        best = pd.read_sql_query(q_best, conn, params=(sp.lower(), metab))
-
-        if best.empty or best.at[0, 'n_pts'] < 2:
+        df = cvt_data.get_best_series_and_data(conn, sp, metab, role="analyte", store=store)
+        if df is None:
             valid = False
             break
-
-        series_id = best.at[0, 'series_id']
-        # load & clean concentration–time
-        q_ct = """
-            SELECT time_hr, conc
-              FROM conc_time_values
-             WHERE fk_series_id = ?
-        """
-        df = pd.read_sql_query(q_ct, conn, params=(series_id,))
-        df['time_hr'] = pd.to_numeric(df['time_hr'], errors='coerce')
-        df['conc']    = pd.to_numeric(df['conc'],    errors='coerce')
-        df = (df
-              .dropna(subset=['time_hr','conc'])
-              .sort_values('time_hr')
-              .reset_index(drop=True))
-
-        if len(df) < 2:
-            valid = False
-            break
-
         ct_data[idx] = df
 
     if valid:
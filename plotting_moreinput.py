@@ -1,117 +1,75 @@
-import sqlite3
-import pandas as pd
 import matplotlib.pyplot as plt
-import random
+import pandas as pd
+
+import chemical_search
+import cohort
+import cvt_data
+import series_store
 
 # Path to your SQLite database
 db_path = "cvt_db_20210607.sqlite"
-conn    = sqlite3.connect(db_path)
+conn    = cvt_data.connect(db_path)
 
 # === USER INPUTS ===
 species      = "mouse"            # e.g. "mouse", "human", "rat"
 analyte_name = "dichloromethane"  # e.g. "Caffeine", "Aspirin", etc.
+sex          = None               # "male", "female", or None for any
+age          = None               # (lo, hi) in the DB's age units; None bound = open
+weight_kg    = None               # e.g. (0.2, 0.3) for 200–300 g
+max_curves   = 25                 # overlay at most this many series
 
-# 1) Pick a random subject that has at least one series for this analyte
-query_subjects = """
-SELECT DISTINCT s.id
-  FROM subjects AS s
-  JOIN series   AS r ON s.id = r.fk_subject_id
- WHERE s.species               = ?
-   AND r.analyte_name_original = ?
-"""
-subject_ids_df = pd.read_sql_query(query_subjects,
-                                   conn,
-                                   params=(species, analyte_name))
-random_subject_id = random.choice(subject_ids_df['id'].tolist())
-
-# 2) Pick a random series for that subject + analyte
-query_series = """
-SELECT id
-  FROM series
- WHERE fk_subject_id           = ?
-   AND analyte_name_original   = ?
-"""
-series_ids_df = pd.read_sql_query(query_series,
-                                  conn,
-                                  params=(random_subject_id, analyte_name))
-random_series_id = random.choice(series_ids_df['id'].tolist())
-
-# 3) Pull subject metadata
-meta_df = pd.read_sql_query(
-    """
-    SELECT sex, age, age_category, height, weight_kg
-      FROM subjects
-     WHERE id = ?
-    """,
-    conn,
-    params=(random_subject_id,)
+# 0) Series recorded under exactly this analyte name (series.analyte_name_original)
+named = pd.read_sql_query(
+    "SELECT id FROM series WHERE analyte_name_original = ?", conn, params=(analyte_name,)
 )
-meta = meta_df.iloc[0]
-
-# 3a) Coerce numeric fields (empty or invalid → NaN)
-age_num    = pd.to_numeric(meta['age'],    errors='coerce')
-height_num = pd.to_numeric(meta['height'], errors='coerce')
-weight_num = pd.to_numeric(meta['weight_kg'], errors='coerce')
+if named.empty:
+    # only suggest; the search index matches casing, CAS, DTXSID and typos too
+    search = chemical_search.ensure_index(db_path)
+    hint = ", ".join(f"'{term}'" for _, term in search.search(analyte_name, limit=5))
+    raise ValueError(f"No series named '{analyte_name}'" + (f"; did you mean {hint}?" if hint else ""))
 
-# 3b) Build a list of non-null metadata strings
-meta_parts = []
-if isinstance(meta['sex'], str) and meta['sex'].strip():
-    meta_parts.append(f"Sex: {meta['sex']}")
-if pd.notna(age_num):
-    age_str = f"Age: {int(age_num)}"
-    if isinstance(meta['age_category'], str) and meta['age_category'].strip():
-        age_str += f" ({meta['age_category']})"
-    meta_parts.append(age_str)
-if pd.notna(height_num):
-    meta_parts.append(f"Height: {height_num} cm")
-if pd.notna(weight_num):
-    meta_parts.append(f"Weight: {weight_num} kg")
-
-meta_line = " · ".join(meta_parts)  # empty if no metadata
-
-# 4) Load and clean concentration–time data
-conc_time_df = pd.read_sql_query(
-    """
-    SELECT time_hr, conc
-      FROM conc_time_values
-     WHERE fk_series_id = ?
-    """,
-    conn,
-    params=(random_series_id,)
+# 1) Those series whose subject fits the cohort (metadata normalized once, see cohort.py)
+matches = cohort.open_cohort(db_path).query(
+    species=species, sex=sex, age=age, weight_kg=weight_kg, min_pts=0
 )
+matches = matches[matches["series_id"].isin(named["id"])]
+if matches.empty:
+    raise ValueError(f"No {species} series for '{analyte_name}' in this cohort")
+print(f"{len(matches)} series from {matches['subject_id'].nunique()} subjects")
+shown = matches.head(max_curves)
 
-# 4a) Convert to numeric, coercing errors to NaN
-conc_time_df['time_hr'] = pd.to_numeric(conc_time_df['time_hr'], errors='coerce')
-conc_time_df['conc']    = pd.to_numeric(conc_time_df['conc'],    errors='coerce')
-
-# 4b) Drop any rows that failed to parse
-conc_time_df = conc_time_df.dropna(subset=['time_hr', 'conc'])
+# 2) Load the cleaned, time-sorted concentration–time data
+#    (from the memory-mapped series store when one has been built, else from SQL)
+store = series_store.open_store(db_path)
 
-# 4c) Sort by time
-conc_time_df = conc_time_df.sort_values(by='time_hr').reset_index(drop=True)
-
-# 5) Plot
+# 3) Overlay every matching series, labelled with its subject's metadata
 plt.figure(figsize=(10, 6))
-plt.plot(
-    conc_time_df['time_hr'],
-    conc_time_df['conc'],
-    marker='o',
-    linestyle='-',
-    label='Raw Conc'
-)
+for _, row in shown.iterrows():
+    conc_time_df = cvt_data.load_series(conn, row["series_id"], store=store)
+    meta_line = cohort.describe(row)
+    plt.plot(
+        conc_time_df['time_hr'],
+        conc_time_df['conc'],
+        marker='o',
+        linestyle='-',
+        label=f"Subject {row['subject_id']}" + (f" · {meta_line}" if meta_line else "")
+    )
+conn.close()
 
-# 6) Annotate
+# 4) Annotate
+filters = [f"sex: {sex}" if sex else "", f"age: {age}" if age else "",
+           f"weight: {weight_kg} kg" if weight_kg else ""]
 plt.suptitle(
-    f"Subject {random_subject_id} · Species: {species} · Analyte: {analyte_name}",
+    f"Species: {species} · Analyte: {analyte_name}",
     y=0.98,
     fontsize=12
 )
-if meta_line:
-    plt.title(meta_line, fontsize=10)
+plt.title(" · ".join([f for f in filters if f] +
+                     [f"{len(shown)} of {len(matches)} series"]), fontsize=10)
 
 plt.xlabel("Time (hr)")
 plt.ylabel("Concentration")
-plt.legend()
+plt.legend(fontsize=7)
 plt.grid(True)
 plt.tight_layout()
 plt.show()
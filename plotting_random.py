@@ -1,13 +1,15 @@
-import sqlite3
 import pandas as pd
 import matplotlib.pyplot as plt
 import random
 
+import cvt_data
+import series_store
+
 # Path to the uploaded SQLite file
 db_path = "cvt_db_20210607.sqlite"
 
 # Connect to the database
-conn = sqlite3.connect(db_path)
+conn = cvt_data.connect(db_path)
 
 # Choose species and pick a random subject and series
 species = "human"
@@ -22,23 +24,9 @@ series_ids = pd.read_sql_query(
 )
 random_series_id = random.choice(series_ids['id'].tolist())
 
-# Fetch and sort the concentration–time data
-conc_time_df = pd.read_sql_query(
-    """
-    SELECT time_hr, conc
-    FROM conc_time_values
-    WHERE fk_series_id = ?
-    """,
-    conn,
-    params=(random_series_id,),
-)
-
-# Ensure numeric types
-conc_time_df['time_hr'] = conc_time_df['time_hr'].astype(float)
-conc_time_df['conc']    = conc_time_df['conc'].astype(float)
-
-# **Sort by time before plotting**
-conc_time_df = conc_time_df.sort_values(by='time_hr').reset_index(drop=True)
+# Fetch the cleaned, time-sorted concentration–time data
+# (from the memory-mapped series store when one has been built, else from SQL)
+conc_time_df = cvt_data.load_series(conn, random_series_id, store=series_store.open_store(db_path))
 
 # Plot
 plt.figure(figsize=(10, 6))
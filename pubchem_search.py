@@ -1,6 +1,55 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
 import pubchempy as pcp
 import requests
 
+import incidence
+
+'''
+PubChem lookups.
+
+get_compound_by_cas() is the original one-off lookup. PubChemResolver is the
+bulk path: it resolves thousands of CAS/DTXSID identifiers to CIDs and basic
+properties on a thread pool, and keeps every answer (misses included) in a local
+SQLite cache, so reruns only go to the network for identifiers never seen.
+
+  - one RateLimiter (LIMITER) is shared by all workers and by the structure
+    prefetch (structure_store.py), holding the whole process to PubChem's
+    5 requests/second;
+  - fetch() retries 429/5xx responses and connection errors with exponential
+    backoff (honouring Retry-After); 404 means "not found" and is cached as such;
+  - properties are fetched in batches of CIDs, not one request per compound;
+  - base_url is configurable, so the resolver can run against a local stub server.
+'''
+
+PUG_URL          = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+CACHE_PATH       = "pubchem_cache.sqlite"
+RATE             = 5        # requests/second, PubChem's published limit
+MAX_WORKERS      = 8
+RETRIES          = 4
+BACKOFF          = 0.5      # seconds, doubled on every retry
+TIMEOUT          = 30
+PROPERTY_BATCH   = 100
+PROPERTIES       = ("MolecularFormula", "MolecularWeight", "CanonicalSMILES", "InChIKey", "IUPACName")
+RETRY_STATUS     = {429, 500, 502, 503, 504}
+_FAILED          = object()
+
+CACHE_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS resolved (
+        ident      TEXT PRIMARY KEY,
+        cid        INTEGER,
+        properties TEXT,
+        fetched_at REAL NOT NULL
+    );
+"""
+
+
 def get_compound_by_cas(casrn):
     # First try with PubChemPy
     try:
@@ -30,12 +79,192 @@ def get_compound_by_cas(casrn):
 
     return None
 
-# Example usage
-# cas_number = "50-00-0"  # Formaldehyde
-cas_number = "14762-75-5"
-compound_info = get_compound_by_cas(cas_number)
 
-if compound_info:
-    print("Compound Info:", compound_info)
-else:
-    print("❌ Compound not found")
+# ——— BULK RESOLVER ———
+def lookup_routes(ident):
+    # DSSTox ids are PubChem registry ids; CAS numbers are RN xrefs; names last.
+    # Identifiers can be free text (mol_stream.py), so '/', '?' or '#' must not end the path segment
+    segment = quote(ident, safe="")
+    if ident.upper().startswith("DTXSID"):
+        yield f"xref/RegistryID/{segment}"
+    elif "-" in ident:
+        yield f"xref/RN/{segment}"
+    yield f"name/{segment}"
+
+
+class RateLimiter:
+    def __init__(self, rate=RATE):
+        self.interval = 1.0 / rate
+        self._next    = 0.0
+        self._lock    = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+LIMITER = RateLimiter()     # PubChem's limit is per client, so one per process
+
+
+def fetch(session, url, limiter=LIMITER, retries=RETRIES, backoff=BACKOFF, **kwargs):
+    # response, 404 included; raises for other errors once the retries are spent
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            res = session.get(url, timeout=TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+        if res.status_code in RETRY_STATUS and attempt < retries:
+            retry_after = res.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+            time.sleep(delay)
+            continue
+        if res.status_code != 404:
+            res.raise_for_status()
+        return res
+
+
+class PubChemResolver:
+    def __init__(self, cache_path=CACHE_PATH, base_url=PUG_URL, rate=RATE,
+                 max_workers=MAX_WORKERS, retries=RETRIES, backoff=BACKOFF):
+        self.base_url    = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.retries     = retries
+        self.backoff     = backoff
+        # a non-default rate (e.g. against a local stub) gets its own limiter
+        self.limiter     = LIMITER if rate == RATE else RateLimiter(rate)
+        self.requests    = 0
+        self.failed      = []
+        self._local      = threading.local()
+        self._lock       = threading.Lock()
+        self._cache      = sqlite3.connect(cache_path, check_same_thread=False)
+        self._cache.executescript(CACHE_SCHEMA_SQL)
+
+    def _session(self):
+        # requests.Session is not thread-safe: one per worker thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _get(self, path):
+        # JSON body, or None for 404; raises after the last retry
+        with self._lock:
+            self.requests += 1
+        res = fetch(self._session(), f"{self.base_url}/{path}", self.limiter, self.retries, self.backoff)
+        return None if res.status_code == 404 else res.json()
+
+    def _resolve_cid(self, ident):
+        try:
+            return self._lookup_cid(ident)
+        except requests.RequestException:
+            return _FAILED     # not cached, so the next run tries again
+
+    def _lookup_cid(self, ident):
+        for route in lookup_routes(ident):
+            body = self._get(f"compound/{route}/cids/JSON")
+            cids = (body or {}).get("IdentifierList", {}).get("CID", [])
+            if cids:
+                return int(cids[0])
+        return None
+
+    def _properties(self, cids):
+        # {cid: {property: value}} for one batch, or _FAILED
+        batch = ",".join(str(c) for c in cids)
+        try:
+            body = self._get(f"compound/cid/{batch}/property/{','.join(PROPERTIES)}/JSON")
+        except requests.RequestException:
+            return _FAILED
+        return {int(row.pop("CID")): row
+                for row in (body or {}).get("PropertyTable", {}).get("Properties", [])}
+
+    def cached(self, idents):
+        with self._lock:
+            rows = self._cache.execute(
+                "SELECT ident, cid, properties FROM resolved "
+                "WHERE ident IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(idents)),),
+            ).fetchall()
+        return {ident: {"cid": cid, **json.loads(props or "{}")} if cid is not None else None
+                for ident, cid, props in rows}
+
+    def resolve_many(self, idents):
+        # {ident: {"cid": …, <PROPERTIES>…}} or None when PubChem has no match
+        idents = list(dict.fromkeys(i.strip() for i in idents if i and i.strip()))
+        self.failed = []
+        results = self.cached(idents)
+        todo = [i for i in idents if i not in results]
+        if not todo:
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pubchem") as ex:
+            cids = dict(zip(todo, ex.map(self._resolve_cid, todo)))
+            failed = {i for i, c in cids.items() if c is _FAILED}
+            unique = sorted({c for i, c in cids.items() if c is not None and i not in failed})
+            chunks = [unique[i:i + PROPERTY_BATCH] for i in range(0, len(unique), PROPERTY_BATCH)]
+            props = {}
+            for chunk, part in zip(chunks, ex.map(self._properties, chunks)):
+                if part is _FAILED:
+                    lost = set(chunk)
+                    failed.update(i for i, c in cids.items() if c in lost)
+                else:
+                    props.update(part)
+
+        now = time.time()
+        rows = [(i, cids[i], json.dumps(props.get(cids[i], {})) if cids[i] is not None else None, now)
+                for i in todo if i not in failed]
+        with self._lock, self._cache:
+            self._cache.executemany("INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?)", rows)
+        results.update(self.cached(todo))
+        self.failed = sorted(failed)
+        return results
+
+    def resolve(self, ident):
+        return self.resolve_many([ident]).get(ident.strip())
+
+    def close(self):
+        self._cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve CAS/DTXSID identifiers to PubChem CIDs in bulk.")
+    parser.add_argument("idents", nargs="*",
+                        help="identifiers (default: every chemical in both matrix CSVs)")
+    parser.add_argument("--csv", nargs="+",
+                        default=["parallel_administered_drugs_matrix.csv", "parallel_metabolites_matrix.csv"],
+                        help="species×species matrix CSVs to take identifiers from")
+    parser.add_argument("--cache", default=CACHE_PATH, help="SQLite result cache")
+    parser.add_argument("--base-url", default=PUG_URL, help="PUG REST root (point at a stub to test)")
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--out", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    idents = args.idents
+    if not idents:
+        idents = sorted(set().union(*(
+            chems for path in args.csv
+            for chems in incidence.chemicals_from_matrix_csv(path).values()
+        )))
+
+    resolver = PubChemResolver(args.cache, args.base_url, args.rate, args.workers)
+    t0 = time.perf_counter()
+    results = resolver.resolve_many(idents)
+    resolver.close()
+    n_found = sum(r is not None for r in results.values())
+    print(f"{n_found}/{len(idents)} identifiers resolved with {resolver.requests} requests "
+          f"in {time.perf_counter() - t0:.1f}s → '{args.cache}'")
+    if resolver.failed:
+        print(f"{len(resolver.failed)} failed after retries (not cached): {', '.join(resolver.failed[:10])}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from matplotlib.figure import Figure
+
+import diagnostics
+
+'''
+Render cache for the cross-species overlay plots.
+
+Each chemical's subplot is rendered once as a PNG "tile" and cached in memory
+(LRU, bounded by total bytes) and optionally on disk. Tiles are keyed by the
+overlaid species, chemical, role, data version and style, so any session asking
+for the same overlay gets the cached bytes and the apps just lay tiles out in a
+grid.
+
+Tiles are drawn on a standalone matplotlib Figure (no pyplot state), so
+concurrent Streamlit sessions can render safely.
+'''
+
+MAX_BYTES = 64 * 1024 * 1024
+
+# Dark theme used by the explorer; bump "version" when the drawing code changes
+DARK_STYLE = {
+    "version":    1,
+    "figsize":    (5, 3),
+    "dpi":        100,
+    "figure_bg":  "black",
+    "axes_bg":    "#222222",
+    "fg":         "white",
+    "grid":       "gray",
+    "legend_bg":  "#333333",
+    "markers":    ("o", "s", "^", "D", "v", "P"),
+    "linestyles": ("-", "--", "-.", ":"),
+}
+
+# Light theme for printed / batch reports (batch_report.py)
+PRINT_STYLE = dict(DARK_STYLE, figure_bg="white", axes_bg="white", fg="black",
+                   grid="#bbbbbb", legend_bg="white")
+
+
+def style_axis(ax, title, style=DARK_STYLE):
+    ax.set_facecolor(style["axes_bg"])
+    ax.tick_params(colors=style["fg"], which='both')
+    ax.xaxis.label.set_color(style["fg"])
+    ax.yaxis.label.set_color(style["fg"])
+    ax.title.set_color(style["fg"])
+    for spine in ax.spines.values():
+        spine.set_color(style["fg"])
+    ax.grid(color=style["grid"], linestyle=':', linewidth=0.5)
+
+    ax.set_title(title, fontsize=10)
+    ax.set_xlabel("Time (hr)")
+    ax.set_ylabel("Concentration")
+    if ax.get_legend_handles_labels()[0]:    # N-way tiles can have species without data
+        ax.legend(
+            fontsize=6, facecolor=style["legend_bg"], edgecolor=style["fg"], labelcolor=style["fg"]
+        )
+
+
+def plot_curves(ax, title, curves, style=DARK_STYLE):
+    # curves: [(label, color, DataFrame(time_hr, conc)), ...]
+    for i, (label, color, df) in enumerate(curves):
+        ax.plot(df["time_hr"], df["conc"],
+                marker=style["markers"][i % len(style["markers"])],
+                linestyle=style["linestyles"][i % len(style["linestyles"])],
+                color=color, label=label)
+    style_axis(ax, title, style)
+
+
+def plot_bands(ax, title, bands, style=DARK_STYLE):
+    # bands: [(label, color, DataFrame(time_hr, median, mean, lower, upper)), ...] (series_bands.py)
+    for i, (label, color, df) in enumerate(bands):
+        ax.fill_between(df["time_hr"], df["lower"], df["upper"], color=color, alpha=0.25, linewidth=0)
+        ax.plot(df["time_hr"], df["median"], color=color,
+                linestyle=style["linestyles"][i % len(style["linestyles"])], label=f"{label} median")
+        ax.plot(df["time_hr"], df["mean"], color=color, linestyle=":", linewidth=0.8,
+                label=f"{label} geo. mean")
+    ax.set_yscale("log")
+    style_axis(ax, title, style)
+
+
+def render_tile(title, curves, style=DARK_STYLE, plot=plot_curves):
+    # curves: [(label, color, DataFrame), ...] in the form `plot` draws
+    with diagnostics.span("matplotlib draw"):
+        fig = Figure(figsize=style["figsize"], dpi=style["dpi"], layout="constrained")
+        fig.patch.set_facecolor(style["figure_bg"])
+        plot(fig.add_subplot(), title, curves, style)
+    with diagnostics.span("png encode"):
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", facecolor=fig.get_facecolor())
+        return buf.getvalue()
+
+
+def tile_key(species, chem, role, data_version, style=DARK_STYLE, view="best"):
+    # species: the overlaid species, in legend order (a pair, or more for N-way views)
+    # view: "best" for best-series curves, or e.g. "band-10-90" for series_bands tiles
+    raw = json.dumps([list(species), chem, role, data_version, style, view],
+                     sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class TileCache:
+    def __init__(self, max_bytes=MAX_BYTES, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir  = disk_dir
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._tiles    = OrderedDict()
+        self._lock     = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def get(self, key):
+        with self._lock:
+            png = self._tiles.get(key)
+            if png is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                diagnostics.count("tile_cache.hit")
+                return png
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), "rb") as f:
+                png = f.read()
+            self._put_memory(key, png)
+            with self._lock:
+                self.hits += 1
+            diagnostics.count("tile_cache.hit")
+            return png
+        with self._lock:
+            self.misses += 1
+        diagnostics.count("tile_cache.miss")
+        return None
+
+    def _put_memory(self, key, png):
+        with self._lock:
+            if key in self._tiles:
+                self.nbytes -= len(self._tiles.pop(key))
+            self._tiles[key] = png
+            self.nbytes += len(png)
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, old = self._tiles.popitem(last=False)
+                self.nbytes -= len(old)
+
+    def put(self, key, png):
+        self._put_memory(key, png)
+        if self.disk_dir:
+            tmp = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, self._disk_path(key))
+
+    def get_or_render(self, key, render):
+        png = self.get(key)
+        if png is None:
+            png = render()
+            self.put(key, png)
+        return png
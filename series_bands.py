@@ -0,0 +1,163 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import best_series_index
+import cvt_data
+import series_store
+
+'''
+Aggregate view of every series for a (species, chemical, role).
+
+The apps normally plot only the best series (most valid points). Here every
+series with at least MIN_PTS valid points is fetched, from the memory-mapped
+series store when one is built or else with one query on idx.conc_time, and
+summarized as a band:
+
+  1. each series is interpolated linearly in log10(conc) onto a common time
+     grid: N_GRID quantiles of all sampling times pooled, so the grid is dense
+     where the studies sample densely; a series only contributes between its
+     first and last sample (no extrapolation), and points with conc <= 0 are
+     dropped since they have no log
+  2. the median, the geometric mean (mean of log10 conc) and the lower/upper
+     percentiles are taken across series at every grid time, all in one
+     (n_series, N_GRID) array
+
+Everything is vectorized over all series at once (one searchsorted for the
+whole set), so a chemical with hundreds of series is summarized in
+milliseconds. Grid times covered by fewer than MIN_SERIES series keep their
+median/mean but get no band.
+'''
+
+DB_PATH     = "cvt_db_20210607.sqlite"
+N_GRID      = 60
+PERCENTILES = (10, 90)
+MIN_PTS     = 2
+MIN_SERIES  = 2
+COLUMNS     = ["time_hr", "n_series", "median", "mean", "lower", "upper"]
+
+SERIES_IDS_SQL = """
+    SELECT series_id
+      FROM idx.series_stats
+     WHERE species_norm = ? AND {column} = ? AND n_valid_pts >= ?
+     ORDER BY series_id
+"""
+
+POINTS_SQL = """
+    SELECT fk_series_id, time_hr, conc
+      FROM idx.conc_time
+     WHERE valid AND fk_series_id IN (SELECT value FROM json_each(?))
+     ORDER BY fk_series_id, time_hr
+"""
+
+
+# ——— FETCH ———
+def series_ids(conn, species, dtxsid, role="administered", min_pts=MIN_PTS):
+    column = best_series_index.ROLE_COLUMNS[role]
+    rows = conn.execute(SERIES_IDS_SQL.format(column=column), (species.lower(), dtxsid, min_pts))
+    return np.array([r[0] for r in rows], dtype="int64")
+
+
+def load_points(conn, ids, store=None):
+    # (time, conc, counts) for `ids`, concatenated in that order, time-sorted per series
+    ids = np.asarray(ids, dtype="int64")
+    if store is not None:
+        ids = ids[ids < len(store)]
+        starts = np.asarray(store.offsets[ids], dtype="int64")
+        counts = np.asarray(store.offsets[ids + 1], dtype="int64") - starts
+        pos = np.repeat(starts - np.r_[0, np.cumsum(counts)[:-1]], counts) + np.arange(counts.sum())
+        return np.asarray(store.time[pos]), np.asarray(store.conc[pos]), counts
+    rows = conn.execute(POINTS_SQL, (json.dumps(ids.tolist()),)).fetchall()
+    pts = np.array(rows, dtype="float64").reshape(-1, 3)
+    counts = np.bincount(np.searchsorted(ids, pts[:, 0].astype("int64")), minlength=len(ids))
+    return pts[:, 1], pts[:, 2], counts
+
+
+# ——— BAND ———
+def band(time, conc, counts, n_grid=N_GRID, percentiles=PERCENTILES, min_series=MIN_SERIES):
+    # time/conc: concatenated series (time-sorted within each); counts: points per series
+    seg = np.repeat(np.arange(len(counts)), counts)
+    keep = conc > 0
+    t, seg = np.asarray(time, dtype="float64")[keep], seg[keep]
+    lc = np.log10(np.asarray(conc, dtype="float64")[keep])
+    counts = np.bincount(seg, minlength=len(counts))
+    seg = np.searchsorted(np.flatnonzero(counts), seg)       # renumber, dropping emptied series
+    counts = counts[counts > 0]
+    m = len(counts)
+    if m == 0:
+        return pd.DataFrame(columns=COLUMNS)
+
+    grid = np.unique(np.quantile(t, np.linspace(0.0, 1.0, n_grid)))
+    first = np.r_[0, np.cumsum(counts)[:-1]]
+    last = first + counts - 1
+    # shift each series into its own disjoint time window so one searchsorted serves all
+    span = grid[-1] - grid[0] + 1.0
+    key = seg * span + (t - grid[0])
+    q = (np.arange(m)[:, None] * span + (grid - grid[0])).ravel()
+    qseg = np.repeat(np.arange(m), len(grid))
+    hi = np.clip(np.searchsorted(key, q, side="left"), first[qseg], last[qseg])
+    lo = np.clip(hi - 1, first[qseg], last[qseg])
+    dt = key[hi] - key[lo]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.clip(np.where(dt > 0, (q - key[lo]) / dt, 0.0), 0.0, 1.0)
+    values = ((1 - w) * lc[lo] + w * lc[hi]).reshape(m, len(grid))
+    inside = (grid >= t[first][:, None]) & (grid <= t[last][:, None])
+    values[~inside] = np.nan
+
+    n = inside.sum(axis=0)
+    covered = n > 0
+    values = values[:, covered]
+    lower, median, upper = np.nanpercentile(values, [percentiles[0], 50, percentiles[1]], axis=0)
+    mean = np.nanmean(values, axis=0)
+    narrow = n[covered] < min_series
+    lower[narrow] = upper[narrow] = np.nan
+    return pd.DataFrame({
+        "time_hr":  grid[covered],
+        "n_series": n[covered],
+        "median":   10 ** median,
+        "mean":     10 ** mean,
+        "lower":    10 ** lower,
+        "upper":    10 ** upper,
+    })
+
+
+def series_band(conn, species, dtxsid, role="administered", store=None,
+                n_grid=N_GRID, percentiles=PERCENTILES, min_pts=MIN_PTS):
+    # (band DataFrame, number of series); the band is None when no series qualifies
+    ids = series_ids(conn, species, dtxsid, role, min_pts)
+    if not len(ids):
+        return None, 0
+    time_, conc, counts = load_points(conn, ids, store)
+    out = band(time_, conc, counts, n_grid, percentiles)
+    return (out if len(out) else None), len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Median and percentile band over every series "
+                                                 "for a species and chemical.")
+    parser.add_argument("species")
+    parser.add_argument("dtxsid")
+    parser.add_argument("--db", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--role", default="administered", choices=cvt_data.ROLES)
+    parser.add_argument("--band", nargs=2, type=float, default=PERCENTILES, metavar=("LO", "HI"),
+                        help="percentiles for the band")
+    parser.add_argument("--grid", type=int, default=N_GRID)
+    args = parser.parse_args()
+
+    with cvt_data.connection(args.db) as conn:
+        t0 = time.perf_counter()
+        res, n = series_band(conn, args.species, args.dtxsid, args.role,
+                             series_store.open_store(args.db), args.grid, tuple(args.band))
+        elapsed = time.perf_counter() - t0
+    if res is None:
+        print(f"No {args.role} series with ≥{MIN_PTS} points for {args.species} · {args.dtxsid}")
+        return
+    print(res.to_string(index=False, float_format="{:.4g}".format))
+    print(f"{n} series on {len(res)} grid times in {elapsed * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import diagnostics
+
+'''
+Process-wide cache of cleaned concentration–time series for the apps.
+
+Replaces @st.cache_data on get_best_series_and_data, which pickles a copy of
+every DataFrame on each hit, has no size bound and never notices a new DB file.
+Here each series is stored once per process and every session gets the same
+object back:
+
+  - frames are made read-only (their arrays have writeable=False; series
+    from the memory-mapped store already are), so sharing without copies is
+    safe: an in-place edit raises instead of corrupting other sessions;
+  - entries are evicted least-recently-used once their estimated size exceeds
+    max_bytes; the estimate is the frame's memory_usage(deep=True) plus a fixed
+    per-frame cost (pandas objects, measured with tracemalloc at ~11 KB, which
+    dwarfs the arrays of a typical few-dozen-point series) and a per-entry cost
+    for the key and bookkeeping;
+  - each lookup passes the data version (cvt_data.data_version: DB size/mtime),
+    and a new version empties the cache;
+  - hits, misses, evictions and invalidations are counted for stats().
+
+"No series" (None) is cached too, at the per-entry cost only.
+'''
+
+MAX_BYTES      = 256 * 1024 * 1024
+FRAME_OVERHEAD = 12 * 1024     # DataFrame, block manager, index and column objects
+ENTRY_OVERHEAD = 256           # key tuple and OrderedDict slot
+
+
+def read_only(df):
+    if df is None:
+        return None
+    cols = {}
+    for col in df.columns:
+        arr = df[col].to_numpy()
+        if arr.flags.writeable:
+            arr = arr.copy()
+            arr.setflags(write=False)
+        cols[col] = arr
+    return pd.DataFrame(cols, copy=False)
+
+
+def frame_nbytes(df):
+    # estimated cost of caching df, not just its arrays
+    if df is None:
+        return ENTRY_OVERHEAD
+    return ENTRY_OVERHEAD + FRAME_OVERHEAD + int(df.memory_usage(index=True, deep=True).sum())
+
+
+class SeriesCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes     = max_bytes
+        self.version       = None
+        self.nbytes        = 0
+        self.hits          = 0
+        self.misses        = 0
+        self.evictions     = 0
+        self.invalidations = 0
+        self._frames       = OrderedDict()     # key → (DataFrame or None, nbytes)
+        self._lock         = threading.Lock()
+
+    def _check_version(self, version):
+        # caller holds the lock
+        if version != self.version:
+            if self._frames:
+                self.invalidations += 1
+            self._frames.clear()
+            self.nbytes  = 0
+            self.version = version
+
+    def get(self, key, version):
+        # (found, frame); frame may be None for "no series"
+        with self._lock:
+            self._check_version(version)
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                diagnostics.count("series_cache.hit")
+                return True, self._frames[key][0]
+            self.misses += 1
+        diagnostics.count("series_cache.miss")
+        return False, None
+
+    def put(self, key, version, df):
+        df = read_only(df)
+        size = frame_nbytes(df)
+        with self._lock:
+            self._check_version(version)
+            if key in self._frames:
+                self.nbytes -= self._frames.pop(key)[1]
+            self._frames[key] = (df, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self._frames) > 1:
+                _, (_, old) = self._frames.popitem(last=False)
+                self.nbytes -= old
+                self.evictions += 1
+        return df
+
+    def get_or_load(self, key, version, load):
+        found, df = self.get(key, version)
+        if not found:
+            df = self.put(key, version, load())
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries":       len(self._frames),
+                "bytes":         self.nbytes,
+                "max_bytes":     self.max_bytes,
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_rate":      self.hits / lookups if lookups else 0.0,
+                "evictions":     self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import best_series_index
+
+'''
+Columnar, memory-mapped copy of conc_time_values keyed by series id.
+
+A one-time conversion writes every usable row of conc_time_values into CSR-style
+arrays next to the source DB (cvt_db_20210607.sqlite → cvt_db_20210607.series/):
+
+  time.npy     float64, all points, sorted by (series id, time)
+  conc.npy     float64, aligned with time.npy
+  offsets.npy  int64, length max_series_id + 2; series s is [offsets[s], offsets[s + 1])
+  meta.json    source size/mtime the store was built from
+
+The points come from the typed idx.conc_time table (see best_series_index.py),
+valid rows only, so fetching a series is a zero-copy slice of two
+memory-mapped arrays. open_store() only returns a store that matches the current source file.
+'''
+
+DB_PATH    = "cvt_db_20210607.sqlite"
+CHUNK_ROWS = 500_000
+
+
+def store_path_for(db_path):
+    return os.path.splitext(db_path)[0] + ".series"
+
+
+class SeriesStore:
+    def __init__(self, path):
+        self.path    = path
+        self.time    = np.load(os.path.join(path, "time.npy"),    mmap_mode="r")
+        self.conc    = np.load(os.path.join(path, "conc.npy"),    mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, series_id):
+        series_id = int(series_id)
+        if not 0 <= series_id < len(self):
+            return self.time[:0], self.conc[:0]
+        lo, hi = self.offsets[series_id], self.offsets[series_id + 1]
+        return self.time[lo:hi], self.conc[lo:hi]
+
+    def frame(self, series_id):
+        t, c = self.get(series_id)
+        return pd.DataFrame({"time_hr": t, "conc": c}, copy=False)
+
+
+# ——— CONVERSION ———
+def convert(db_path, out_path=None, chunk_rows=CHUNK_ROWS):
+    out_path = out_path or store_path_for(db_path)
+    signature = best_series_index.source_signature(db_path)
+
+    index_path = best_series_index.ensure_index(db_path)
+    conn = sqlite3.connect(f"file:{os.path.abspath(index_path)}?mode=ro", uri=True)
+    sids, times, concs = [], [], []
+    try:
+        for chunk in pd.read_sql_query(
+            "SELECT fk_series_id, time_hr, conc FROM conc_time WHERE valid",
+            conn, chunksize=chunk_rows,
+        ):
+            sids.append(chunk["fk_series_id"].to_numpy(dtype="int64"))
+            times.append(chunk["time_hr"].to_numpy(dtype="float64"))
+            concs.append(chunk["conc"].to_numpy(dtype="float64"))
+        max_sid = conn.execute("SELECT COALESCE(MAX(series_id), 0) FROM series_stats").fetchone()[0]
+    finally:
+        conn.close()
+
+    sid  = np.concatenate(sids)  if sids  else np.empty(0, dtype="int64")
+    t    = np.concatenate(times) if times else np.empty(0)
+    c    = np.concatenate(concs) if concs else np.empty(0)
+    max_sid = max(int(max_sid), int(sid.max()) if len(sid) else 0)
+
+    order = np.lexsort((t, sid))            # stable: by series id, then time
+    sid, t, c = sid[order], t[order], c[order]
+    counts  = np.bincount(sid, minlength=max_sid + 1)
+    offsets = np.zeros(max_sid + 2, dtype="int64")
+    np.cumsum(counts, out=offsets[1:])
+
+    # Write next to the target and swap in, so readers never see a partial store
+    with best_series_index.atomic_output(out_path, directory=True) as tmp_path:
+        np.save(os.path.join(tmp_path, "time.npy"),    t)
+        np.save(os.path.join(tmp_path, "conc.npy"),    c)
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(dict(signature, n_points=int(len(t)), n_series=int(max_sid + 1)), f)
+    return out_path
+
+
+# ——— OPEN ———
+_stores      = {}
+_stores_lock = threading.Lock()
+
+
+def is_fresh(db_path, store_path=None):
+    store_path = store_path or store_path_for(db_path)
+    try:
+        with open(os.path.join(store_path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return all(meta.get(k) == v for k, v in best_series_index.source_signature(db_path).items())
+
+
+def open_store(db_path, store_path=None):
+    # Returns None when no store matches the current DB, so callers fall back to SQL
+    store_path = store_path or store_path_for(db_path)
+    if not is_fresh(db_path, store_path):
+        return None
+    key = (os.path.abspath(store_path), tuple(best_series_index.source_signature(db_path).values()))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SeriesStore(store_path)
+        return _stores[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert conc_time_values into a memory-mapped columnar store.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="source CvT SQLite file")
+    parser.add_argument("--out", help="store directory (default: <db>.series)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    out_path = convert(args.db, args.out)
+    store = SeriesStore(out_path)
+    print(f"Wrote {len(store.time)} points for {len(store)} series ids "
+          f"to '{out_path}' ({time.perf_counter() - t0:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+
+import incidence
+import pubchem_search
+
+'''
+Local structure store for the 3D viewer.
+
+A prefetch job resolves every chemical in the incidence store (DTXSID or CAS) to
+a PubChem CID and keeps its SDF, zlib-compressed, in structures.sqlite:
+
+  DTXSID…   compound/xref/RegistryID/{id}   (DSSTox ids are PubChem registry ids)
+  CAS RN    compound/xref/RN/{cas}
+  fallback  compound/name/{chem}
+
+(pubchem_search.lookup_routes), throttled and retried like every other PubChem
+request (pubchem_search.fetch and its process-wide limiter). 3D conformers are
+preferred, 2D records are kept when PubChem has no 3D one, and chemicals that do
+not resolve are remembered so reruns do not ask again. The same job drops a copy
+of 3Dmol.js into static/, which Streamlit serves from the app process
+(server.enableStaticServing), so the viewer needs no network at all
+once the store is warm.
+'''
+
+STORE_PATH    = "structures.sqlite"
+STATIC_DIR    = "static"
+JS_NAME       = "3Dmol-min.js"
+JS_CDN_URL    = "https://3Dmol.org/build/3Dmol-min.js"
+PUG_URL       = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+TIMEOUT       = 30
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS structures (
+        chem        TEXT PRIMARY KEY,
+        cid         INTEGER,
+        record_type TEXT,
+        sdf         BLOB,
+        fetched_at  REAL NOT NULL
+    );
+"""
+
+
+class StructureStore:
+    def __init__(self, path=STORE_PATH):
+        self.path  = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA_SQL)
+        self._lock = threading.Lock()
+
+    def __contains__(self, chem):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM structures WHERE chem = ?", (chem,)
+            ).fetchone() is not None
+
+    def get(self, chem):
+        # SDF text, or None when the chemical is unknown or did not resolve
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sdf FROM structures WHERE chem = ?", (chem,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode()
+
+    def put(self, chem, cid, record_type, sdf):
+        blob = zlib.compress(sdf.encode(), 9) if sdf is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?, ?)",
+                (chem, cid, record_type, blob, time.time()),
+            )
+
+    def missing(self):
+        with self._lock:
+            return [c for (c,) in self._conn.execute(
+                "SELECT chem FROM structures WHERE sdf IS NULL"
+            )]
+
+    def close(self):
+        self._conn.close()
+
+
+# ——— PUBCHEM ———
+def resolve_cid(session, chem):
+    for route in pubchem_search.lookup_routes(chem):
+        res = pubchem_search.fetch(session, f"{PUG_URL}/compound/{route}/cids/JSON")
+        if res.status_code == 404:
+            continue
+        cids = res.json().get("IdentifierList", {}).get("CID", [])
+        if cids:
+            return int(cids[0])
+    return None
+
+
+def fetch_sdf(session, cid):
+    for record_type in ("3d", "2d"):
+        res = pubchem_search.fetch(session, f"{PUG_URL}/compound/cid/{cid}/SDF",
+                                   params={"record_type": record_type})
+        if res.status_code == 404:
+            continue
+        return record_type, res.text
+    return None, None
+
+
+def fetch_structure(store, chem, session=None):
+    session = session or requests.Session()
+    cid = resolve_cid(session, chem)
+    record_type, sdf = fetch_sdf(session, cid) if cid is not None else (None, None)
+    store.put(chem, cid, record_type, sdf)
+    return sdf
+
+
+def get_or_fetch(store, chem, session=None):
+    if chem in store:
+        return store.get(chem)
+    try:
+        return fetch_structure(store, chem, session)
+    except requests.RequestException:
+        return None     # offline: leave it for the next prefetch
+
+
+# ——— PREFETCH ———
+def matrix_chemicals(incidence_dir=incidence.INCIDENCE_DIR):
+    chems = set()
+    for role in ("administered", "analyte"):
+        chems.update(c.decode() for c in incidence.load_incidence(incidence_dir, role).chemicals)
+    return sorted(chems)
+
+
+def prefetch(store, chems, retry_missing=False):
+    retry = set(store.missing()) if retry_missing else set()
+    todo = [c for c in chems if c not in store or c in retry]
+    session = requests.Session()
+    n_found = n_failed = 0
+    for i, chem in enumerate(todo, 1):
+        try:
+            sdf = fetch_structure(store, chem, session)
+        except requests.RequestException as e:
+            print(f"  {chem}: {e}")
+            n_failed += 1
+            continue
+        n_found += sdf is not None
+        if i % 50 == 0:
+            print(f"  {i}/{len(todo)}")
+    return len(chems) - len(todo), n_found, n_failed
+
+
+def vendor_3dmol(static_dir=STATIC_DIR):
+    path = os.path.join(static_dir, JS_NAME)
+    if os.path.exists(path):
+        return path
+    os.makedirs(static_dir, exist_ok=True)
+    res = requests.get(JS_CDN_URL, timeout=TIMEOUT)
+    res.raise_for_status()
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(res.content)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+# ——— VIEWER ———
+def script_src(base_url_path="", static_dir=STATIC_DIR):
+    # Served by Streamlit at /app/static/ when vendored, else the public CDN
+    if not os.path.exists(os.path.join(static_dir, JS_NAME)):
+        return JS_CDN_URL
+    prefix = f"/{base_url_path.strip('/')}" if base_url_path.strip("/") else ""
+    return f"{prefix}/app/static/{JS_NAME}"
+
+
+def viewer_html(div_id, sdf, style_js="{stick:{}}", spin=False, js_src=JS_CDN_URL):
+    # The SDF goes into the page as a JS string literal, so there is no fetch at view time
+    sdf_js = json.dumps(sdf).replace("</", "<\\/")
+    spin_js = "viewer.spin(true);" if spin else ""
+    return f"""
+    <script src="{js_src}"></script>
+    <div id="{div_id}" style="width:100%; height:500px; background-color:#0E1117;"></div>
+    <script>
+    (function() {{
+      const tgt = document.getElementById("{div_id}");
+      const viewer = $3Dmol.createViewer(tgt, {{ backgroundColor: 'black' }});
+      viewer.addModel({sdf_js}, 'sdf');
+      viewer.setStyle({{}}, {style_js});
+      viewer.zoomTo();
+      viewer.render();
+      {spin_js}
+    }})();
+    </script>
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefetch SDFs for every chemical in the incidence store.")
+    parser.add_argument("--store", default=STORE_PATH, help="structure store (SQLite)")
+    parser.add_argument("--matrices", default=incidence.INCIDENCE_DIR, help="incidence store directory")
+    parser.add_argument("--static-dir", default=STATIC_DIR, help="where to vendor 3Dmol.js")
+    parser.add_argument("--retry-missing", action="store_true",
+                        help="ask PubChem again for chemicals that did not resolve before")
+    args = parser.parse_args()
+
+    print(f"3Dmol.js → '{vendor_3dmol(args.static_dir)}'")
+    store = StructureStore(args.store)
+    chems = matrix_chemicals(args.matrices)
+    t0 = time.perf_counter()
+    n_cached, n_found, n_failed = prefetch(store, chems, args.retry_missing)
+    store.close()
+    print(f"{len(chems)} chemicals: {n_cached} already stored, {n_found} fetched, "
+          f"{n_failed} failed ({time.perf_counter() - t0:.1f}s) → '{args.store}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+'''
+Synthetic CvT database generator.
+
+Writes a SQLite file with the subjects / series / conc_time_values tables the
+tools read, at a configurable scale, so everything can be exercised and
+benchmarked without the real cvt_db_20210607.sqlite. Each chemical is studied
+in a random subset of species; each (species, chemical) pair gets a Poisson
+number of series of mono-exponential decay curves with log-normal noise.
+
+The values are stored as text, like the source, and carry the same kinds of
+mess the readers have to cope with:
+
+  text_fraction    unparseable time/conc values ("n/a", "<LOQ", "ND")
+  blank_fraction   empty or whitespace-only time/conc values
+  species_noise    species spelled with other casing or stray whitespace
+  metabolite_fraction
+                   series whose analyte differs from the test substance
+'''
+
+SCHEMA_SQL = """
+    DROP TABLE IF EXISTS conc_time_values;
+    DROP TABLE IF EXISTS series;
+    DROP TABLE IF EXISTS subjects;
+    CREATE TABLE subjects (
+        id           INTEGER PRIMARY KEY,
+        species      TEXT,
+        sex          TEXT,
+        age          TEXT,
+        age_category TEXT,
+        height       TEXT,
+        weight_kg    TEXT
+    );
+    CREATE TABLE series (
+        id                    INTEGER PRIMARY KEY,
+        fk_subject_id         INTEGER,
+        test_substance_dtxsid TEXT,
+        analyte_dtxsid        TEXT,
+        analyte_casrn         TEXT,
+        analyte_name_original TEXT
+    );
+    CREATE TABLE conc_time_values (
+        id           INTEGER PRIMARY KEY,
+        fk_series_id INTEGER,
+        time_hr      TEXT,
+        conc         TEXT
+    );
+"""
+
+SPECIES = ["mouse", "rat", "human", "dog", "monkey", "rabbit", "hamster", "frog",
+           "pig", "guinea pig", "sheep", "cat", "horse", "cow", "chicken", "fish"]
+TEXT_VALUES  = np.array(["n/a", "<LOQ", "ND"])
+BLANK_VALUES = np.array(["", " "])
+CHUNK_ROWS   = 200_000
+
+PRESETS = {
+    "tiny":   dict(n_species=4,  n_chemicals=50,     series_per_chemical=2, points_per_series=6),
+    "small":  dict(n_species=6,  n_chemicals=500,    series_per_chemical=3, points_per_series=8),
+    "medium": dict(n_species=8,  n_chemicals=3_000,  series_per_chemical=4, points_per_series=10),
+    "large":  dict(n_species=12, n_chemicals=15_000, series_per_chemical=6, points_per_series=12),
+}
+DEFAULTS = dict(species_coverage=0.4, text_fraction=0.03, blank_fraction=0.03,
+                species_noise=0.1, metabolite_fraction=0.4, seed=0)
+
+
+def dtxsid(i):
+    return f"DTXSID{9000000 + i:07d}"
+
+
+def casrn(i):
+    body = f"{100 + i}"
+    # CAS check digit: weighted sum of the other digits, mod 10
+    digits = (body + "12")[::-1]
+    check = sum((k + 1) * int(d) for k, d in enumerate(digits)) % 10
+    return f"{body}-12-{check}"
+
+
+def _messy(values, rng, text_fraction, blank_fraction):
+    out = values.astype(object)
+    r = rng.random(len(values))
+    text  = r < text_fraction
+    blank = (r >= text_fraction) & (r < text_fraction + blank_fraction)
+    out[text]  = rng.choice(TEXT_VALUES,  text.sum())
+    out[blank] = rng.choice(BLANK_VALUES, blank.sum())
+    return out
+
+
+def _species_spelling(names, rng, noise):
+    names = np.asarray(names, dtype=object)
+    r = rng.random(len(names))
+    names[r < noise / 2] = [n.capitalize() for n in names[r < noise / 2]]
+    tail = (r >= noise / 2) & (r < noise)
+    names[tail] = [f"{n} " for n in names[tail]]
+    return names
+
+
+def generate(path, n_species, n_chemicals, series_per_chemical, points_per_series,
+             species_coverage=DEFAULTS["species_coverage"], text_fraction=DEFAULTS["text_fraction"],
+             blank_fraction=DEFAULTS["blank_fraction"], species_noise=DEFAULTS["species_noise"],
+             metabolite_fraction=DEFAULTS["metabolite_fraction"], seed=DEFAULTS["seed"]):
+    if not 1 <= n_species <= len(SPECIES):
+        raise ValueError(f"n_species must be between 1 and {len(SPECIES)}")
+    rng = np.random.default_rng(seed)
+
+    # (species, chemical) pairs that were studied, then series per pair
+    studied = rng.random((n_species, n_chemicals)) < species_coverage
+    sp_idx, chem_idx = np.nonzero(studied)
+    per_pair = np.maximum(rng.poisson(series_per_chemical, len(sp_idx)), 1)
+    series_sp   = np.repeat(sp_idx, per_pair)
+    series_chem = np.repeat(chem_idx, per_pair)
+    n_series = len(series_sp)
+    series_ids = np.arange(1, n_series + 1)
+
+    is_metabolite = rng.random(n_series) < metabolite_fraction
+    analyte = np.where(is_metabolite,
+                       (series_chem + rng.integers(1, max(n_chemicals, 2), n_series)) % n_chemicals,
+                       series_chem)
+
+    # one subject per series
+    subj_species = _species_spelling([SPECIES[i] for i in series_sp], rng, species_noise)
+    sex    = rng.choice(np.array(["male", "female", "M", "F", ""], dtype=object), n_series)
+    age    = _messy(np.round(rng.uniform(0.1, 60, n_series), 1).astype(str), rng, 0, 0.3)
+    height = _messy(np.round(rng.uniform(5, 190, n_series), 1).astype(str), rng, 0, 0.6)
+    weight = _messy(np.round(rng.lognormal(0, 1.5, n_series), 3).astype(str), rng, 0.02, 0.2)
+    age_category = rng.choice(np.array(["adult", "juvenile", "pup", ""], dtype=object), n_series)
+
+    # points: sorted sampling times and noisy mono-exponential decay
+    n_pts = np.maximum(rng.poisson(points_per_series, n_series), 1)
+    point_series = np.repeat(series_ids, n_pts)
+    n_points = len(point_series)
+    k_el = np.repeat(rng.lognormal(-1, 0.8, n_series), n_pts)
+    c0   = np.repeat(rng.lognormal(2, 1, n_series), n_pts)
+    t = np.round(rng.exponential(6, n_points), 3)
+    order = np.lexsort((t, point_series))
+    t = t[order]
+    conc = np.round(c0 * np.exp(-k_el * t) * rng.lognormal(0, 0.15, n_points), 5)
+    time_txt = _messy(t.astype(str),    rng, text_fraction, blank_fraction)
+    conc_txt = _messy(conc.astype(str), rng, text_fraction, blank_fraction)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.executescript(SCHEMA_SQL)
+    with conn:
+        conn.executemany("INSERT INTO subjects VALUES (?, ?, ?, ?, ?, ?, ?)", zip(
+            series_ids.tolist(), subj_species, sex, age, age_category, height, weight))
+        conn.executemany("INSERT INTO series VALUES (?, ?, ?, ?, ?, ?)", zip(
+            series_ids.tolist(), series_ids.tolist(),
+            [dtxsid(i) for i in series_chem], [dtxsid(i) for i in analyte],
+            [casrn(i) for i in analyte], [f"chemical {i}" for i in analyte]))
+        for lo in range(0, n_points, CHUNK_ROWS):
+            hi = min(lo + CHUNK_ROWS, n_points)
+            conn.executemany(
+                "INSERT INTO conc_time_values (fk_series_id, time_hr, conc) VALUES (?, ?, ?)",
+                zip(point_series[lo:hi].tolist(), time_txt[lo:hi], conc_txt[lo:hi]))
+    conn.close()
+    os.replace(tmp, path)
+    return {"species": n_species, "chemicals": n_chemicals, "series": n_series, "points": n_points}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CvT SQLite database.")
+    parser.add_argument("out", help="SQLite file to write (replaced if it exists)")
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument("--species", type=int, dest="n_species")
+    parser.add_argument("--chemicals", type=int, dest="n_chemicals")
+    parser.add_argument("--series-per-chemical", type=float, dest="series_per_chemical",
+                        help="mean series per studied (species, chemical) pair")
+    parser.add_argument("--points-per-series", type=float, dest="points_per_series")
+    parser.add_argument("--species-coverage", type=float, default=DEFAULTS["species_coverage"],
+                        help="chance that a chemical was studied in a given species")
+    parser.add_argument("--text-fraction", type=float, default=DEFAULTS["text_fraction"])
+    parser.add_argument("--blank-fraction", type=float, default=DEFAULTS["blank_fraction"])
+    parser.add_argument("--species-noise", type=float, default=DEFAULTS["species_noise"])
+    parser.add_argument("--metabolite-fraction", type=float, default=DEFAULTS["metabolite_fraction"])
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"])
+    args = vars(parser.parse_args())
+
+    out = args.pop("out")
+    scale = dict(PRESETS[args.pop("preset")])
+    scale.update({k: v for k, v in args.items() if v is not None})
+    t0 = time.perf_counter()
+    sizes = generate(out, **scale)
+    print(f"Wrote {sizes['series']} series / {sizes['points']} points "
+          f"({sizes['species']} species × {sizes['chemicals']} chemicals) "
+          f"to '{out}' in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
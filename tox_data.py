@@ -1,25 +1,126 @@
-import pandas as pd
+import argparse
 import sqlite3
+import time
+
+import pandas as pd
+
+'''
+Load chemical_data.csv into the chemical_inventory table of chemical_data.sqlite.
+
+The CSV is streamed in chunks and inserted with executemany inside a single
+transaction, with ingest pragmas on (no fsync; an in-memory rollback journal on
+full loads), so memory stays bounded by CHUNK_ROWS and the load runs at SQLite's
+bulk insert speed. A failed or interrupted load rolls back to the previous table. Every column is stored as TEXT, as read; empty cells become NULL.
+
+  full (default)   drop and recreate the table, build the indexes after loading
+  --upsert         keep the table and replace, per DTXSID, the rows of every
+                   chemical present in the CSV (an inventory can hold several
+                   rows per chemical, one per functional use); others are kept.
+                   Rows without a DTXSID count as one group and are replaced
+                   together, so rerunning an upsert never duplicates them
+
+Progress and the final throughput are reported in rows/s.
+'''
+
+CSV_FILE    = "chemical_data.csv"
+DB_FILE     = "chemical_data.sqlite"
+TABLE_NAME  = "chemical_inventory"
+KEY_COLUMN  = "DTXSID"
+CHUNK_ROWS  = 100_000
+INDEXES     = {
+    "idx_dtxsid":       "DTXSID",
+    "idx_cas":          "Curated CAS",
+    "idx_function_use": "Harmonized Functional Use",
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _ingest_pragmas(conn, upsert):
+    # full loads keep the journal in memory: ROLLBACK still restores the old table on an
+    # error or Ctrl-C (with the journal OFF it is undefined), only an OS crash is not covered;
+    # upserts touch existing data and keep WAL for crash safety
+    conn.execute(f"PRAGMA journal_mode = {'WAL' if upsert else 'MEMORY'}")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")     # KiB
+
+
+def create_indexes(conn, table=TABLE_NAME, columns=None):
+    for name, column in INDEXES.items():
+        if columns is None or column in columns:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {_quote(table)}({_quote(column)})")
+
+
+def ingest(csv_file=CSV_FILE, db_file=DB_FILE, table=TABLE_NAME, upsert=False,
+           chunk_rows=CHUNK_ROWS, progress=None):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    _ingest_pragmas(conn, upsert)
+    chunks = pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    n_rows, seen = 0, set()
+    t0 = time.perf_counter()
+    try:
+        conn.execute("BEGIN")
+        for i, chunk in enumerate(chunks):
+            columns = list(chunk.columns)
+            if i == 0:
+                cols_sql = ", ".join(f"{_quote(c)} TEXT" for c in columns)
+                if not upsert:
+                    conn.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({cols_sql})")
+                if upsert:
+                    if KEY_COLUMN not in columns:
+                        raise ValueError(f"--upsert needs a {KEY_COLUMN} column in {csv_file}")
+                    create_indexes(conn, table, columns)    # the key lookups need them now
+                insert_sql = (f"INSERT INTO {_quote(table)} ({', '.join(map(_quote, columns))}) "
+                              f"VALUES ({', '.join('?' * len(columns))})")
+
+            rows = chunk.to_numpy(dtype=object)
+            rows[rows == ""] = None
+            if upsert:
+                # drop a chemical's old rows the first time it shows up in this file, so
+                # rows of one DTXSID spread over several chunks all survive
+                # (IS, not =, so the NULL-key group is matched too; empty keys are NULL here)
+                fresh = {k or None for k in chunk[KEY_COLUMN].unique()} - seen
+                seen |= fresh
+                conn.executemany(f"DELETE FROM {_quote(table)} WHERE {_quote(KEY_COLUMN)} IS ?",
+                                 ((k,) for k in fresh))
+            conn.executemany(insert_sql, rows.tolist())
+            n_rows += len(chunk)
+            if progress:
+                progress(n_rows, time.perf_counter() - t0)
+        if not upsert and n_rows:
+            create_indexes(conn, table, columns)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return n_rows, time.perf_counter() - t0
 
-# Define file and database paths
-csv_file = "chemical_data.csv"
-db_file = "chemical_data.sqlite"
-table_name = "chemical_inventory"
 
-# Load CSV with proper handling of quoted fields and commas
-df = pd.read_csv(csv_file)
+def main():
+    parser = argparse.ArgumentParser(description="Stream the chemical inventory CSV into SQLite.")
+    parser.add_argument("csv", nargs="?", default=CSV_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--table", default=TABLE_NAME)
+    parser.add_argument("--upsert", action="store_true",
+                        help=f"replace rows per {KEY_COLUMN} instead of rebuilding the table")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
 
-# Create SQLite connection and load the dataframe
-conn = sqlite3.connect(db_file)
-df.to_sql(table_name, conn, if_exists="replace", index=False)
+    def progress(n, elapsed):
+        print(f"  {n:>10,} rows  {n / max(elapsed, 1e-9):>10,.0f} rows/s", end="\r", flush=True)
 
-# Optional: create an index on common query fields for performance
-with conn:
-    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_dtxsid ON {table_name}(DTXSID);")
-    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_cas ON {table_name}([Curated CAS]);")
-    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_function_use ON {table_name}([Harmonized Functional Use]);")
+    n_rows, elapsed = ingest(args.csv, args.db, args.table, args.upsert, args.chunk_rows, progress)
+    print()
+    print(f"Data loaded into '{args.db}' in table '{args.table}': {n_rows:,} rows in {elapsed:.2f}s "
+          f"({n_rows / max(elapsed, 1e-9):,.0f} rows/s{', upsert' if args.upsert else ''})")
 
-print(f"Data loaded into '{db_file}' in table '{table_name}'")
 
-# Close connection
-conn.close()
+if __name__ == "__main__":
+    main()
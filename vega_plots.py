@@ -0,0 +1,133 @@
+import pandas as pd
+
+'''
+Client-side overlay charts for the explorer.
+
+Instead of rasterizing matplotlib figures on the server, the app sends the
+compact numeric series (long-form: chemical, species, time_hr, conc) to the
+browser along with a Vega-Lite spec, and the browser does the drawing. The
+panels share one x-scale bound to an interval selection, so dragging/zooming in
+any panel zooms them all; y-scales stay per-chemical and can be switched to log.
+The band view (series_bands.py) layers each species' percentile band under its
+median line the same way.
+'''
+
+PANEL_WIDTH  = 320
+PANEL_HEIGHT = 200
+DASHES       = [[1, 0], [6, 3], [2, 2], [8, 3, 2, 3]]
+
+
+def overlay_data(frames):
+    # frames: {(chemical, species): DataFrame(time_hr, conc)}
+    parts = [
+        df[["time_hr", "conc"]].assign(chemical=chem, species=sp)
+        for (chem, sp), df in frames.items() if df is not None
+    ]
+    if not parts:
+        return pd.DataFrame(columns=["chemical", "species", "time_hr", "conc"])
+    return pd.concat(parts, ignore_index=True)[["chemical", "species", "time_hr", "conc"]]
+
+
+def overlay_spec(colors, log_y=False, columns=2):
+    # colors: {species: hex}; order gives the legend order and dash pattern
+    species = list(colors)
+    y_scale = {"type": "log"} if log_y else {"type": "linear", "zero": False}
+    layer = {
+        "mark": {"type": "line", "point": True, "tooltip": True},
+        "params": [{
+            "name": "zoom",
+            "select": {"type": "interval", "encodings": ["x"]},
+            "bind": "scales",
+        }],
+        "encoding": {
+            "x": {"field": "time_hr", "type": "quantitative", "title": "Time (hr)"},
+            "y": {"field": "conc", "type": "quantitative", "title": "Concentration",
+                  "scale": y_scale},
+            "color": {"field": "species", "type": "nominal",
+                      "scale": {"domain": species, "range": [colors[sp] for sp in species]}},
+            "strokeDash": {"field": "species", "type": "nominal",
+                           "scale": {"domain": species,
+                                     "range": [DASHES[i % len(DASHES)] for i in range(len(species))]}},
+            "tooltip": [
+                {"field": "chemical", "type": "nominal"},
+                {"field": "species",  "type": "nominal"},
+                {"field": "time_hr",  "type": "quantitative", "title": "Time (hr)"},
+                {"field": "conc",     "type": "quantitative", "title": "Concentration"},
+            ],
+        },
+    }
+    spec = {
+        "facet":   {"field": "chemical", "type": "nominal", "title": None},
+        "columns": columns,
+        "spec":    {"width": PANEL_WIDTH, "height": PANEL_HEIGHT, **layer},
+        # shared x keeps zoom linked across panels; each chemical keeps its own y range
+        "resolve": {"scale": {"x": "shared", "y": "independent"}},
+    }
+    if log_y:
+        spec["transform"] = [{"filter": "datum.conc > 0"}]
+    return spec
+
+
+def band_data(bands):
+    # bands: {(chemical, species): DataFrame(time_hr, median, mean, lower, upper)}
+    cols = ["chemical", "species", "time_hr", "n_series", "median", "mean", "lower", "upper"]
+    parts = [df.assign(chemical=chem, species=sp)
+             for (chem, sp), df in bands.items() if df is not None]
+    if not parts:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(parts, ignore_index=True)[cols]
+
+
+def band_spec(colors, columns=2):
+    # always log y: the band is computed in log concentration
+    species = list(colors)
+    color = {"field": "species", "type": "nominal",
+             "scale": {"domain": species, "range": [colors[sp] for sp in species]}}
+    x = {"field": "time_hr", "type": "quantitative", "title": "Time (hr)"}
+    y_scale = {"type": "log"}
+    area = {
+        "mark": {"type": "area", "opacity": 0.25},
+        "encoding": {
+            "x": x,
+            "y":  {"field": "lower", "type": "quantitative", "title": "Concentration", "scale": y_scale},
+            "y2": {"field": "upper"},
+            "color": color,
+        },
+    }
+    median = {
+        "mark": {"type": "line", "tooltip": True},
+        "params": [{
+            "name": "zoom",
+            "select": {"type": "interval", "encodings": ["x"]},
+            "bind": "scales",
+        }],
+        "encoding": {
+            "x": x,
+            "y": {"field": "median", "type": "quantitative", "scale": y_scale},
+            "color": color,
+            "tooltip": [
+                {"field": "chemical", "type": "nominal"},
+                {"field": "species",  "type": "nominal"},
+                {"field": "time_hr",  "type": "quantitative", "title": "Time (hr)"},
+                {"field": "n_series", "type": "quantitative", "title": "Series"},
+                {"field": "median",   "type": "quantitative", "format": ".4g"},
+                {"field": "mean",     "type": "quantitative", "format": ".4g", "title": "Geo. mean"},
+                {"field": "lower",    "type": "quantitative", "format": ".4g"},
+                {"field": "upper",    "type": "quantitative", "format": ".4g"},
+            ],
+        },
+    }
+    mean = {
+        "mark": {"type": "line", "strokeDash": [2, 2], "strokeWidth": 1},
+        "encoding": {
+            "x": x,
+            "y": {"field": "mean", "type": "quantitative", "scale": y_scale},
+            "color": color,
+        },
+    }
+    return {
+        "facet":   {"field": "chemical", "type": "nominal", "title": None},
+        "columns": columns,
+        "spec":    {"width": PANEL_WIDTH, "height": PANEL_HEIGHT, "layer": [area, median, mean]},
+        "resolve": {"scale": {"x": "shared", "y": "independent"}},
+    }